@@ -0,0 +1,223 @@
+#!/usr/local/autopkg/python
+#
+# Copyright 2022 Alex Alequin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""See docstring for FreshnessProbe class"""
+
+import argparse
+import json
+import os
+import sys
+
+try:
+    from autopkglib import Processor, ProcessorError
+except ImportError:
+    # Run from the command line, outside of AutoPkg.
+    sys.path.append("/Library/AutoPkg")
+    from autopkglib import Processor, ProcessorError  # pylint: disable=import-error
+
+# AutoPkg loads processors by path, make the shared helpers importable.
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.insert(0, os.path.dirname(__file__))
+from SharedProcessorsLib.freshness import FreshnessProbe as Probe  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.locks import LockTimeout  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.recipes import (  # pylint: disable=import-error,wrong-import-position
+    RecipeError,
+    flatten_recipe,
+    select_recipes,
+)
+
+__all__ = ["FreshnessProbe"]
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def default_state_path(recipe_cache_dir=None):
+    """FreshnessProbe.json in the shared processors' cache directory"""
+    cache_root = os.path.expanduser("~/Library/AutoPkg/Cache")
+    if recipe_cache_dir:
+        cache_root = os.path.dirname(recipe_cache_dir)
+    return os.path.join(cache_root, "com.github.arequ.SharedProcessors", "FreshnessProbe.json")
+
+
+def probe_recipes(selectors, state_path, max_workers=16, timeout=15, update_state=True):
+    """
+    probes the check phase of the recipes selected by path, directory or identifier,
+    parents are looked up in this repo and the given paths
+    """
+    recipes, selected = select_recipes(selectors, REPO_ROOT)
+
+    flattened = []
+    unresolvable = []
+    for identifier in selected:
+        try:
+            flattened.append((recipes[identifier]["path"], flatten_recipe(identifier, recipes)))
+        except RecipeError as err:
+            unresolvable.append({
+                "identifier": identifier,
+                "path": recipes[identifier]["path"],
+                "needs_run": True,
+                "reason": str(err),
+                "endpoints": [],
+                "unresolved": [],
+            })
+    probe = Probe(state_path, max_workers=max_workers, timeout=timeout)
+    return probe.check(flattened, update_state=update_state) + unresolvable
+
+
+def acknowledge_recipes(identifiers, state_path):
+    """
+    records that the recipes with these identifiers ran successfully, returns the
+    endpoints whose new fingerprint is now the one compared against
+    """
+    if not os.path.exists(state_path):
+        return []
+    return Probe(state_path).acknowledge(identifiers)
+
+
+class FreshnessProbe(Processor):  # pylint: disable=too-few-public-methods
+    """
+    Probes the check phase endpoints of many recipes concurrently, with HEAD and
+    conditional requests, and reports which recipes would download something new
+    and need a full run. ETag, Last-Modified and Content-Length of every endpoint
+    are remembered in a state file, so the next probe compares against them.
+    A change keeps being reported until the recipes it was reported to are
+    acknowledged with freshness_acknowledge (or --ack) after a successful run,
+    run_recipes.py does so for the recipes it runs.
+
+    Also runs from the command line:
+    FreshnessProbe.py [--dry-run] [--json] [RECIPE, DIRECTORY or IDENTIFIER ...]
+    FreshnessProbe.py --ack IDENTIFIER ...
+    """
+
+    description = __doc__
+    input_variables = {
+        "freshness_recipes": {
+            "required": False,
+            "description": "Recipe paths, directories or identifiers to probe. Defaults "
+            "to every recipe in this repo.",
+        },
+        "freshness_state_path": {
+            "required": False,
+            "description": "JSON file the endpoint fingerprints are kept in. Defaults to "
+            "com.github.arequ.SharedProcessors/FreshnessProbe.json next to RECIPE_CACHE_DIR.",
+        },
+        "freshness_max_workers": {
+            "required": False,
+            "description": "Number of endpoints probed at once.",
+            "default": 16,
+        },
+        "freshness_timeout": {
+            "required": False,
+            "description": "Timeout in seconds of every request.",
+            "default": 15,
+        },
+        "freshness_update_state": {
+            "required": False,
+            "description": "Record the probed fingerprints as pending, they are compared "
+            "against once the recipes they were reported to are acknowledged.",
+            "default": True,
+        },
+        "freshness_acknowledge": {
+            "required": False,
+            "description": "Identifiers of recipes that ran successfully. Their pending "
+            "fingerprints are recorded instead of probing anything.",
+        },
+    }
+    output_variables = {
+        "freshness_results": {
+            "description": "Per recipe: identifier, path, needs_run, reason, the status "
+            "of every probed endpoint and the URLs that could not be resolved"
+        },
+        "freshness_stale_recipes": {
+            "description": "Identifiers of the recipes that need a full run"
+        },
+    }
+
+    def main(self):
+        """gimme some main"""
+        state_path = self.env.get("freshness_state_path") or default_state_path(
+            self.env.get("RECIPE_CACHE_DIR")
+        )
+        if self.env.get("freshness_acknowledge"):
+            try:
+                updated = acknowledge_recipes(self.env["freshness_acknowledge"], state_path)
+            except LockTimeout as err:
+                raise ProcessorError(str(err)) from err
+            self.output(f"Recorded the new fingerprint of {len(updated)} endpoints.")
+            self.env["freshness_results"] = []
+            self.env["freshness_stale_recipes"] = []
+            return
+        try:
+            results = probe_recipes(
+                self.env.get("freshness_recipes"),
+                state_path,
+                max_workers=int(self.env.get("freshness_max_workers", 16)),
+                timeout=float(self.env.get("freshness_timeout", 15)),
+                update_state=str(self.env.get("freshness_update_state", True)).lower()
+                not in ("0", "false", "no"),
+            )
+        except (RecipeError, LockTimeout) as err:
+            raise ProcessorError(str(err)) from err
+        self.env["freshness_results"] = results
+        self.env["freshness_stale_recipes"] = [
+            result["identifier"] for result in results if result["needs_run"]
+        ]
+        for result in results:
+            if result["needs_run"]:
+                self.output(f"{result['identifier']}: {result['reason']}")
+        self.output(
+            f"{len(self.env['freshness_stale_recipes'])} of {len(results)} recipes need a run."
+        )
+
+
+def cli(argv):
+    """command line entry point, prints the recipes that need a run"""
+    parser = argparse.ArgumentParser(description=FreshnessProbe.__doc__.strip().splitlines()[0])
+    parser.add_argument("recipes", nargs="*", help="recipe paths, directories or identifiers")
+    parser.add_argument("--state", default=default_state_path(), help="fingerprint state file")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent probes")
+    parser.add_argument("--timeout", type=float, default=15, help="request timeout in seconds")
+    parser.add_argument("--dry-run", action="store_true", help="don't update the state file")
+    parser.add_argument("--json", action="store_true", help="print the full results as JSON")
+    parser.add_argument("--ack", action="store_true",
+                        help="record that the given recipe identifiers ran successfully")
+    args = parser.parse_args(argv)
+    if args.ack:
+        if not args.recipes:
+            parser.error("--ack needs the identifiers of the recipes that ran")
+        for key in acknowledge_recipes(args.recipes, args.state):
+            print(f"updated\t{key}")
+        return 0
+    try:
+        results = probe_recipes(
+            args.recipes, args.state, args.workers, args.timeout, not args.dry_run
+        )
+    except RecipeError as err:
+        parser.error(str(err))
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return 0
+    for result in results:
+        if result["needs_run"]:
+            print(f"{result['identifier']}\t{result['reason']}")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
+    PROCESSOR = FreshnessProbe()
+    PROCESSOR.execute_shell()
@@ -23,15 +23,37 @@ Gets the download URL of latest version of macOS Installer App from Apple's CDN
 This script makes a lot of assumptions and can break.
 """
 
+import base64
 import certifi
+import datetime
+import gzip
+import hashlib
+import http.client
+import json
+import os
 import plistlib
+import re
+import resource
 import ssl
+import sys
+import threading
+import time
+import urllib.error
 import urllib.request
-from xml.dom import minidom
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from urllib.parse import unquote, urljoin, urlsplit
+from xml.etree import ElementTree
 from xml.parsers.expat import ExpatError
 
 from autopkglib import Processor, ProcessorError
 
+# AutoPkg loads processors by path, make the shared helpers importable.
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.insert(0, os.path.dirname(__file__))
+from SharedProcessorsLib import trace  # pylint: disable=import-error,wrong-import-position
+
 ca_bundle = certifi.where()
 opener = urllib.request.build_opener(
     urllib.request.HTTPSHandler(
@@ -40,20 +62,146 @@ opener = urllib.request.build_opener(
 )
 urllib.request.install_opener(opener)
 
+
+class KeepAliveFetcher:
+    """
+    Thread-safe HTTP(S) GET helper that keeps one persistent connection per
+    (thread, host) so that repeated requests to the same CDN reuse the socket
+    instead of paying for a new TCP + TLS handshake every time. Proxies are
+    taken from the environment like urlopen does, HTTPS is tunnelled with
+    CONNECT.
+    """
+
+    max_redirects = 5
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.context = ssl.create_default_context(cafile=ca_bundle)
+        self._local = threading.local()
+        self._all_connections = []
+        self._lock = threading.Lock()
+        self.proxies = urllib.request.getproxies()
+
+    def _proxy(self, scheme, netloc):
+        """
+        The proxy to use for a host
+
+        :param scheme: http or https
+        :param netloc: host and port of the URL
+        :return: the proxy URL split, or None to connect directly
+        """
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.request.proxy_bypass(netloc):
+            return None
+        if "://" not in proxy:
+            proxy = f"http://{proxy}"
+        return urlsplit(proxy)
+
+    @staticmethod
+    def _proxy_headers(proxy):
+        if proxy.username is None:
+            return {}
+        credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}"
+        return {
+            "Proxy-Authorization": "Basic "
+            + base64.b64encode(credentials.encode()).decode("ascii")
+        }
+
+    def _connection(self, scheme, netloc):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            proxy = self._proxy(scheme, netloc)
+            host = f"{proxy.hostname}:{proxy.port or 80}" if proxy else netloc
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(
+                    host, timeout=self.timeout, context=self.context
+                )
+                if proxy:
+                    conn.set_tunnel(netloc, headers=self._proxy_headers(proxy))
+            else:
+                conn = http.client.HTTPConnection(host, timeout=self.timeout)
+            connections[(scheme, netloc)] = conn
+            with self._lock:
+                self._all_connections.append(conn)
+        return conn
+
+    def _drop(self, scheme, netloc):
+        conn = self._local.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def get(self, url):
+        """
+        Fetch the given URL, following redirects
+
+        :param url: http or https URL to fetch
+        :return: response body as bytes
+        """
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path = f"{path}?{parts.query}"
+            headers = {}
+            proxy = self._proxy(parts.scheme, parts.netloc)
+            if proxy and parts.scheme == "http":
+                # A plain HTTP proxy gets the absolute URL.
+                path = f"http://{parts.netloc}{path}"
+                headers = self._proxy_headers(proxy)
+            # A kept-alive socket may have been closed by the server since the
+            # last request, so retry once on a fresh connection.
+            for attempt in range(2):
+                conn = self._connection(parts.scheme, parts.netloc)
+                try:
+                    conn.request("GET", path, headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    break
+                except (http.client.HTTPException, OSError):
+                    self._drop(parts.scheme, parts.netloc)
+                    if attempt:
+                        raise
+            if response.will_close:
+                self._drop(parts.scheme, parts.netloc)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader("Location", ""))
+                continue
+            if response.status != 200:
+                raise urllib.error.HTTPError(
+                    url, response.status, response.reason, response.headers, None
+                )
+            return body
+        raise urllib.error.URLError(f"Too many redirects for {url}")
+
+    def close(self):
+        """Close every connection opened by any thread"""
+        with self._lock:
+            for conn in self._all_connections:
+                conn.close()
+            self._all_connections = []
+
+
 class GetInstallmacOSMetadata(Processor):
     """
     Processor to get the download URL of the latest version of macOS Installer App from Apple's CDN
     """
 
     description = __doc__
+    product_index_path = None
     input_variables = {
         "MACOS_VERSION": {
             "required": False,
-            "description": "TODO: not implemented yet. Passed if you want to get the URL for a specific macOS version.",
+            "description": "Passed if you want to get the URL for a specific macOS version. A major "
+            "version (e.g. 13, or 10.15 before Big Sur) selects the most recently posted release "
+            "of it, a full version (e.g. 13.6.1 or 10.15.7) must match exactly. Defaults to the "
+            "highest available version.",
         },
         "MACOS_BUILD": {
             "required": False,
-            "description": "TODO: not implemented yet. Passed if you want to get the URL for a specific macOS build.",
+            "description": "Passed if you want to get the URL for a specific macOS build, e.g. 22G313.",
         },
         "SUCATALOG_URL": {
             "required": False,
@@ -61,6 +209,47 @@ class GetInstallmacOSMetadata(Processor):
             "default": "https://swscan.apple.com/content/catalogs/others/index-10.16-10.15-10.14-10.13-10.12-10.11-10.10-10.9"
             "-mountainlion-lion-snowleopard-leopard.merged-1.sucatalog",
         },
+        "SUCATALOG_CACHE_DIR": {
+            "required": False,
+            "description": "Directory used to cache the catalog and the metadata of its "
+            "products between runs. Defaults to "
+            "com.github.arequ.SharedProcessors/sucatalog next to RECIPE_CACHE_DIR. "
+            "Set to an empty string to disable caching.",
+        },
+        "SUCATALOG_CACHE_MAX_AGE": {
+            "required": False,
+            "description": "Seconds a cached catalog is trusted without asking the server "
+            "whether it changed. 0 always revalidates with a conditional request.",
+            "default": 0,
+        },
+        "SUCATALOG_CACHE_MAX_ENTRIES": {
+            "required": False,
+            "description": "Number of cached catalogs (one per SUCATALOG_URL) to keep. "
+            "Least recently used catalogs are evicted first.",
+            "default": 4,
+        },
+        "SUCATALOG_STREAMING": {
+            "required": False,
+            "description": "Parse the catalog incrementally, only keeping products with an "
+            "InstallAssistant package in memory. Set to False to load it with plistlib.",
+            "default": True,
+        },
+        "DIST_FETCH_WORKERS": {
+            "required": False,
+            "description": "Number of .dist files to download concurrently.",
+            "default": 8,
+        },
+        "DIST_FETCH_TIMEOUT": {
+            "required": False,
+            "description": "Timeout in seconds for each .dist download.",
+            "default": 30,
+        },
+        "trace_path": {
+            "required": False,
+            "description": "File to append timing spans of the catalog download, cache "
+            "and .dist fetch stages to, JSON lines for a .jsonl path and Chrome trace "
+            "events otherwise. Tracing is off when empty.",
+        },
     }
     output_variables = {
         "url": {
@@ -79,24 +268,309 @@ class GetInstallmacOSMetadata(Processor):
             "description": "build",
             "required": True,
         },
+        "size": {
+            "description": "Size in bytes of the package at url, as published in the catalog",
+            "required": True,
+        },
+        "digest": {
+            "description": "SHA-1 of the package at url as published in the catalog, "
+            "empty if the catalog has none",
+            "required": True,
+        },
     }
 
-    def get_remote_plist(self, url):
+    def get_remote_catalog(self, url, headers=None):
+        """
+        Helper function to download the software update catalog from the given URL
+
+        :param url: URL to download the catalog from
+        :param headers: optional extra request headers, e.g. conditional GET validators
+        :return: tuple of (digested catalog, see digest_catalog, response headers).
+            The catalog is None if the server answered 304 Not Modified,
+            both are None if the download failed.
+        :raises ProcessorError: if the catalog is truncated or malformed
+        """
+        streaming = str(self.env.get("SUCATALOG_STREAMING", True)).lower() not in (
+            "0", "false", "no",
+        )
+        request = urllib.request.Request(url, headers=dict(headers or {}))
+        request.add_header("Accept-Encoding", "gzip")
+        with trace.span("catalog.download", streaming=streaming) as stage:
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response_headers = response.headers
+                    # Counts the bytes on the wire, before decompression.
+                    stream = trace.counted(response)
+                    if response_headers.get("Content-Encoding", "").lower() == "gzip":
+                        stream = gzip.GzipFile(fileobj=stream)
+                    if streaming:
+                        catalog = self.parse_catalog_stream(stream)
+                    else:
+                        catalog = self.digest_catalog(plistlib.loads(stream.read()))
+                    stage.set(status=response.status, products=len(catalog["Products"]))
+            except urllib.error.HTTPError as e:
+                stage.set(status=e.code)
+                if e.code == 304:
+                    return None, e.headers
+                print(f"Error downloading plist from URL {url}: {e}")
+                return None, None
+            except (
+                EOFError,
+                gzip.BadGzipFile,
+                zlib.error,
+                ExpatError,
+                ElementTree.ParseError,
+                ValueError,
+                KeyError,
+                TypeError,
+            ) as e:
+                stage.set(error=type(e).__name__)
+                raise ProcessorError(f"Invalid catalog from URL {url}: {e!r}") from e
+            except OSError as e:
+                stage.set(error=type(e).__name__)
+                print(f"Error downloading plist from URL {url}: {e}")
+                return None, None
+        self.output(
+            f"Parsed catalog ({'streaming' if streaming else 'plistlib'}), "
+            f"{len(catalog['Products'])} installer products, "
+            f"peak RSS {self.peak_rss() / 1048576:.1f} MiB",
+            2,
+        )
+        return catalog, response_headers
+
+    def peak_rss(self):
+        """
+        Helper function to report the peak resident set size of this process
+
+        :return: peak RSS in bytes
+        """
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes.
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def plist_value(self, element):
+        """
+        Helper function to convert a plist XML element to its Python value
+
+        :param element: ElementTree element of a plist value
+        :return: Python representation, as plistlib would return it
+        """
+        tag = element.tag
+        if tag == "dict":
+            children = list(element)
+            return {
+                key.text or "": self.plist_value(value)
+                for key, value in zip(children[::2], children[1::2])
+            }
+        if tag == "array":
+            return [self.plist_value(child) for child in element]
+        if tag == "string":
+            return element.text or ""
+        if tag == "integer":
+            return int(element.text)
+        if tag == "real":
+            return float(element.text)
+        if tag in ("true", "false"):
+            return tag == "true"
+        if tag == "date":
+            return datetime.datetime.strptime(element.text, "%Y-%m-%dT%H:%M:%SZ")
+        if tag == "data":
+            return base64.b64decode(element.text or "")
+        raise ElementTree.ParseError(f"Unknown plist element <{tag}>")
+
+    def element_has_install_assistant_pkg(self, element):
+        """
+        Helper function to check a product's plist element for InstallAssistant packages
+        without converting the whole product
+
+        :param element: ElementTree element of the product dict
+        :return: True if the product lists InstallAssistantPackageIdentifiers
+        """
+        children = list(element)
+        for key, value in zip(children[::2], children[1::2]):
+            if key.text == "ExtendedMetaInfo" and value.tag == "dict":
+                return any(
+                    child.tag == "key" and child.text == "InstallAssistantPackageIdentifiers"
+                    for child in value
+                )
+        return False
+
+    def parse_catalog_stream(self, stream):
+        """
+        Helper function to parse the catalog incrementally. Product elements are
+        discarded as soon as they have been read and only products with an
+        InstallAssistant package are converted to Python objects.
+
+        :param stream: file-like object with the catalog's XML plist data
+        :return: digested catalog dictionary, see digest_catalog
+        """
+        products = {}
+        depth = 0
+        top_key = None
+        product_key = None
+        products_element = None
+        for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                # depth 1 is <plist>, 2 the root dict, 3 its keys and values.
+                if depth == 3 and top_key == "Products" and element.tag == "dict":
+                    products_element = element
+                continue
+            if depth == 3:
+                if element.tag == "key":
+                    top_key = element.text
+                else:
+                    products_element = None
+                    element.clear()
+            elif depth == 4 and products_element is not None:
+                if element.tag == "key":
+                    product_key = element.text
+                else:
+                    if self.element_has_install_assistant_pkg(element):
+                        products[product_key] = self.plist_value(element)
+                    products_element.clear()
+            depth -= 1
+        return self.digest_catalog({"Products": products})
+
+    def digest_catalog(self, catalog):
+        """
+        Helper function to reduce the catalog to the products this processor cares about
+
+        :param catalog: full catalog dictionary
+        :return: catalog dictionary only holding products with a single InstallAssistant.pkg
+        """
+        products = {}
+        for product_key, product in catalog["Products"].items():
+            if not self.has_install_assistant_pkg(product):
+                continue
+            packages = self.find_install_assistant_pkg(product)
+            if len(packages) != 1:
+                continue
+            products[product_key] = {
+                "ExtendedMetaInfo": product["ExtendedMetaInfo"],
+                "Packages": packages,
+                "Distributions": product["Distributions"],
+            }
+            if "PostDate" in product:
+                products[product_key]["PostDate"] = product["PostDate"]
+        return {"Products": products}
+
+    def catalog_cache_dir(self):
+        """
+        Helper function to find the catalog cache directory
+
+        :return: path to the cache directory, None if caching is disabled
+        """
+        if "SUCATALOG_CACHE_DIR" in self.env:
+            return self.env["SUCATALOG_CACHE_DIR"] or None
+        cache_root = os.path.expanduser("~/Library/AutoPkg/Cache")
+        if self.env.get("RECIPE_CACHE_DIR"):
+            cache_root = os.path.dirname(self.env["RECIPE_CACHE_DIR"])
+        return os.path.join(cache_root, "com.github.arequ.SharedProcessors", "sucatalog")
+
+    def write_catalog_cache(self, cache_path, entry):
+        """
+        Helper function to atomically write a catalog cache entry
+
+        :param cache_path: path of the cache file
+        :param entry: dictionary holding the validators and the digested catalog
+        """
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            plistlib.dump(entry, f, fmt=plistlib.FMT_BINARY)
+        os.replace(tmp_path, cache_path)
+
+    def evict_catalog_cache(self, cache_dir):
         """
-        Helper function to download the remote plist from the given URL
+        Helper function to remove the least recently used cached catalogs
 
-        :param url: URL to download the plist from
-        :return: dictionary representation of the plist data
+        :param cache_dir: path to the cache directory
         """
+        max_entries = max(1, int(self.env.get("SUCATALOG_CACHE_MAX_ENTRIES", 4)))
+        entries = [
+            os.path.join(cache_dir, name)
+            for name in os.listdir(cache_dir)
+            if name.endswith(".plist")
+        ]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[max_entries:]:
+            self.remove_catalog_cache(path)
+
+    def remove_catalog_cache(self, path):
+        """
+        Helper function to remove a cached catalog and its product index
+
+        :param path: path of the cached catalog plist
+        """
+        for cache_file in (path, f"{path[:-len('.plist')]}.products.json"):
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+
+    def get_catalog(self, url):
+        """
+        Helper function to get the digested catalog, served from the on-disk cache when
+        the server reports that the catalog has not changed
+
+        :param url: URL of the software update catalog
+        :return: digested catalog dictionary, see digest_catalog
+        """
+        cache_dir = self.catalog_cache_dir()
+        if not cache_dir:
+            catalog, _ = self.get_remote_catalog(url)
+            if catalog is None:
+                raise ProcessorError(f"Unable to download catalog from {url}")
+            return catalog
+
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_name = hashlib.sha256(url.encode()).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f"{cache_name}.plist")
+        self.product_index_path = os.path.join(cache_dir, f"{cache_name}.products.json")
+        cached = None
+        with trace.span("catalog.cache_read") as stage:
+            try:
+                with open(cache_path, "rb") as f:
+                    stage.add(bytes=os.fstat(f.fileno()).st_size)
+                    cached = plistlib.load(f)
+            except (OSError, plistlib.InvalidFileException):
+                pass
+            stage.set(hit=cached is not None)
+
+        # The cache file's mtime is the last time the server confirmed its content.
+        max_age = float(self.env.get("SUCATALOG_CACHE_MAX_AGE", 0))
+        if cached and time.time() - os.path.getmtime(cache_path) < max_age:
+            self.output("Using cached catalog, SUCATALOG_CACHE_MAX_AGE not reached", 2)
+            return cached["catalog"]
+
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
         try:
-            context = ssl.create_default_context()
-            with urllib.request.urlopen(url, timeout=30) as response:
-                plist_data = response.read()
-        except urllib.error.URLError as e:
-            print(f"Error downloading plist from URL {url}: {e}")
-            return None
-        plist_data_dict = plistlib.loads(plist_data)
-        return plist_data_dict if plist_data_dict else plist_data
+            catalog, response_headers = self.get_remote_catalog(url, headers)
+        except ProcessorError:
+            # Without the cached copy and its ETag, the next run fetches the whole catalog.
+            self.remove_catalog_cache(cache_path)
+            raise
+        if response_headers is None:
+            if not cached:
+                raise ProcessorError(f"Unable to download catalog from {url}")
+            self.output("WARNING: Catalog download failed, using cached catalog")
+            return cached["catalog"]
+        if catalog is None:
+            self.output("Catalog has not changed, using cached catalog", 2)
+            os.utime(cache_path)
+            return cached["catalog"]
+
+        entry = {"url": url, "catalog": catalog}
+        if response_headers.get("ETag"):
+            entry["etag"] = response_headers["ETag"]
+        if response_headers.get("Last-Modified"):
+            entry["last_modified"] = response_headers["Last-Modified"]
+        with trace.span("catalog.cache_write"):
+            self.write_catalog_cache(cache_path, entry)
+            self.evict_catalog_cache(cache_dir)
+        return catalog
 
     def has_install_assistant_pkg(self, product):
         """
@@ -132,64 +606,266 @@ class GetInstallmacOSMetadata(Processor):
         :return: tuple of metadata (title, build, version)
         """
         dist_url = product["Distributions"].get("English")
+        # Runs on the fetch workers, every .dist is a span of its own on its thread.
+        with trace.span("dist.fetch", url=dist_url) as stage:
+            try:
+                dist_data = self.fetcher.get(dist_url)
+            except (http.client.HTTPException, OSError) as e:
+                stage.set(error=type(e).__name__)
+                print(f"Error downloading .dist from URL {dist_url}: {e}")
+                return None, None, None
+            stage.add(bytes=len(dist_data))
+
         try:
-            context = ssl.create_default_context()
-            with urllib.request.urlopen(dist_url, timeout=30) as response:
-                dist_data = response.read().decode()
-        except urllib.error.URLError as e:
-            print(f"Error downloading .dist from URL {dist_url}: {e}")
+            return self.parse_dist(dist_data)
+        except (ElementTree.ParseError, ValueError) as e:
+            print(f"Error parsing .dist from URL {dist_url}:", e)
             return None, None, None
 
+    def parse_dist(self, dist_data, chunk_size=4096):
+        """
+        Helper function to pull the metadata out of a .dist file with a streaming parser,
+        parsing stops as soon as the first <title> and the first two <string> elements
+        have been seen
+
+        :param dist_data: raw bytes of the .dist file
+        :param chunk_size: number of bytes fed to the parser at a time
+        :return: tuple of metadata (title, build, version)
+        """
+        parser = ElementTree.XMLPullParser(events=("end",))
+        title = None
+        strings = []
+        for offset in range(0, len(dist_data), chunk_size):
+            parser.feed(dist_data[offset:offset + chunk_size])
+            for _, element in parser.read_events():
+                if element.tag == "title" and title is None:
+                    title = element.text
+                elif element.tag == "string" and len(strings) < 2:
+                    strings.append(element.text)
+            if title is not None and len(strings) == 2:
+                break
+        if title is None or len(strings) < 2 or None in strings:
+            raise ValueError("title, build or version missing")
+        return title, strings[0], strings[1]
+
+    def load_product_index(self):
+        """
+        Helper function to load the persistent product metadata index
+
+        :return: dictionary of product key to cached metadata
+        """
+        if not self.product_index_path:
+            return {}
         try:
-            xmldoc = minidom.parseString(dist_data)
-            title = xmldoc.getElementsByTagName("title")[0].firstChild.nodeValue
-            build = xmldoc.getElementsByTagName("string")[0].firstChild.nodeValue
-            version = xmldoc.getElementsByTagName("string")[1].firstChild.nodeValue
-        except ExpatError as e:
-            print("Error parsing XML:", e)
-            return None, None, None
-        return title, build, version
+            with open(self.product_index_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_product_index(self, index):
+        """
+        Helper function to atomically write the persistent product metadata index
+
+        :param index: dictionary of product key to cached metadata
+        """
+        if not self.product_index_path:
+            return
+        tmp_path = f"{self.product_index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp_path, self.product_index_path)
+
+    def index_metadata(self, index, product_key, product, metadata):
+        """
+        Helper function to record the metadata of a product in the product index
+
+        :param index: dictionary of product key to cached metadata
+        :param product_key: key of the product in the catalog
+        :param product: product dictionary
+        :param metadata: tuple of metadata (title, build, version), all None on failure
+        """
+        (title, build, version) = metadata
+        if version is None:
+            index.pop(product_key, None)
+            return
+        index[product_key] = {
+            "dist_url": product["Distributions"].get("English"),
+            "title": title,
+            "build": build,
+            "version": version,
+        }
+        if "PostDate" in product:
+            index[product_key]["post_date"] = product["PostDate"].isoformat()
+
+    def iter_metadata(self, products, batch_size=None):
+        """
+        Generator resolving the metadata of the given products in order. Products already
+        in the product index are answered from it, the others are fetched concurrently in
+        batches so that a consumer which stops early only pays for the .dist files it saw.
+
+        :param products: list of (product key, product dictionary) tuples
+        :param batch_size: maximum number of .dist files fetched at once. The first batch
+            fetches a single file and each following batch doubles up to this size.
+            Defaults to DIST_FETCH_WORKERS.
+        :return: generator of (product key, product, (title, build, version)) tuples,
+            products whose metadata could not be retrieved are skipped
+        """
+        workers = max(1, int(self.env.get("DIST_FETCH_WORKERS", 8)))
+        batch_size = batch_size or workers
+        # Products that left the catalog will never be asked for again.
+        product_keys = {key for key, _ in products}
+        index = {
+            key: entry
+            for key, entry in self.load_product_index().items()
+            if key in product_keys
+        }
+
+        def is_indexed(key, product):
+            return index.get(key, {}).get("dist_url") == product["Distributions"].get(
+                "English"
+            )
+
+        self.fetcher = KeepAliveFetcher(
+            timeout=float(self.env.get("DIST_FETCH_TIMEOUT", 30))
+        )
+        executor = ThreadPoolExecutor(max_workers=workers)
+        fetched = 0
+        limit = 1
+        position = 0
+        try:
+            while position < len(products):
+                key, product = products[position]
+                if is_indexed(key, product):
+                    position += 1
+                    entry = index[key]
+                    yield key, product, (entry["title"], entry["build"], entry["version"])
+                    continue
+                batch = []
+                pending = {}
+                while position < len(products) and len(pending) < limit:
+                    key, product = products[position]
+                    position += 1
+                    batch.append((key, product))
+                    if not is_indexed(key, product):
+                        pending[key] = executor.submit(self.get_metadata, product)
+                fetched += len(pending)
+                limit = min(limit * 2, batch_size)
+                for key, product in batch:
+                    if key in pending:
+                        self.index_metadata(index, key, product, pending[key].result())
+                for key, product in batch:
+                    entry = index.get(key)
+                    if entry:
+                        yield key, product, (entry["title"], entry["build"], entry["version"])
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.fetcher.close()
+            self.save_product_index(index)
+            trace.add(dist_fetched=fetched)
+            self.output(f"Fetched {fetched} .dist files, {len(index)} products indexed", 2)
+
+    def get_candidates(self, catalog):
+        """
+        Helper function to list the installer products of the catalog, newest first
+
+        :param catalog: digested catalog dictionary, see digest_catalog
+        :return: list of (product key, product dictionary) tuples sorted by PostDate
+        """
+        return sorted(
+            catalog["Products"].items(),
+            key=lambda item: item[1].get("PostDate", datetime.datetime.min),
+            reverse=True,
+        )
+
+    def version_key(self, version):
+        """
+        Helper function to turn a version string into a numerically sortable key
+
+        :param version: version string, e.g. "14.1"
+        :return: tuple of integers without trailing zeros, e.g. (14, 1)
+        """
+        key = [int(part) for part in re.findall(r"\d+", str(version))]
+        while len(key) > 1 and key[-1] == 0:
+            key.pop()
+        return tuple(key)
+
+    def installer_matches(self, version, build, wanted_version=None, wanted_build=None):
+        """
+        Helper function to check an installer against MACOS_VERSION and MACOS_BUILD.
+        A major version alone (e.g. 13, or 10.15 as macOS 10 releases are 10.x) matches
+        any release of that major version, anything longer (e.g. 13.6 or 10.15.7) must
+        match exactly.
+
+        :param version: version of the installer
+        :param build: build of the installer
+        :param wanted_version: requested version, None matches any version
+        :param wanted_build: requested build, None matches any build
+        :return: True if the installer matches, False otherwise
+        """
+        if wanted_build and str(build).lower() != str(wanted_build).lower():
+            return False
+        if wanted_version:
+            wanted = self.version_key(wanted_version)
+            components = len(str(wanted_version).split("."))
+            if components <= (2 if wanted[:1] == (10,) else 1):
+                return self.version_key(version)[:components] == wanted[:components]
+            return self.version_key(version) == wanted
+        return True
+
+    def find_macos_installer(self, catalog, wanted_version=None, wanted_build=None):
+        """
+        Helper function to find the most recently posted installer matching the given
+        version and/or build, .dist files are only fetched until a match is found
+
+        :param catalog: digested catalog dictionary, see digest_catalog
+        :param wanted_version: requested version, None matches any version
+        :param wanted_build: requested build, None matches any build
+        :return: product dictionary with title, build and version, None if nothing matches
+        """
+        with closing(self.iter_metadata(self.get_candidates(catalog))) as metadata:
+            for _, product, (title, build, version) in metadata:
+                if self.installer_matches(version, build, wanted_version, wanted_build):
+                    return dict(product, title=title, build=build, version=version)
+        return None
 
     def get_macos_installers(self, catalog):
         """
         Helper function to get the macOS installers from the given catalog
 
-        :param catalog: catalog dictionary to get the macOS installers from
-        :return: dictionary of macOS installers
-        """
-        for product_key in list(catalog["Products"].keys()):
-            product = catalog["Products"][product_key]
-            if self.has_install_assistant_pkg(product):
-                catalog["Products"][product_key][
-                    "Packages"
-                ] = self.find_install_assistant_pkg(product)
-                if len(catalog["Products"][product_key]["Packages"]) == 1:
-                    catalog[product_key] = catalog["Products"][product_key]
-                    (title, build, version) = self.get_metadata(catalog[product_key])
-                    catalog[product_key]["title"] = title
-                    catalog[product_key]["build"] = build
-                    catalog[product_key]["version"] = version
-        keys_to_delete = ["CatalogVersion", "ApplePostURL", "IndexDate", "Products"]
-        for key in keys_to_delete:
-            del catalog[key]
-        return catalog
+        :param catalog: digested catalog dictionary, see digest_catalog
+        :return: dictionary of macOS installers, newest PostDate first
+        """
+        installers = {}
+        with closing(self.iter_metadata(self.get_candidates(catalog))) as metadata:
+            for product_key, product, (title, build, version) in metadata:
+                installers[product_key] = dict(
+                    product, title=title, build=build, version=version
+                )
+        return installers
 
     def main(self):
         """
         Main function to run the processor
         """
-        catalog = self.get_remote_plist(self.env["SUCATALOG_URL"])
-        macos_installers = self.get_macos_installers(catalog)
-        sorted_installers = {
-            k: v
-            for k, v in sorted(
-                macos_installers.items(),
-                key=lambda item: item[1]["version"],
-                reverse=True,
-            )
-        }
-        latest = next(iter(sorted_installers.values()))
-        self.env["display_name"] = latest["title"]
-        self.env["version"] = latest["version"]
-        self.env["build"] = latest["build"]
-        self.env["url"] = latest["Packages"][0]["URL"]
+        with trace.tracing(self.env.get("trace_path"), "GetInstallmacOSMetadata"):
+            with trace.span("catalog"):
+                catalog = self.get_catalog(self.env["SUCATALOG_URL"])
+            wanted_version = self.env.get("MACOS_VERSION")
+            wanted_build = self.env.get("MACOS_BUILD")
+            # Spans the product index and the .dist fetches.
+            with trace.span("installers.resolve"):
+                # Unpinned, the most recently posted installer is the latest one.
+                installer = self.find_macos_installer(catalog, wanted_version, wanted_build)
+            if not installer:
+                if wanted_version or wanted_build:
+                    raise ProcessorError(
+                        f"No macOS installer found matching version {wanted_version} "
+                        f"and build {wanted_build}."
+                    )
+                raise ProcessorError("No macOS installer metadata could be retrieved.")
+        self.env["display_name"] = installer["title"]
+        self.env["version"] = installer["version"]
+        self.env["build"] = installer["build"]
+        self.env["url"] = installer["Packages"][0]["URL"]
+        self.env["size"] = installer["Packages"][0].get("Size", "")
+        self.env["digest"] = installer["Packages"][0].get("Digest", "")
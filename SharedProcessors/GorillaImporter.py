@@ -14,16 +14,71 @@
 # limitations under the License.
 """See docstring for GorillaImporter class"""
 
+from contextlib import contextmanager
+import copy
+import glob
 import os
 import pathlib
 import subprocess
 import shutil
+import sys
+import time
 from ruamel.yaml import YAML
 
 from autopkglib import Processor, ProcessorError
 
+# AutoPkg loads processors by path, make the shared helpers importable.
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.insert(0, os.path.dirname(__file__))
+from SharedProcessorsLib import trace  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.digests import file_digests  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.gorillaindex import HashIndex  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.inputs import input_flag  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.locks import (  # pylint: disable=import-error,wrong-import-position
+    LockTimeout,
+    file_lock,
+)
+from SharedProcessorsLib.pkgstore import (  # pylint: disable=import-error,wrong-import-position
+    add_to_store,
+    blob_path,
+    clone_file,
+    link_into_place,
+)
+from SharedProcessorsLib.yamlpatch import (  # pylint: disable=import-error,wrong-import-position
+    AmbiguousYAML,
+    TopLevelMapping,
+)
+
 __all__ = ["GorillaImporter"]
 
+# Per-package keys, read from the env for a single import or from each gorilla_packages item.
+PACKAGE_KEYS = (
+    "pathname",
+    "pkg_shortname",
+    "pkg_version",
+    "pkg_display_name",
+    "pkg_file_extension",
+    "gorilla_subdirectories",
+    "pkg_installer_arguments",
+    "pkg_uninstaller_arguments",
+    "yaml_entry",
+    "gorilla_promote_from",
+)
+PACKAGE_REQUIRED_KEYS = (
+    "pathname",
+    "pkg_shortname",
+    "pkg_version",
+    "pkg_file_extension",
+    "gorilla_subdirectories",
+)
+# Keys a gorilla_packages item inherits from the env when it doesn't set them.
+PACKAGE_DEFAULT_KEYS = (
+    "gorilla_subdirectories",
+    "pkg_installer_arguments",
+    "pkg_uninstaller_arguments",
+    "gorilla_promote_from",
+)
+
 class GorillaImporter(Processor):
     """Imports a pkg or dmg to the Munki repo."""
     input_variables = {
@@ -36,16 +91,68 @@ class GorillaImporter(Processor):
             "required": True,
         },
         "gorilla_subdirectories": {
-            "required": True,
-            "description": "Path to pkg: nupkg, msi, exe, ps1 relative to URL",
+            "required": False,
+            "description": "Path to pkg: nupkg, msi, exe, ps1 relative to URL. "
+            "Required unless every gorilla_packages item sets it.",
+        },
+        "gorilla_packages": {
+            "required": False,
+            "description": "List of packages to import in one catalog write, each a dict "
+            "with pathname, pkg_shortname, pkg_version, pkg_file_extension and optionally "
+            "pkg_display_name, gorilla_subdirectories, pkg_installer_arguments, "
+            "pkg_uninstaller_arguments and yaml_entry. Replaces the single package inputs.",
+        },
+        "gorilla_catalog_backups": {
+            "required": False,
+            "description": "Number of timestamped catalog backups "
+            "(<catalog>.yaml.<timestamp>.bak) to keep, 0 disables backups.",
+            "default": 5,
+        },
+        "gorilla_pkg_store": {
+            "required": False,
+            "description": "Content-addressed store the pkgs are kept in, the paths under "
+            "pkgs/ are hardlinks into it. Defaults to pkgs/.store in gorilla_repo, set to "
+            "an empty string to copy straight into pkgs/ instead.",
+        },
+        "gorilla_hash_index": {
+            "required": False,
+            "description": "JSON sidecar indexing the installer sha256 of every catalog "
+            "in the repo. A payload already in the repo is not copied again. Defaults to "
+            ".gorilla_hash_index.json in gorilla_repo, set to an empty string to disable.",
+        },
+        "gorilla_promote_from": {
+            "required": False,
+            "description": "Catalog to promote pkg_shortname from, e.g. alpha_test. Its "
+            "entry is copied into gorilla_catalog as is, nothing is downloaded, copied or "
+            "hashed. pathname, pkg_version and pkg_file_extension are not needed, a given "
+            "pkg_version must match the promoted entry.",
+        },
+        "gorilla_catalog_patching": {
+            "required": False,
+            "description": "Only parse and re-serialize the catalog entries being "
+            "imported, the rest of the file is kept byte for byte. Catalogs the fast "
+            "path can't handle unambiguously are always fully round-tripped.",
+            "default": True,
+        },
+        "gorilla_lock_timeout": {
+            "required": False,
+            "description": "Seconds to wait for another import into the same catalog "
+            "to finish before giving up.",
+            "default": 300,
+        },
+        "trace_path": {
+            "required": False,
+            "description": "File to append timing spans of the lock, catalog, hash "
+            "index and copy stages to, JSON lines for a .jsonl path and Chrome trace "
+            "events otherwise. Tracing is off when empty.",
         },
         "pkg_shortname": {
-            "required": True,
+            "required": False,
             "description": "CASE SENSITIVEThe pkg shortname,\
                          corresponds to the primary key in the pkg hashes"
         },
         "pkg_version": {
-            "required": True,
+            "required": False,
             "description": "Float64 value of importing version."
         },
         "pkg_display_name": {
@@ -77,110 +184,451 @@ class GorillaImporter(Processor):
         "pkg_repo_path": {
             "description": (
                 "The repo path where the pkg was written. "
-                "Empty if item not imported."
+                "Empty if item not imported or for gorilla_packages."
             )
         },
-        "gorilla_repo_changed": {"description": "True if item was imported."},
+        "gorilla_repo_changed": {"description": "True if any item was imported."},
+        "gorilla_importer_results": {
+            "description": "List of pkg_shortname, pkg_version, pkg_repo_path and "
+            "changed per imported package."
+        },
         "gorilla_importer_summary_result": {
-            "description": "Description of interesting results."
+            "description": "pkg_shortname, pkg_version, pkg_repo_path, catalogs and "
+            "status (imported, promoted or unchanged) of every package for the AutoPkg "
+            "report. Not set when nothing was imported."
         },
     }
     description = __doc__
 
-    def yaml_to_dict(self):
-        """takes yaml and turns it into a dict"""
+    def yaml_to_dict(self, yaml_file=None):
+        """takes yaml and turns it into a dict, or a TopLevelMapping patched entry by entry"""
         self.yaml = YAML()
         self.yaml.default_flow_stye=False
-        with open(self.yaml_file, "r") as f:
-            return self.yaml.load(f.read())
+        yaml_file = yaml_file or self.yaml_file
+        with trace.span("catalog.load", catalog=os.path.basename(yaml_file)) as stage:
+            with open(yaml_file, "r") as f:
+                text = f.read()
+            if yaml_file == self.yaml_file:
+                # Read with \n, written back with the line endings the file had.
+                self.catalog_newline = "\r\n" if f.newlines == "\r\n" else "\n"
+            stage.add(bytes=len(text))
+            if input_flag(self.env, "gorilla_catalog_patching", True):
+                try:
+                    catalog = TopLevelMapping(text, self.yaml)
+                    stage.set(patching=True)
+                    return catalog
+                except AmbiguousYAML as err:
+                    self.output(f"Full round-trip of {yaml_file}: {err}", verbose_level=2)
+            stage.set(patching=False)
+            return self.yaml.load(text) or {}
 
     def write_out_catalog(self, catalog):
-        with open(self.yaml_file, "w") as f:
-            self.yaml.dump(catalog, f)
+        """writes through a temp file, readers see either the old or the new catalog"""
+        tmp_path = f"{self.yaml_file}.{os.getpid()}.tmp"
+        with trace.span("catalog.write") as stage:
+            try:
+                with open(tmp_path, "w", newline=self.catalog_newline) as f:
+                    if isinstance(catalog, TopLevelMapping):
+                        f.write(catalog.render())
+                    else:
+                        self.yaml.dump(catalog, f)
+                    f.flush()
+                    stage.add(bytes=f.tell())
+                    os.fsync(f.fileno())
+                shutil.copymode(self.yaml_file, tmp_path)
+                os.replace(tmp_path, self.yaml_file)
+                self.catalog_written = True
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            # Make the rename itself durable.
+            dir_fd = os.open(os.path.dirname(self.yaml_file), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    @contextmanager
+    def lock(self, path):
+        """advisory lock serializing read-modify-write cycles of path between runs
+
+        Files are replaced on write, so the lock lives in a sibling file.
+        """
+        try:
+            with file_lock(f"{path}.lock", float(self.env.get("gorilla_lock_timeout", 300))):
+                yield
+        except LockTimeout as err:
+            raise ProcessorError(str(err)) from err
+
+    def get_hash_index_path(self):
+        """path of the repo's hash index, None if disabled"""
+        if "gorilla_hash_index" in self.env:
+            return self.env["gorilla_hash_index"] or None
+        return os.path.join(self.env["gorilla_repo"], ".gorilla_hash_index.json")
+
+    def load_hash_index(self, known=None):
+        """brings the hash index up to date with the catalogs on disk"""
+        index_path = self.get_hash_index_path()
+        if not index_path:
+            return None
+        index = HashIndex(self.env["gorilla_repo"], index_path, log=self.output)
+        with trace.span("hash_index.update" if known else "hash_index.load"):
+            with self.lock(index_path):
+                index.load(known)
+                index.save()
+        return index
+
+    def update_hash_index(self, catalog, results):
+        """records the written catalog in the hash index, a failure doesn't undo the import"""
+        try:
+            self.load_hash_index({
+                f"{self.env['gorilla_catalog']}.yaml": self.hash_index.indexed_catalog(
+                    self.env["gorilla_catalog"],
+                    catalog,
+                    [result["pkg_shortname"] for result in results if result["changed"]],
+                )
+            })
+        except (ProcessorError, OSError, ValueError) as err:
+            # The catalog's size and mtime no longer match its index record,
+            # so the next run re-parses it.
+            self.output(f"WARNING: Hash index not updated, it is rebuilt next run: {err}")
+
+    def get_packages(self):
+        """the packages to import, gorilla_packages or the single one described by the env"""
+        if "gorilla_packages" in self.env:
+            packages = [
+                {**{key: self.env[key] for key in PACKAGE_DEFAULT_KEYS if key in self.env}, **package}
+                for package in self.env["gorilla_packages"]
+            ]
+        else:
+            packages = [{key: self.env[key] for key in PACKAGE_KEYS if key in self.env}]
+        for package in packages:
+            required = ("pkg_shortname",) if "gorilla_promote_from" in package else PACKAGE_REQUIRED_KEYS
+            missing = [key for key in required if key not in package]
+            if missing:
+                raise ProcessorError(
+                    f"Package {package.get('pkg_shortname', package.get('pathname'))} "
+                    f"is missing {', '.join(missing)}"
+                )
+            if "gorilla_promote_from" not in package and not os.path.isfile(package["pathname"]):
+                raise ProcessorError(
+                    f"Package {package['pkg_shortname']}: {package['pathname']} does not exist"
+                )
+            package.setdefault("pkg_display_name", package["pkg_shortname"])
+        return packages
 
-    def hashes_are_identical(self):
+    def get_pkg_sha256(self):
+        """sha256sum of the downloaded file, free if WinVersioner already hashed it"""
+        return file_digests(self.package["pathname"])["sha256"].upper()
+
+    def hashes_are_identical(self, pkg_entry):
         """compares sha256sum of existing file with remotefile"""
         try:
-            existing_file_hash = self.pkg_entry["installer"]["hash"]
+            existing_file_hash = pkg_entry["installer"]["hash"]
         except KeyError:
             existing_file_hash = None
-        new_file_hash = self.env["pkg_sha256"].upper()
+        new_file_hash = self.get_pkg_sha256()
         return existing_file_hash == new_file_hash
 
     def backup_catalog(self):
-        """Backs up old version"""
-        shutil.copy(self.yaml_file, f"{self.yaml_file}.bak")
+        """Backs up old version and removes the oldest backups beyond gorilla_catalog_backups"""
+        keep = int(self.env.get("gorilla_catalog_backups", 5))
+        if keep <= 0:
+            return
+        timestamp = time.strftime("%Y%m%d%H%M%S") + f"{time.time() % 1:.6f}"[1:]
+        backup_path = f"{self.yaml_file}.{timestamp}.bak"
+        with trace.span("catalog.backup"):
+            # The catalog is replaced rather than rewritten, a hardlink keeps the old content.
+            try:
+                os.link(self.yaml_file, backup_path)
+            except OSError:
+                shutil.copy2(self.yaml_file, backup_path)
+            # Timestamps sort lexically.
+            backups = sorted(glob.glob(f"{glob.escape(self.yaml_file)}.*.bak"))
+            for old_backup in backups[:-keep]:
+                os.remove(old_backup)
 
     def update_pkg_entry(self, catalog):
-        self.pkg_entry["display_name"] = self.env["pkg_shortname"] # is not actually in use..
-        self.pkg_entry["version"] = self.env["pkg_version"]
+        self.pkg_entry["display_name"] = self.package["pkg_shortname"] # is not actually in use..
+        self.pkg_entry["version"] = self.package["pkg_version"]
 
-        # If it's in the catalog, it should have an installer key, no?
-        self.pkg_entry["installer"]["hash"] = self.env["pkg_sha256"].upper()
-        self.pkg_entry["installer"]["location"] = os.path.join(self.env["gorilla_subdirectories"], self.dest_filename)
-        self.pkg_entry["installer"]["type"] = self.env["pkg_file_extension"]
+        # New entries without a yaml_entry have no installer key yet.
+        self.pkg_entry.setdefault("installer", {})
+        self.pkg_entry["installer"]["hash"] = self.get_pkg_sha256()
+        self.pkg_entry["installer"]["location"] = self.dest_location
+        self.pkg_entry["installer"]["type"] = self.package["pkg_file_extension"]
         # We may have specified additional arguments, override everything with those.
         try:
-            self.pkg_entry["installer"]["arguments"] = self.env["pkg_installer_arguments"]
+            self.pkg_entry["installer"]["arguments"] = self.package["pkg_installer_arguments"]
         except KeyError:
             pass
 
         if "check" in self.pkg_entry.keys():
             if "registry" in self.pkg_entry["check"].keys():
-                self.pkg_entry["check"]["registry"]["name"] = self.env["pkg_display_name"]
-                self.pkg_entry["check"]["registry"]["version"] = self.env["pkg_version"]
+                self.pkg_entry["check"]["registry"]["name"] = self.package["pkg_display_name"]
+                self.pkg_entry["check"]["registry"]["version"] = self.package["pkg_version"]
 
         if "uninstaller" in self.pkg_entry.keys():
-            self.pkg_entry["uninstaller"]["hash"] = self.env["pkg_sha256"].upper()
-            self.pkg_entry["uninstaller"]["location"] = os.path.join(self.env["gorilla_subdirectories"], self.dest_filename)
-            self.pkg_entry["uninstaller"]["type"] = self.env["pkg_file_extension"]
+            self.pkg_entry["uninstaller"]["hash"] = self.get_pkg_sha256()
+            self.pkg_entry["uninstaller"]["location"] = self.dest_location
+            self.pkg_entry["uninstaller"]["type"] = self.package["pkg_file_extension"]
             try:
-                self.pkg_entry["uninstaller"]["arguments"] = self.env["pkg_uninstaller_arguments"]
+                self.pkg_entry["uninstaller"]["arguments"] = self.package["pkg_uninstaller_arguments"]
             except KeyError:
                 pass
 
+    def get_pkg_store(self):
+        """path of the content-addressed store, None if disabled"""
+        if "gorilla_pkg_store" in self.env:
+            return self.env["gorilla_pkg_store"] or None
+        return os.path.join(self.env["gorilla_repo"], "pkgs", ".store")
+
+    def stage_file(self, path):
+        """
+        remembers that path is about to be created or replaced, a replaced file is
+        kept as a hardlink until the catalog is written
+        """
+        if any(path == staged for staged, _ in self.staged_files):
+            return
+        backup = None
+        if os.path.lexists(path):
+            backup = f"{path}.{os.getpid()}.rollback"
+            if os.path.lexists(backup):
+                os.remove(backup)
+            os.link(path, backup)
+        self.staged_files.append((path, backup))
+
+    def rollback_files(self):
+        """removes the files staged by this run, puts back what they replaced"""
+        for path, backup in reversed(self.staged_files):
+            try:
+                if backup:
+                    os.replace(backup, path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+            except OSError as err:
+                self.output(f"WARNING: Unable to roll back {path}: {err}")
+        self.staged_files = []
+
+    def commit_files(self):
+        """drops the backups of the replaced files once the catalog refers to the new ones"""
+        for _, backup in self.staged_files:
+            if backup and os.path.lexists(backup):
+                os.remove(backup)
+        self.staged_files = []
+
     def copy_pkg_to_repo(self):
         """Grabs the downloaded file pathname to move into the repo"""
-        dest_path = os.path.join(self.env["gorilla_repo"], "pkgs", self.env["gorilla_subdirectories"])
+        dest_path = os.path.join(self.env["gorilla_repo"], "pkgs", self.package["gorilla_subdirectories"])
         if not os.path.isdir(dest_path):
             pathlib.Path(dest_path).mkdir(parents=True, exist_ok=True)
-        self.env["pkg_repo_path"] = os.path.join(dest_path, self.dest_filename)
-        shutil.copy(self.env["pathname"],self.env["pkg_repo_path"])
+        pkg_repo_path = os.path.join(dest_path, self.dest_filename)
+        store = self.get_pkg_store()
+        # Hashed before the span, it only times the copy.
+        sha256 = self.get_pkg_sha256()
+        with trace.span("package.copy", file=self.dest_filename) as stage:
+            if store:
+                blob = blob_path(store, sha256)
+                if not os.path.exists(blob):
+                    self.stage_file(blob)
+                blob, method = add_to_store(store, self.package["pathname"], sha256)
+                if method is None:
+                    self.output(f"{os.path.basename(blob)} is already in the store, not copying.")
+                else:
+                    self.output(f"Stored {self.package['pathname']} ({method})", verbose_level=2)
+                    stage.add(bytes=os.path.getsize(blob))
+                stage.set(method=method or "stored")
+                self.stage_file(pkg_repo_path)
+                link_into_place(blob, pkg_repo_path)
+            else:
+                tmp_path = f"{pkg_repo_path}.{os.getpid()}.tmp"
+                self.stage_file(pkg_repo_path)
+                try:
+                    clone_file(self.package["pathname"], tmp_path)
+                    os.replace(tmp_path, pkg_repo_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                stage.add(bytes=os.path.getsize(pkg_repo_path))
+        return pkg_repo_path
 
+    def find_in_repo(self, sha256):
+        """an index entry whose payload with this sha256 is present in the repo, or None"""
+        if not self.hash_index:
+            return None
+        for entry in self.hash_index.lookup(sha256):
+            if entry["location"] and os.path.isfile(
+                os.path.join(self.env["gorilla_repo"], "pkgs", entry["location"])
+            ):
+                return entry
+        return None
 
-    def main(self):
-        self.yaml_file = os.path.join(
-            self.env["gorilla_repo"], "catalogs", f"{self.env['gorilla_catalog']}.yaml"
-        )
-        catalog = self.yaml_to_dict()
-        self.dest_filename = f"{self.env['pkg_shortname']}-{self.env['pkg_version']}.{self.env['pkg_file_extension']}"
-        self.copy_pkg_to_repo()
+    def get_source_catalog(self, name):
+        """a catalog packages are promoted from, loaded once per run"""
+        if name not in self.source_catalogs:
+            path = os.path.join(self.env["gorilla_repo"], "catalogs", f"{name}.yaml")
+            try:
+                self.source_catalogs[name] = self.yaml_to_dict(path)
+            except OSError as err:
+                raise ProcessorError(f"Unable to read catalog {name}: {err}") from err
+        return self.source_catalogs[name]
 
+    def promote_package(self, catalog):
+        """copies the entry of self.package from its gorilla_promote_from catalog"""
+        shortname = self.package["pkg_shortname"]
+        source_name = self.package["gorilla_promote_from"]
+        source_entry = self.get_source_catalog(source_name).get(shortname)
+        if source_entry is None:
+            raise ProcessorError(f"{shortname} is not in catalog {source_name}")
+        version = str(source_entry.get("version", ""))
+        if "pkg_version" in self.package and str(self.package["pkg_version"]) != version:
+            raise ProcessorError(
+                f"{source_name} has {shortname} {version}, not {self.package['pkg_version']}"
+            )
         try:
-            self.pkg_entry = catalog[self.env["pkg_shortname"]]
+            location = source_entry["installer"]["location"]
+            sha256 = source_entry["installer"]["hash"]
+        except KeyError as err:
+            raise ProcessorError(f"{shortname} in {source_name} has no installer {err}") from err
+        result = {
+            "pkg_shortname": shortname,
+            "pkg_version": version,
+            "pkg_repo_path": os.path.join(self.env["gorilla_repo"], "pkgs", location),
+        }
+        try:
+            existing_hash = catalog[shortname]["installer"]["hash"]
         except KeyError:
-            self.pkg_entry = {}
+            existing_hash = None
+        if existing_hash == sha256:
+            self.output(f"{shortname} {version} is already in {self.env['gorilla_catalog']}.")
+            result["changed"] = False
+            return result
+        catalog[shortname] = copy.deepcopy(source_entry)
+        self.output(f"{shortname} {version} has been promoted from {source_name}.")
+        result["changed"] = True
+        return result
 
-        if "yaml_entry" in self.env:
-            for key in self.env["yaml_entry"]:
-                self.pkg_entry[key] = self.env["yaml_entry"][key]
+    def import_package(self, catalog):
+        """updates the catalog entry of self.package, returns its result"""
+        shortname = self.package["pkg_shortname"]
+        self.dest_filename = f"{shortname}-{self.package['pkg_version']}.{self.package['pkg_file_extension']}"
+        result = {
+            "pkg_shortname": shortname,
+            "pkg_version": self.package["pkg_version"],
+        }
 
-        if self.hashes_are_identical():
-            self.output("File hashes are identical. Stopping processor.")
-            self.env["gorilla_repo_changed"] = False
-            return
+        # Checked against the entry as it is in the catalog, a yaml_entry installer
+        # key would hide the hash. Nothing is copied for an unchanged package.
+        existing_entry = catalog.get(shortname, {})
+        if self.hashes_are_identical(existing_entry):
+            self.output(f"File hashes are identical for {shortname}.")
+            result["pkg_repo_path"] = os.path.join(
+                self.env["gorilla_repo"], "pkgs", existing_entry["installer"]["location"]
+            )
+            result["changed"] = False
+            return result
+
+        # Work on a copy, the catalog must not be touched if the import fails halfway.
+        self.pkg_entry = copy.deepcopy(existing_entry)
+        if "yaml_entry" in self.package:
+            for key in self.package["yaml_entry"]:
+                self.pkg_entry[key] = self.package["yaml_entry"][key]
 
+        existing = self.find_in_repo(self.get_pkg_sha256())
+        if existing:
+            self.output(
+                f"{shortname} is already in the repo as {existing['location']} "
+                f"({existing['catalog']} {existing['shortname']}), not copying."
+            )
+            self.dest_location = existing["location"]
+            result["pkg_repo_path"] = os.path.join(self.env["gorilla_repo"], "pkgs", self.dest_location)
+        else:
+            self.dest_location = os.path.join(self.package["gorilla_subdirectories"], self.dest_filename)
+            result["pkg_repo_path"] = self.copy_pkg_to_repo()
         self.update_pkg_entry(catalog)
-        self.output(self.pkg_entry)
+        self.output(self.pkg_entry, verbose_level=2)
         # Update the catalog to include the new entries data.
-        catalog[self.env["pkg_shortname"]] = self.pkg_entry
-        # Backup catalog, just in case..
-        shutil.copy(self.yaml_file, f"{self.yaml_file}.bak")
-        self.write_out_catalog(catalog)
-        self.env["gorilla_importer_summary"] = self.pkg_entry
-        self.env["gorilla_repo_changed"] = True
-        self.output(f"{self.pkg_entry} has been added to the catalog.")
+        catalog[shortname] = self.pkg_entry
+        self.output(f"{shortname} {self.package['pkg_version']} has been added to the catalog.")
+        result["changed"] = True
+        return result
+
+    def main(self):
+        with trace.tracing(self.env.get("trace_path"), "GorillaImporter"):
+            self.yaml_file = os.path.join(
+                self.env["gorilla_repo"], "catalogs", f"{self.env['gorilla_catalog']}.yaml"
+            )
+            packages = self.get_packages()
+            self.source_catalogs = {}
+            with self.lock(self.yaml_file):
+                catalog = self.yaml_to_dict()
+                self.hash_index = self.load_hash_index()
+                self.staged_files = []
+                self.catalog_written = False
+                try:
+                    results = []
+                    for self.package in packages:
+                        with trace.span("package", shortname=self.package["pkg_shortname"]) as stage:
+                            if "gorilla_promote_from" in self.package:
+                                results.append(self.promote_package(catalog))
+                            else:
+                                results.append(self.import_package(catalog))
+                            stage.set(changed=results[-1]["changed"])
+
+                    changed = any(result["changed"] for result in results)
+                    if changed:
+                        # Backup catalog, just in case..
+                        self.backup_catalog()
+                        self.write_out_catalog(catalog)
+                except BaseException as err:
+                    # All or nothing: without the catalog, the copied pkgs are orphans.
+                    if self.catalog_written:
+                        self.commit_files()
+                    else:
+                        self.rollback_files()
+                    if isinstance(err, OSError):
+                        raise ProcessorError(
+                            f"Import into {self.env['gorilla_catalog']} failed: {err}"
+                        ) from err
+                    raise
+                self.commit_files()
+                if changed:
+                    if self.hash_index:
+                        self.update_hash_index(catalog, results)
+                else:
+                    self.output("File hashes are identical. Catalog left untouched.")
 
+            self.env["pkg_repo_path"] = results[0]["pkg_repo_path"] if len(results) == 1 else ""
+            self.env["gorilla_importer_results"] = results
+            self.env["gorilla_repo_changed"] = changed
+            # Like MunkiImporter, only runs that imported something are reported,
+            # with the status of every package of the batch.
+            self.env.pop("gorilla_importer_summary_result", None)
+            if changed:
+                rows = [
+                    {
+                        "pkg_shortname": result["pkg_shortname"],
+                        "pkg_version": str(result["pkg_version"]),
+                        "pkg_repo_path": result["pkg_repo_path"],
+                        "catalogs": self.env["gorilla_catalog"],
+                        "status": (
+                            "unchanged" if not result["changed"]
+                            else "promoted" if "gorilla_promote_from" in package
+                            else "imported"
+                        ),
+                    }
+                    for package, result in zip(packages, results)
+                ]
+                # AutoPkg reports one row per recipe, a batch is joined into one.
+                self.env["gorilla_importer_summary_result"] = {
+                    "summary_text": "The following new items were imported into Gorilla:",
+                    "report_fields": [
+                        "pkg_shortname", "pkg_version", "pkg_repo_path", "catalogs", "status",
+                    ],
+                    "data": {
+                        field: ", ".join(row[field] for row in rows) for field in rows[0]
+                    },
+                }
 
 if __name__ == "__main__":
     PROCESSOR = GorillaImporter()
@@ -0,0 +1,6 @@
+"""
+Helpers shared by the processors in com.github.arequ.SharedProcessors.
+
+AutoPkg loads processors by file path, so processors that use these modules
+put their own directory on sys.path before importing them.
+"""
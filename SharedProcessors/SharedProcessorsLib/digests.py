@@ -0,0 +1,92 @@
+"""
+Single-pass file hashing shared by the processors.
+
+Files are read once through a large reusable buffer and every requested digest
+is updated from the same buffer. Results are remembered per file identity
+(path, size, mtime, inode) for the lifetime of the process, so a file hashed by
+WinVersioner is not read again by GorillaImporter in the same AutoPkg run.
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import trace
+
+__all__ = ["file_identity", "file_digests", "remember_digests", "submit_file_digests"]
+
+BUFFER_SIZE = 1 << 20
+
+_lock = threading.Lock()
+_results = {}
+_executor = None
+
+
+def _reset_after_fork():
+    """
+    A forked child, e.g. a WinVersioner batch worker, inherits the executor but
+    not its thread, work submitted to it would never run.
+    """
+    global _lock, _executor  # pylint: disable=global-statement
+    _lock = threading.Lock()
+    _executor = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def file_identity(path):
+    """Returns a tuple identifying the current content of a file without reading it."""
+    stat = os.stat(path)
+    return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def remember_digests(path, digests):
+    """Records digests that are already known for a file, e.g. from a cache."""
+    identity = file_identity(path)
+    with _lock:
+        _results.setdefault(identity, {}).update(digests)
+
+
+def file_digests(path, algorithms=("sha256",)):
+    """
+    Returns a dictionary of algorithm name to lowercase hex digest for a file.
+    Digests that are not known yet are all computed in a single pass.
+    """
+    identity = file_identity(path)
+    with _lock:
+        known = dict(_results.get(identity, {}))
+    missing = [algorithm for algorithm in algorithms if algorithm not in known]
+    if missing:
+        hashers = [hashlib.new(algorithm) for algorithm in missing]
+        buffer = bytearray(BUFFER_SIZE)
+        view = memoryview(buffer)
+        with trace.span("hash", file=os.path.basename(path), algorithms=missing) as stage:
+            with open(path, "rb", buffering=0) as f:
+                while True:
+                    size = f.readinto(buffer)
+                    if not size:
+                        break
+                    for hasher in hashers:
+                        hasher.update(view[:size])
+            stage.add(bytes=identity[1])
+        computed = {
+            algorithm: hasher.hexdigest() for algorithm, hasher in zip(missing, hashers)
+        }
+        with _lock:
+            _results.setdefault(identity, {}).update(computed)
+        known.update(computed)
+    return {algorithm: known[algorithm] for algorithm in algorithms}
+
+
+def submit_file_digests(path, algorithms=("sha256",)):
+    """
+    Starts file_digests on a worker thread and returns its Future. hashlib
+    releases the GIL while hashing, so the caller can keep working meanwhile.
+    """
+    global _executor  # pylint: disable=global-statement
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="digests")
+    return _executor.submit(file_digests, path, tuple(algorithms))
@@ -0,0 +1,353 @@
+"""
+Concurrent freshness checks for the check phase of download recipes.
+
+The endpoints a recipe hits before EndOfCheckPhase are read from the recipe
+itself, with %VARIABLES% filled in from its Input. URLs built from values that
+are only known at run time (e.g. a download id scraped by URLTextSearcher) are
+skipped, the page they are scraped from is probed instead.
+
+Downloads are probed with a conditional HEAD request and compared on ETag,
+Last-Modified, Content-Length and the URL redirects end up at. Pages, whose
+validators are often missing or change on every request, are fetched with a
+conditional GET and compared on a digest of the body. The fingerprints are
+kept in a JSON state file between runs.
+
+A changed fingerprint is only kept as pending, with the recipes it was
+reported to, until acknowledge() is told that all of them ran successfully.
+Until then the endpoint is compared with the last acknowledged fingerprint
+and keeps reporting a change, so an update isn't lost to a failed or skipped
+run.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import re
+import ssl
+import time
+import urllib.error
+import urllib.request
+
+from .locks import file_lock
+from .recipes import processor_name
+
+try:
+    import certifi
+except ImportError:  # pragma: no cover - AutoPkg's Python ships certifi
+    certifi = None
+
+__all__ = ["CHECK_PROCESSORS", "check_phase_endpoints", "FreshnessProbe"]
+
+# Processor name: (argument holding the URL, kind of endpoint)
+CHECK_PROCESSORS = {
+    "URLTextSearcher": ("url", "page"),
+    "SparkleUpdateInfoProvider": ("appcast_url", "page"),
+    "URLDownloader": ("url", "download"),
+    "URLDownloaderPython": ("url", "download"),
+}
+VARIABLE = re.compile(r"%(\w+)%")
+# Fingerprint fields that tell a new version apart, per kind of endpoint.
+COMPARED_FIELDS = {
+    "download": ("etag", "last_modified", "content_length", "final_url"),
+    "page": ("final_url", "body_sha256"),
+}
+# Servers answering HEAD with these get a one byte ranged GET instead.
+HEAD_REFUSED = (403, 405, 501)
+# Probes and run_recipes' acknowledgements update the state file concurrently.
+STATE_LOCK_TIMEOUT = 60
+
+
+def substitute(value, variables):
+    """fills in %VARIABLES%, returns None if one of them isn't known"""
+    missing = []
+
+    def replace(match):
+        if match.group(1) in variables and isinstance(variables[match.group(1)], str):
+            return variables[match.group(1)]
+        missing.append(match.group(1))
+        return match.group()
+
+    # Input values may refer to each other, e.g. %BASE_URL%/%NAME%.
+    for _ in range(5):
+        missing.clear()
+        substituted = VARIABLE.sub(replace, value)
+        if substituted == value:
+            break
+        value = substituted
+    return None if missing else value
+
+
+def check_phase_endpoints(recipe):
+    """
+    the endpoints a flattened recipe probes before EndOfCheckPhase as dictionaries
+    with url, kind and headers, plus the URLs that can't be resolved without running it
+    """
+    variables = dict(recipe.get("Input") or {})
+    endpoints = []
+    unresolved = []
+    for step in recipe.get("Process") or []:
+        name = processor_name(step)
+        if name == "EndOfCheckPhase":
+            break
+        if name not in CHECK_PROCESSORS:
+            continue
+        argument, kind = CHECK_PROCESSORS[name]
+        arguments = step.get("Arguments") or {}
+        if argument not in arguments:
+            continue
+        url = substitute(str(arguments[argument]), variables)
+        if url is None:
+            unresolved.append(str(arguments[argument]))
+            continue
+        headers = {
+            str(key): substitute(str(value), variables) or str(value)
+            for key, value in (arguments.get("request_headers") or {}).items()
+        }
+        endpoint = {"url": url, "kind": kind, "headers": headers}
+        if endpoint not in endpoints:
+            endpoints.append(endpoint)
+    return endpoints, unresolved
+
+
+def endpoint_key(endpoint):
+    """state file key of an endpoint"""
+    return f"{endpoint['kind']} {endpoint['url']}"
+
+
+class FreshnessProbe:
+    """Probes endpoints concurrently and compares them with the saved state."""
+
+    def __init__(self, state_path, max_workers=8, timeout=15):
+        self.state_path = state_path
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        if certifi is not None:
+            context = ssl.create_default_context(cafile=certifi.where())
+        else:
+            context = ssl.create_default_context()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPSHandler(context=context))
+        self.state = self.load_state()
+
+    def load_state(self):
+        """the saved fingerprints, empty if missing or unreadable"""
+        # {endpoint key: fingerprint, plus "pending": {"fingerprint", "recipes",
+        # "acknowledged"} if it changed}
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def locked_state(self):
+        """
+        the state file's lock, taken around re-reading, merging and saving so
+        concurrent probes and acknowledgements don't overwrite each other
+        """
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        return file_lock(f"{self.state_path}.lock", STATE_LOCK_TIMEOUT)
+
+    def save_state(self):
+        """atomically writes the fingerprints"""
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def request(self, endpoint, method, previous, byte_range=False):
+        """response headers, final URL and body digest, or None on 304"""
+        headers = dict(endpoint["headers"])
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+        if byte_range:
+            headers["Range"] = "bytes=0-0"
+        request = urllib.request.Request(endpoint["url"], headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                fingerprint = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "content_length": response.headers.get("Content-Length"),
+                    "final_url": response.geturl(),
+                }
+                if byte_range and response.status == 206:
+                    fingerprint["content_length"] = (
+                        response.headers.get("Content-Range", "").rpartition("/")[2] or None
+                    )
+                if endpoint["kind"] == "page":
+                    fingerprint["body_sha256"] = hashlib.sha256(response.read()).hexdigest()
+                    # Pages are compared on their content, dynamic lengths don't matter.
+                    fingerprint["content_length"] = None
+                return fingerprint
+        except urllib.error.HTTPError as err:
+            if err.code == 304:
+                return None
+            raise
+
+    def probe(self, endpoint):
+        """status of one endpoint: unchanged, changed, new or error, and its fingerprint"""
+        key = endpoint_key(endpoint)
+        previous = {
+            field: value for field, value in self.state.get(key, {}).items() if field != "pending"
+        }
+        started = time.monotonic()
+        try:
+            if endpoint["kind"] == "page":
+                fingerprint = self.request(endpoint, "GET", previous)
+            else:
+                try:
+                    fingerprint = self.request(endpoint, "HEAD", previous)
+                except urllib.error.HTTPError as err:
+                    if err.code not in HEAD_REFUSED:
+                        raise
+                    fingerprint = self.request(endpoint, "GET", previous, byte_range=True)
+        except (urllib.error.URLError, OSError, ValueError) as err:
+            return {"url": endpoint["url"], "status": "error", "error": str(err),
+                    "seconds": time.monotonic() - started}, None
+        seconds = time.monotonic() - started
+        if fingerprint is None:
+            return {"url": endpoint["url"], "status": "unchanged", "seconds": seconds}, previous
+        compared = COMPARED_FIELDS[endpoint["kind"]]
+        if not previous:
+            status = "new"
+        elif all(previous.get(field) == fingerprint.get(field) for field in compared):
+            status = "unchanged"
+        else:
+            status = "changed"
+        return {"url": endpoint["url"], "status": status, "seconds": seconds}, fingerprint
+
+    def is_pending(self, endpoint, fingerprint):
+        """the pending change of endpoint if fingerprint is still the same, else None"""
+        pending = self.state.get(endpoint_key(endpoint), {}).get("pending")
+        if pending and fingerprint and all(
+            pending["fingerprint"].get(field) == fingerprint.get(field)
+            for field in COMPARED_FIELDS[endpoint["kind"]]
+        ):
+            return pending
+        return None
+
+    def status_for(self, identifier, endpoint, status, fingerprint):
+        """
+        the status of endpoint for one recipe, a change the recipe already
+        acknowledged is unchanged for it
+        """
+        if status["status"] in ("new", "changed"):
+            pending = self.is_pending(endpoint, fingerprint)
+            if pending and identifier in pending.get("acknowledged", []):
+                return dict(status, status="unchanged")
+        return status
+
+    def check(self, recipes, update_state=True):
+        """
+        probes the check phase endpoints of recipes, a list of (path, flattened recipe),
+        returns one result per recipe with needs_run and the endpoint statuses
+        """
+        started = time.time()
+        plans = []
+        unique = {}
+        for path, recipe in recipes:
+            endpoints, unresolved = check_phase_endpoints(recipe)
+            plans.append((path, recipe, endpoints, unresolved))
+            for endpoint in endpoints:
+                unique.setdefault(endpoint_key(endpoint), endpoint)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(1, len(unique)))) as executor:
+            probed = dict(zip(unique, executor.map(self.probe, unique.values())))
+
+        results = []
+        for path, recipe, endpoints, unresolved in plans:
+            identifier = recipe.get("Identifier", os.path.basename(path))
+            statuses = [
+                self.status_for(identifier, endpoint, *probed[endpoint_key(endpoint)])
+                for endpoint in endpoints
+            ]
+            if not endpoints:
+                reason = "no check phase endpoint can be probed"
+            else:
+                reason = ", ".join(
+                    f"{status['url']} is {status['status']}"
+                    for status in statuses
+                    if status["status"] != "unchanged"
+                )
+            results.append({
+                "identifier": identifier,
+                "path": path,
+                "needs_run": bool(reason),
+                "reason": reason,
+                "endpoints": statuses,
+                "unresolved": unresolved,
+            })
+
+        if update_state:
+            # Who has to run before a change counts as seen.
+            reported = {}
+            for result, (_, _, endpoints, _) in zip(results, plans):
+                for endpoint in endpoints:
+                    reported.setdefault(endpoint_key(endpoint), set()).add(result["identifier"])
+            with self.locked_state():
+                self.state = self.load_state()
+                self.merge(probed, unique, reported, started)
+                self.save_state()
+        return results
+
+    def merge(self, probed, unique, reported, started):
+        """
+        records probed fingerprints in the state as re-read under the lock, the
+        acknowledgements and probes saved since this check started are kept
+        """
+        for key, (status, fingerprint) in probed.items():
+            if status["status"] == "error":
+                continue
+            entry = self.state.setdefault(key, {})
+            compared = COMPARED_FIELDS[unique[key]["kind"]]
+            current = {field: value for field, value in entry.items() if field != "pending"}
+            if status["status"] != "unchanged" and current and all(
+                current.get(field) == fingerprint.get(field) for field in compared
+            ):
+                # All of its recipes acknowledged this change while it was probed.
+                status = dict(status, status="unchanged")
+            if status["status"] == "unchanged":
+                # A change another probe found in the meantime is not ours to drop.
+                if entry.get("pending", {}).get("fingerprint", {}).get("checked", 0) < started:
+                    entry.pop("pending", None)
+                entry["checked"] = time.time()
+                continue
+            # The same change again keeps who already ran, a newer one starts over.
+            pending = self.is_pending(unique[key], fingerprint) or {}
+            acknowledged = set(pending.get("acknowledged", []))
+            recipes = set(entry.get("pending", {}).get("recipes", [])) | reported[key]
+            entry["pending"] = {
+                "fingerprint": dict(fingerprint, checked=time.time()),
+                "recipes": sorted(recipes - acknowledged),
+                "acknowledged": sorted(acknowledged),
+            }
+
+    def acknowledge(self, identifiers):
+        """
+        records that the recipes with these identifiers ran successfully, a pending
+        fingerprint becomes the one compared against once all its recipes did.
+        Returns the keys of the endpoints whose fingerprint was updated.
+        """
+        identifiers = set(identifiers)
+        updated = []
+        with self.locked_state():
+            # Re-read, the state may have been probed again since this probe was made.
+            self.state = self.load_state()
+            touched = False
+            for key, entry in self.state.items():
+                pending = entry.get("pending")
+                if not pending or not identifiers & set(pending["recipes"]):
+                    continue
+                touched = True
+                pending["acknowledged"] = sorted(
+                    set(pending.get("acknowledged", [])) | (identifiers & set(pending["recipes"]))
+                )
+                pending["recipes"] = sorted(set(pending["recipes"]) - identifiers)
+                if not pending["recipes"]:
+                    self.state[key] = pending["fingerprint"]
+                    updated.append(key)
+            if touched:
+                self.save_state()
+        return updated
@@ -0,0 +1,145 @@
+"""
+Persistent sha256 index over every catalog of a Gorilla repo.
+
+The index is a JSON sidecar holding, per catalog file, the size and mtime it
+was built from and the (shortname, version, location, sha256) of each of its
+entries. Loading it only re-parses the catalogs that changed since, so finding
+out whether a payload is already somewhere in the repo doesn't require reading
+every catalog.
+"""
+
+import json
+import os
+
+from ruamel.yaml import YAML
+from ruamel.yaml.error import YAMLError
+
+from . import trace
+
+__all__ = ["HashIndex", "catalog_entries"]
+
+INDEX_VERSION = 1
+
+
+def catalog_entries(catalog):
+    """The indexed fields of every entry with an installer hash in a loaded catalog."""
+    entries = []
+    for shortname, entry in (catalog or {}).items():
+        try:
+            installer = entry["installer"]
+            sha256 = str(installer["hash"]).lower()
+        except (KeyError, TypeError):
+            continue
+        if not sha256:
+            continue
+        entries.append({
+            "shortname": str(shortname),
+            "version": str(entry.get("version", "")),
+            "location": str(installer.get("location", "")),
+            "sha256": sha256,
+        })
+    return entries
+
+
+class HashIndex:
+    """sha256 to (catalog, shortname, version, location) across a repo's catalogs."""
+
+    def __init__(self, repo, index_path, log=None):
+        self.catalogs_dir = os.path.join(repo, "catalogs")
+        self.index_path = index_path
+        self.log = log or (lambda message: None)
+        self.catalogs = {}
+        self.by_hash = {}
+        self.dirty = False
+
+    @staticmethod
+    def stat_key(path):
+        """what a catalog's index entry is valid for"""
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load(self, known=None):
+        """
+        reads the sidecar and re-indexes catalogs added or changed since, known maps
+        catalog file names to up to date records from indexed_catalog
+        """
+        self.catalogs = {}
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self.catalogs = data["catalogs"]
+        except (OSError, ValueError, KeyError):
+            pass
+        if known:
+            self.catalogs.update(known)
+            self.dirty = True
+        names = sorted(
+            name for name in os.listdir(self.catalogs_dir) if name.endswith(".yaml")
+        ) if os.path.isdir(self.catalogs_dir) else []
+        for name in list(self.catalogs):
+            if name not in names:
+                del self.catalogs[name]
+                self.dirty = True
+        yaml = None
+        for name in names:
+            path = os.path.join(self.catalogs_dir, name)
+            try:
+                stat_key = self.stat_key(path)
+                if self.catalogs.get(name, {}).get("stat") == stat_key:
+                    continue
+                yaml = yaml or YAML(typ="safe")
+                with trace.span("hash_index.parse", catalog=name) as stage:
+                    stage.add(bytes=stat_key[0])
+                    with open(path, "r") as f:
+                        catalog = yaml.load(f)
+            except (OSError, YAMLError) as err:
+                # Left out without a stat key, so it is parsed again next time.
+                self.log(f"WARNING: Not indexing {name}: {err}")
+                if self.catalogs.pop(name, None) is not None:
+                    self.dirty = True
+                continue
+            self.catalogs[name] = {"stat": stat_key, "entries": catalog_entries(catalog)}
+            self.dirty = True
+        self.rebuild()
+        return self
+
+    def rebuild(self):
+        """recomputes the sha256 lookup table"""
+        self.by_hash = {}
+        for name, indexed in self.catalogs.items():
+            for entry in indexed["entries"]:
+                self.by_hash.setdefault(entry["sha256"], []).append(
+                    dict(entry, catalog=name[: -len(".yaml")])
+                )
+
+    def lookup(self, sha256):
+        """every catalog entry whose installer has this sha256"""
+        return self.by_hash.get(sha256.lower(), [])
+
+    def indexed_catalog(self, name, catalog, changed=None):
+        """
+        index record of a catalog from its in-memory content, right after it was written.
+        With the list of changed shortnames only those entries are re-read from catalog.
+        """
+        path = os.path.join(self.catalogs_dir, f"{name}.yaml")
+        if changed is None or f"{name}.yaml" not in self.catalogs:
+            return {"stat": self.stat_key(path), "entries": catalog_entries(catalog)}
+        changed = set(changed)
+        entries = [
+            entry
+            for entry in self.catalogs[f"{name}.yaml"]["entries"]
+            if entry["shortname"] not in changed
+        ]
+        entries.extend(catalog_entries({shortname: catalog[shortname] for shortname in changed}))
+        return {"stat": self.stat_key(path), "entries": entries}
+
+    def save(self):
+        """atomically writes the sidecar if anything changed"""
+        if not self.dirty:
+            return
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "catalogs": self.catalogs}, f)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
@@ -0,0 +1,15 @@
+"""
+Parsing of processor inputs.
+
+Recipe overrides and `autopkg run -k KEY=VALUE` pass every value as a string,
+so a boolean input may arrive as True or as "False".
+"""
+
+__all__ = ["input_flag"]
+
+FALSE_STRINGS = ("", "0", "false", "no", "off")
+
+
+def input_flag(env, key, default=False):
+    """a boolean input of env, the strings in FALSE_STRINGS count as false"""
+    return str(env.get(key, default)).strip().lower() not in FALSE_STRINGS
@@ -0,0 +1,43 @@
+"""
+Advisory file locks serializing read-modify-write cycles of shared files.
+
+Catalogs, the hash index, the WinVersioner metadata cache and the
+FreshnessProbe state are each rewritten by whole-file replacement. Parallel
+recipe runs take an flock on a sibling .lock file around loading, merging
+and saving, so one run's changes aren't lost to another's.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import os
+import time
+
+from . import trace
+
+__all__ = ["LockTimeout", "file_lock"]
+
+
+class LockTimeout(TimeoutError):
+    """Raised when another process holds a lock for too long."""
+
+
+@contextmanager
+def file_lock(lock_path, timeout):
+    """Exclusive advisory flock on lock_path, waiting at most timeout seconds."""
+    deadline = time.monotonic() + timeout
+    with open(lock_path, "a") as lock_file:
+        with trace.span("lock.wait", lock=os.path.basename(lock_path)):
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise LockTimeout(
+                            f"Timed out after {timeout:g}s waiting for the lock on {lock_path}"
+                        ) from None
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,322 @@
+"""
+Pure-Python reader for the parts of a Windows Installer (.msi) database that the
+processors need: the Property table and the SummaryInformation stream.
+
+An .msi is an OLE compound file. The file is memory-mapped and only the sectors
+of the few streams that are read (directory, string pool, Property table and
+SummaryInformation) are ever touched, regardless of the size of the installer.
+"""
+
+import codecs
+import datetime
+import mmap
+import struct
+
+__all__ = ["MSIError", "CompoundFile", "MSIFile", "PID_COMMENTS"]
+
+CFB_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+STREAM_TYPE = 2
+ROOT_TYPE = 5
+
+# Table streams are prefixed with this character, the rest of the name is packed
+# two characters per code point using this 64 character alphabet.
+TABLE_PREFIX = "\u4840"
+NAME_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz._"
+
+SUMMARY_INFORMATION = "\x05SummaryInformation"
+PID_CODEPAGE = 1
+PID_COMMENTS = 6
+VT_I2 = 2
+VT_I4 = 3
+VT_LPSTR = 30
+VT_FILETIME = 64
+
+
+class MSIError(Exception):
+    """Raised when a file can't be read as an MSI database."""
+
+
+def decode_stream_name(name):
+    """Decodes the packed name of an MSI stream, e.g. to "\\u4840Property"."""
+    decoded = []
+    for char in name:
+        code = ord(char)
+        if 0x3800 <= code < 0x4840:
+            if code >= 0x4800:
+                decoded.append(NAME_ALPHABET[code - 0x4800])
+            else:
+                code -= 0x3800
+                decoded.append(NAME_ALPHABET[code & 0x3F])
+                decoded.append(NAME_ALPHABET[(code >> 6) & 0x3F])
+        else:
+            decoded.append(char)
+    return "".join(decoded)
+
+
+def python_encoding(codepage):
+    """Maps a Windows codepage number to a Python codec name."""
+    if codepage == 0:
+        return "cp1252"
+    if codepage == 65001:
+        return "utf-8"
+    try:
+        return codecs.lookup(f"cp{codepage}").name
+    except LookupError:
+        return "latin-1"
+
+
+class CompoundFile:
+    """Read-only access to the streams of an OLE compound file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as err:
+            self._file.close()
+            raise MSIError(f"{path} is empty") from err
+        try:
+            self._read_header()
+            self.streams = self._read_directory()
+        except (struct.error, IndexError) as err:
+            self.close()
+            raise MSIError(f"{path} is not a valid compound file: {err}") from err
+        self._mini_stream = None
+        self._mini_fat = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Unmaps and closes the file."""
+        self._map.close()
+        self._file.close()
+
+    def _read_header(self):
+        if self._map[:8] != CFB_SIGNATURE:
+            raise MSIError(f"{self.path} is not a compound file")
+        sector_shift, mini_sector_shift = struct.unpack_from("<HH", self._map, 0x1E)
+        # Version 3 files use 512 byte sectors, version 4 files 4096 byte ones.
+        if sector_shift not in (9, 12) or mini_sector_shift != 6:
+            raise MSIError(f"{self.path} has an unsupported sector size")
+        (
+            num_fat_sectors,
+            self._first_dir_sector,
+            _,
+            self._mini_cutoff,
+            self._first_mini_fat_sector,
+            self._num_mini_fat_sectors,
+            first_difat_sector,
+            _,
+        ) = struct.unpack_from("<8I", self._map, 0x2C)
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+        self._max_sectors = len(self._map) // self.sector_size + 1
+
+        # The header holds the first 109 FAT sector numbers, the rest are chained.
+        fat_sectors = list(struct.unpack_from("<109I", self._map, 0x4C))
+        per_sector = self.sector_size // 4 - 1
+        sector = first_difat_sector
+        while sector not in (ENDOFCHAIN, FREESECT) and len(fat_sectors) < num_fat_sectors + 109:
+            if len(fat_sectors) > self._max_sectors + 109:
+                raise MSIError(f"{self.path} has a looping DIFAT chain")
+            entries = struct.unpack_from(f"<{per_sector + 1}I", self._map, self._offset(sector))
+            fat_sectors.extend(entries[:per_sector])
+            sector = entries[per_sector]
+        self._fat_sectors = fat_sectors[:num_fat_sectors]
+
+    def _offset(self, sector):
+        offset = (sector + 1) * self.sector_size
+        if offset >= len(self._map):
+            raise MSIError(f"{self.path} refers to sector {sector} past its end")
+        return offset
+
+    def _next_sector(self, sector):
+        per_sector = self.sector_size // 4
+        if sector // per_sector >= len(self._fat_sectors):
+            raise MSIError(f"{self.path} has no FAT entry for sector {sector}")
+        fat_sector = self._fat_sectors[sector // per_sector]
+        offset = self._offset(fat_sector) + (sector % per_sector) * 4
+        if offset + 4 > len(self._map):
+            raise MSIError(f"{self.path} has a truncated FAT")
+        return struct.unpack_from("<I", self._map, offset)[0]
+
+    def _chain(self, sector):
+        count = 0
+        while sector not in (ENDOFCHAIN, FREESECT):
+            count += 1
+            if count > self._max_sectors:
+                raise MSIError(f"{self.path} has a looping sector chain")
+            yield sector
+            sector = self._next_sector(sector)
+
+    def _read_chain(self, sector, size=None):
+        data = b"".join(
+            self._map[self._offset(s):self._offset(s) + self.sector_size]
+            for s in self._chain(sector)
+        )
+        return data if size is None else data[:size]
+
+    def _read_directory(self):
+        directory = self._read_chain(self._first_dir_sector)
+        self._root = (ENDOFCHAIN, 0)
+        streams = {}
+        for offset in range(0, len(directory) - 127, 128):
+            entry = directory[offset:offset + 128]
+            (name_length,) = struct.unpack_from("<H", entry, 0x40)
+            entry_type = entry[0x42]
+            start, size = struct.unpack_from("<IQ", entry, 0x74)
+            if self.sector_size == 512:
+                # Version 3 files may leave garbage in the high dword.
+                size &= 0xFFFFFFFF
+            name = entry[:max(name_length - 2, 0)].decode("utf-16-le", "replace")
+            if entry_type == ROOT_TYPE:
+                self._root = (start, size)
+            elif entry_type == STREAM_TYPE:
+                streams[decode_stream_name(name)] = (start, size)
+        return streams
+
+    def _read_mini_chain(self, sector, size):
+        if self._mini_stream is None:
+            self._mini_stream = self._read_chain(*self._root)
+            mini_fat = self._read_chain(
+                self._first_mini_fat_sector, self._num_mini_fat_sectors * self.sector_size
+            )
+            self._mini_fat = struct.unpack(f"<{len(mini_fat) // 4}I", mini_fat)
+        chunks = []
+        count = 0
+        while sector not in (ENDOFCHAIN, FREESECT):
+            count += 1
+            if count > len(self._mini_fat):
+                raise MSIError(f"{self.path} has a looping mini sector chain")
+            if sector >= len(self._mini_fat):
+                raise MSIError(f"{self.path} has no mini FAT entry for sector {sector}")
+            offset = sector * self.mini_sector_size
+            chunks.append(self._mini_stream[offset:offset + self.mini_sector_size])
+            sector = self._mini_fat[sector]
+        return b"".join(chunks)[:size]
+
+    def read_stream(self, name):
+        """Returns the content of the stream with the given (decoded) name."""
+        try:
+            start, size = self.streams[name]
+        except KeyError as err:
+            raise MSIError(f"{self.path} has no stream {name!r}") from err
+        if size < self._mini_cutoff:
+            return self._read_mini_chain(start, size)
+        return self._read_chain(start, size)
+
+
+class MSIFile(CompoundFile):
+    """An MSI database opened for reading."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._strings = None
+        self._string_ref_size = 2
+
+    def strings(self):
+        """Returns the string pool, indexed by string id (id 0 is the null string)."""
+        if self._strings is not None:
+            return self._strings
+        pool = self.read_stream(f"{TABLE_PREFIX}_StringPool")
+        data = self.read_stream(f"{TABLE_PREFIX}_StringData")
+        try:
+            self._strings = self._parse_string_pool(pool, data)
+        except struct.error as err:
+            raise MSIError(f"{self.path} has a corrupt string pool") from err
+        return self._strings
+
+    def _parse_string_pool(self, pool, data):
+        codepage, flags = struct.unpack_from("<HH", pool, 0)
+        codepage |= (flags & 0x3FFF) << 16
+        if flags & 0x8000:
+            self._string_ref_size = 3
+        encoding = python_encoding(codepage)
+
+        strings = [None]
+        entry = 1
+        count = len(pool) // 4
+        offset = 0
+        while entry < count:
+            length, refs = struct.unpack_from("<HH", pool, entry * 4)
+            if length == 0 and refs == 0:
+                strings.append("")
+                entry += 1
+                continue
+            if length == 0:
+                # Strings over 64k store their length in the following entry.
+                low, high = struct.unpack_from("<HH", pool, (entry + 1) * 4)
+                length = (high << 16) | low
+                entry += 2
+            else:
+                entry += 1
+            strings.append(data[offset:offset + length].decode(encoding, "replace"))
+            offset += length
+        return strings
+
+    def _string_refs(self, data, count, start):
+        size = self._string_ref_size
+        return [
+            int.from_bytes(data[(start + row) * size:(start + row + 1) * size], "little")
+            for row in range(count)
+        ]
+
+    def properties(self):
+        """Returns the Property table as a dictionary."""
+        strings = self.strings()
+        table = self.read_stream(f"{TABLE_PREFIX}Property")
+        # Tables are stored column by column: every Property, then every Value.
+        rows = len(table) // (2 * self._string_ref_size)
+        names = self._string_refs(table, rows, 0)
+        values = self._string_refs(table, rows, rows)
+        try:
+            return {strings[name]: strings[value] or "" for name, value in zip(names, values)}
+        except IndexError as err:
+            raise MSIError(f"{self.path} has a corrupt Property table") from err
+
+    def summary_information(self):
+        """Returns the SummaryInformation properties as a dictionary keyed by property id."""
+        data = self.read_stream(SUMMARY_INFORMATION)
+        try:
+            return self._parse_summary_information(data)
+        except (struct.error, OverflowError) as err:
+            raise MSIError(f"{self.path} has a corrupt SummaryInformation stream") from err
+
+    def _parse_summary_information(self, data):
+        (section,) = struct.unpack_from("<I", data, 44)
+        (count,) = struct.unpack_from("<I", data, section + 4)
+        raw = {}
+        for index in range(count):
+            pid, offset = struct.unpack_from("<II", data, section + 8 + index * 8)
+            raw[pid] = section + offset
+
+        codepage = 1252
+        if PID_CODEPAGE in raw:
+            codepage = struct.unpack_from("<H", data, raw[PID_CODEPAGE] + 4)[0]
+        encoding = python_encoding(codepage)
+
+        summary = {}
+        for pid, offset in raw.items():
+            (value_type,) = struct.unpack_from("<I", data, offset)
+            value_type &= 0xFFFF
+            if value_type == VT_I2:
+                summary[pid] = struct.unpack_from("<h", data, offset + 4)[0]
+            elif value_type == VT_I4:
+                summary[pid] = struct.unpack_from("<i", data, offset + 4)[0]
+            elif value_type == VT_LPSTR:
+                (length,) = struct.unpack_from("<I", data, offset + 4)
+                value = data[offset + 8:offset + 8 + length]
+                summary[pid] = value.rstrip(b"\x00").decode(encoding, "replace")
+            elif value_type == VT_FILETIME:
+                (ticks,) = struct.unpack_from("<Q", data, offset + 4)
+                summary[pid] = datetime.datetime(1601, 1, 1) + datetime.timedelta(
+                    microseconds=ticks // 10
+                )
+        return summary
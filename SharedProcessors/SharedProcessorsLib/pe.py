@@ -0,0 +1,173 @@
+"""
+Pure-Python reader for the VS_VERSIONINFO resource of Windows PE (.exe) files.
+
+The file is memory-mapped and only the headers, the section table and the pages
+holding the version resource are read, so the cost does not depend on the size
+of the installer payload appended to the executable.
+"""
+
+import mmap
+import struct
+
+__all__ = ["PEError", "read_version_info"]
+
+RT_VERSION = 16
+IMAGE_DIRECTORY_ENTRY_RESOURCE = 2
+VS_FFI_SIGNATURE = 0xFEEF04BD
+
+
+class PEError(Exception):
+    """Raised when a file can't be read as a PE file with version information."""
+
+
+def _align4(offset):
+    return (offset + 3) & ~3
+
+
+class _PEImage:
+    """Minimal view of a memory-mapped PE image."""
+
+    def __init__(self, data):
+        self.data = data
+        if data[:2] != b"MZ":
+            raise PEError("missing MZ header")
+        (pe_offset,) = struct.unpack_from("<I", data, 0x3C)
+        if data[pe_offset:pe_offset + 4] != b"PE\x00\x00":
+            raise PEError("missing PE signature")
+        num_sections, optional_size = struct.unpack_from("<H12xH", data, pe_offset + 6)
+        optional = pe_offset + 24
+        (magic,) = struct.unpack_from("<H", data, optional)
+        if magic == 0x10B:
+            count_offset, directories = optional + 92, optional + 96
+        elif magic == 0x20B:
+            count_offset, directories = optional + 108, optional + 112
+        else:
+            raise PEError(f"unknown optional header magic {magic:#x}")
+        (num_directories,) = struct.unpack_from("<I", data, count_offset)
+        if num_directories <= IMAGE_DIRECTORY_ENTRY_RESOURCE:
+            raise PEError("no resource directory")
+        self.resource_rva, _ = struct.unpack_from(
+            "<II", data, directories + IMAGE_DIRECTORY_ENTRY_RESOURCE * 8
+        )
+        if not self.resource_rva:
+            raise PEError("no resource directory")
+        self.sections = []
+        table = optional + optional_size
+        for index in range(num_sections):
+            virtual_size, virtual_address, raw_size, raw_offset = struct.unpack_from(
+                "<IIII", data, table + index * 40 + 8
+            )
+            self.sections.append(
+                (virtual_address, max(virtual_size, raw_size), raw_offset)
+            )
+
+    def offset(self, rva):
+        """Maps a relative virtual address to a file offset."""
+        for virtual_address, size, raw_offset in self.sections:
+            if virtual_address <= rva < virtual_address + size:
+                return rva - virtual_address + raw_offset
+        raise PEError(f"RVA {rva:#x} is outside of every section")
+
+    def version_resource(self):
+        """Returns the raw bytes of the first RT_VERSION resource."""
+        base = self.offset(self.resource_rva)
+        entry = self._find_entry(base, base, RT_VERSION)
+        # Below the type level take the first name and the first language.
+        for _ in range(2):
+            if not entry & 0x80000000:
+                break
+            entry = self._find_entry(base, base + (entry & 0x7FFFFFFF), None)
+        if entry & 0x80000000:
+            raise PEError("malformed resource directory")
+        data_rva, size = struct.unpack_from("<II", self.data, base + entry)
+        start = self.offset(data_rva)
+        return self.data[start:start + size]
+
+    def _find_entry(self, base, directory, wanted_id):
+        named, ids = struct.unpack_from("<HH", self.data, directory + 12)
+        for index in range(named + ids):
+            name, target = struct.unpack_from("<II", self.data, directory + 16 + index * 8)
+            if wanted_id is None or (not name & 0x80000000 and name == wanted_id):
+                return target
+        raise PEError("no version resource")
+
+
+def _block(data, offset):
+    """Parses the header of a VS_VERSIONINFO style block."""
+    length, value_length, value_type = struct.unpack_from("<HHH", data, offset)
+    if length < 6:
+        raise PEError("malformed version resource")
+    key_start = key_end = offset + 6
+    while data[key_end:key_end + 2] not in (b"\x00\x00", b""):
+        key_end += 2
+    key = data[key_start:key_end].decode("utf-16-le", "replace")
+    return key, value_length, value_type, _align4(key_end + 2), offset + length
+
+
+def _children(data, start, end):
+    offset = _align4(start)
+    while offset < end:
+        block = _block(data, offset)
+        yield block
+        offset = _align4(block[4])
+
+
+def parse_version_info(data):
+    """Parses a VS_VERSIONINFO resource into a dictionary of its string values."""
+    key, value_length, _, value_offset, end = _block(data, 0)
+    if key != "VS_VERSION_INFO":
+        raise PEError("malformed version resource")
+    info = {}
+    if value_length >= 52:
+        signature, = struct.unpack_from("<I", data, value_offset)
+        if signature == VS_FFI_SIGNATURE:
+            file_ms, file_ls, product_ms, product_ls = struct.unpack_from(
+                "<IIII", data, value_offset + 8
+            )
+            info["FileVersionNumber"] = (
+                f"{file_ms >> 16}.{file_ms & 0xFFFF}.{file_ls >> 16}.{file_ls & 0xFFFF}"
+            )
+            info["ProductVersionNumber"] = (
+                f"{product_ms >> 16}.{product_ms & 0xFFFF}."
+                f"{product_ls >> 16}.{product_ls & 0xFFFF}"
+            )
+    for child_key, _, _, child_value, child_end in _children(
+        data, value_offset + value_length, end
+    ):
+        if child_key != "StringFileInfo":
+            continue
+        # Like exiftool, the first string table wins.
+        for _, _, _, table_value, table_end in _children(data, child_value, child_end):
+            for name, length, _, string_value, string_end in _children(
+                data, table_value, table_end
+            ):
+                raw = data[string_value:string_end] if length else b""
+                value = raw.decode("utf-16-le", "replace").split("\x00")[0]
+                info.setdefault(name, value.strip())
+            break
+    return info
+
+
+def read_version_info(path):
+    """
+    Returns the version information of a PE file as a dictionary, e.g.
+    {"ProductName": ..., "ProductVersion": ..., "ProductVersionNumber": "1.2.3.4"}.
+    ProductVersion falls back to the fixed-size version number when the string
+    table doesn't have one.
+    """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as err:
+            raise PEError(f"{path} is empty") from err
+        try:
+            info = parse_version_info(_PEImage(data).version_resource())
+        except (struct.error, IndexError) as err:
+            raise PEError(f"{path} has a malformed PE header: {err}") from err
+        except PEError as err:
+            raise PEError(f"{path}: {err}") from err
+        finally:
+            data.close()
+    if "ProductVersion" not in info and "ProductVersionNumber" in info:
+        info["ProductVersion"] = info["ProductVersionNumber"]
+    return info
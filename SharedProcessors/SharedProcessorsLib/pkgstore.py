@@ -0,0 +1,121 @@
+"""
+Content-addressed package storage for file based repos.
+
+Every payload is stored once under <store>/sha256/<first two hex digits>/<sha256>
+and the paths clients download from are hardlinks to that blob, so the same
+installer imported into several catalogs or subdirectories takes up space once.
+
+Blobs are created with the cheapest copy the filesystem offers: a clone
+(clonefile on APFS, FICLONE on btrfs/XFS), then copy_file_range, then a plain
+buffered copy.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import shutil
+import sys
+
+__all__ = ["blob_path", "clone_file", "add_to_store", "link_into_place"]
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+_libc = None
+
+
+def _clonefile(src, dst):
+    """macOS clonefile(2), raises OSError if the filesystem can't clone"""
+    global _libc  # pylint: disable=global-statement
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if _libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), dst)
+
+
+def clone_file(src, dst):
+    """
+    Copies src to dst, which must not exist yet. Returns how the copy was made:
+    clone, copy_file_range or copy.
+    """
+    if sys.platform == "darwin":
+        try:
+            _clonefile(src, dst)
+            return "clone"
+        except (OSError, AttributeError):
+            pass
+    with open(src, "rb") as src_f, open(dst, "xb") as dst_f:
+        if sys.platform.startswith("linux"):
+            try:
+                fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+                return "clone"
+            except OSError:
+                pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(src_f.fileno(), dst_f.fileno(), 1 << 30):
+                    pass
+                return "copy_file_range"
+            except OSError as err:
+                if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                src_f.seek(0)
+                dst_f.seek(0)
+                dst_f.truncate()
+        shutil.copyfileobj(src_f, dst_f, 1 << 20)
+    return "copy"
+
+
+def blob_path(store, sha256):
+    """Location of the blob for a sha256 digest in a store."""
+    sha256 = sha256.lower()
+    return os.path.join(store, "sha256", sha256[:2], sha256)
+
+
+def add_to_store(store, src, sha256):
+    """
+    Makes sure the store holds the content of src, whose digest the caller already
+    knows. Returns (blob path, how it was copied), how is None if it was already stored.
+    """
+    blob = blob_path(store, sha256)
+    if os.path.exists(blob):
+        return blob, None
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    tmp_path = f"{blob}.{os.getpid()}.tmp"
+    try:
+        method = clone_file(src, tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, blob)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return blob, method
+
+
+def link_into_place(blob, dest):
+    """
+    Atomically points dest at blob with a hardlink. Falls back to a copy when
+    hardlinks are not possible, e.g. across filesystems. Returns link, unchanged
+    or the copy method used.
+    """
+    try:
+        if os.path.samefile(blob, dest):
+            return "unchanged"
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_path = f"{dest}.{os.getpid()}.tmp"
+    try:
+        try:
+            os.link(blob, tmp_path)
+            method = "link"
+        except OSError:
+            method = clone_file(blob, tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return method
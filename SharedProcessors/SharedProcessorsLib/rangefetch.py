@@ -0,0 +1,412 @@
+"""
+Resumable, multi-connection HTTP downloads.
+
+The payload is split into contiguous byte ranges fetched in parallel, each on
+its own connection, and written with positional writes into a preallocated
+<path>.part file, so memory stays at one chunk per connection regardless of the
+payload size. Progress is checkpointed in a <path>.download.json sidecar after
+the data it covers has been flushed, an interrupted download resumes from there
+as long as the server still reports the same size, ETag and Last-Modified.
+
+While the segments are being written, a follower thread hashes the completed
+prefix of the file in order, so verifying a digest doesn't need another pass
+over the payload once the last byte arrived.
+
+Servers that don't honour Range requests get a single sequential stream.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import re
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+
+try:
+    import certifi
+except ImportError:  # pragma: no cover - AutoPkg's Python ships certifi
+    certifi = None
+
+__all__ = ["DownloadError", "RangeDownload", "digest_algorithm"]
+
+CHUNK_SIZE = 1 << 20
+# Checkpoint the sidecar at most this often, each checkpoint flushes the part file.
+CHECKPOINT_BYTES = 64 << 20
+CHECKPOINT_SECONDS = 5
+# Segments smaller than this aren't worth another connection.
+MIN_SEGMENT_SIZE = 8 << 20
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    """Raised when a download can't be completed or verified."""
+
+
+def digest_algorithm(digest):
+    """hashlib algorithm name of a hex digest, guessed from its length"""
+    return {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}.get(len(digest or ""))
+
+
+def _ssl_context():
+    if certifi is not None:
+        return ssl.create_default_context(cafile=certifi.where())
+    return ssl.create_default_context()
+
+
+def _sync(fd):
+    (getattr(os, "fdatasync", None) or os.fsync)(fd)
+
+
+class _PrefixHasher(threading.Thread):
+    """Hashes the file in order as the contiguous downloaded prefix grows."""
+
+    def __init__(self, download, algorithm):
+        super().__init__(name="rangefetch-hash", daemon=True)
+        self.download = download
+        self.hasher = hashlib.new(algorithm)
+        self.position = 0
+        self.error = None
+
+    def run(self):
+        download = self.download
+        try:
+            while True:
+                with download.condition:
+                    while (
+                        download.contiguous() <= self.position
+                        and self.position < download.size
+                        and not download.aborted
+                    ):
+                        download.condition.wait(1)
+                    if download.aborted:
+                        return
+                    frontier = download.contiguous()
+                if self.position >= download.size:
+                    return
+                while self.position < frontier and not download.aborted:
+                    size = min(CHUNK_SIZE, frontier - self.position)
+                    data = os.pread(download.fd, size, self.position)
+                    if not data:
+                        raise DownloadError(f"Short read at {self.position} in {download.part_path}")
+                    self.hasher.update(data)
+                    self.position += len(data)
+        except Exception as err:  # pylint: disable=broad-except
+            self.error = err
+
+    def hexdigest(self):
+        """the digest once the whole file was hashed"""
+        self.join()
+        if self.error:
+            raise self.error
+        return self.hasher.hexdigest()
+
+
+class RangeDownload:
+    """
+    Downloads url to path. run() returns a dictionary with changed, size,
+    resumed (bytes that didn't need downloading again) and digest if
+    expected_digest was given.
+    """
+
+    def __init__(
+        self,
+        url,
+        path,
+        headers=None,
+        segments=8,
+        timeout=60,
+        retries=3,
+        expected_size=None,
+        expected_digest=None,
+        log=None,
+    ):
+        self.url = url
+        self.path = path
+        self.part_path = f"{path}.part"
+        self.state_path = f"{path}.download.json"
+        self.headers = dict(headers or {})
+        self.max_segments = max(1, int(segments))
+        self.timeout = timeout
+        self.retries = retries
+        self.expected_size = int(expected_size) if expected_size else None
+        self.expected_digest = (expected_digest or "").lower() or None
+        self.algorithm = digest_algorithm(self.expected_digest)
+        if self.expected_digest and not self.algorithm:
+            raise DownloadError(f"Can't tell the algorithm of digest {expected_digest}")
+        self.log = log or (lambda message: None)
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPSHandler(context=_ssl_context())
+        )
+        self.condition = threading.Condition()
+        self.state_lock = threading.Lock()
+        self.aborted = False
+        self.fd = None
+        self.size = None
+        self.segments = []
+        self.remote = {}
+        self.unsynced = 0
+        self.last_checkpoint = 0
+
+    def open(self, byte_range=None):
+        """GET response for url, optionally for a byte range (start, end inclusive)"""
+        request = urllib.request.Request(self.url, headers=self.headers)
+        if byte_range:
+            request.add_header("Range", f"bytes={byte_range[0]}-{byte_range[1]}")
+        return self.opener.open(request, timeout=self.timeout)
+
+    def probe(self):
+        """size, validators and Range support of the remote file"""
+        try:
+            with self.open((0, 0)) as response:
+                headers = response.headers
+                content_range = CONTENT_RANGE.match(headers.get("Content-Range", ""))
+                ranges = response.status == 206 and content_range and content_range.group(3) != "*"
+                if ranges:
+                    size = int(content_range.group(3))
+                elif headers.get("Content-Length"):
+                    size = int(headers["Content-Length"])
+                else:
+                    size = None
+        except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError) as err:
+            raise DownloadError(f"Unable to reach {self.url}: {err}") from err
+        return {
+            "url": self.url,
+            "size": size,
+            "ranges": bool(ranges),
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+
+    def load_state(self):
+        """the sidecar, or None"""
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def same_remote(self, state):
+        """whether a sidecar describes the file the server has now"""
+        if not state:
+            return False
+        for key in ("url", "size", "etag", "last_modified"):
+            if state.get(key) != self.remote[key]:
+                return False
+        # Without validators a changed file could keep its size, only trust it if
+        # the digest is going to be verified anyway.
+        return bool(self.remote["etag"] or self.remote["last_modified"] or self.expected_digest)
+
+    def save_state(self, segments=None, complete=False, digest=None):
+        """atomically writes the sidecar"""
+        state = dict(self.remote, complete=complete)
+        if complete:
+            state["digest"] = digest
+            state["mtime_ns"] = os.stat(self.path).st_mtime_ns
+        else:
+            state["segments"] = segments
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def checkpoint(self, written, force=False):
+        """flushes the part file and records progress, throttled"""
+        with self.state_lock:
+            self.unsynced += written
+            now = time.monotonic()
+            if not force and self.unsynced < CHECKPOINT_BYTES and now - self.last_checkpoint < CHECKPOINT_SECONDS:
+                return
+            # Progress is only recorded for data that reached the disk.
+            with self.condition:
+                segments = [list(segment) for segment in self.segments]
+            _sync(self.fd)
+            self.save_state(segments)
+            self.unsynced = 0
+            self.last_checkpoint = now
+
+    def plan_segments(self):
+        """splits the file in contiguous [start, end, done] segments"""
+        if not self.remote["ranges"]:
+            return [[0, self.size, 0]]
+        count = max(1, min(self.max_segments, self.size // MIN_SEGMENT_SIZE))
+        bounds = [self.size * index // count for index in range(count + 1)]
+        return [[bounds[index], bounds[index + 1], 0] for index in range(count)]
+
+    def contiguous(self):
+        """bytes downloaded from the start of the file without a gap, call with condition held"""
+        total = 0
+        for start, end, done in self.segments:
+            total = start + done
+            if start + done < end:
+                break
+        return total
+
+    def fetch_segment(self, segment):
+        """downloads the rest of one segment, retrying from where it stopped"""
+        attempt = 0
+        while True:
+            start, end, done = segment
+            if start + done >= end:
+                return
+            try:
+                if self.remote["ranges"]:
+                    response = self.open((start + done, end - 1))
+                    if response.status != 206:
+                        response.close()
+                        raise DownloadError(f"{self.url} ignored the Range header")
+                else:
+                    # Without Range support there is no resuming, start over.
+                    with self.condition:
+                        segment[2] = 0
+                    response = self.open()
+                with response:
+                    buffer = bytearray(CHUNK_SIZE)
+                    while not self.aborted:
+                        size = response.readinto(buffer)
+                        if not size:
+                            break
+                        size = min(size, end - start - segment[2])
+                        os.pwrite(self.fd, memoryview(buffer)[:size], start + segment[2])
+                        with self.condition:
+                            segment[2] += size
+                            self.condition.notify_all()
+                        self.checkpoint(size)
+                        if start + segment[2] >= end:
+                            break
+                if self.aborted:
+                    return
+                if start + segment[2] < end:
+                    raise DownloadError(
+                        f"Connection closed at {start + segment[2]} of {start}-{end - 1}"
+                    )
+                return
+            except (urllib.error.URLError, http.client.HTTPException, OSError, DownloadError) as err:
+                # HTTPException: IncompleteRead, BadStatusLine, RemoteDisconnected...
+                attempt += 1
+                if attempt > self.retries or self.aborted:
+                    raise DownloadError(f"Segment {start}-{end - 1} failed: {err}") from err
+                self.log(f"Retrying segment {start}-{end - 1} at {start + segment[2]}: {err}")
+                time.sleep(min(2 ** attempt, 30))
+
+    def is_current(self, state):
+        """whether path already holds the complete remote file"""
+        return (
+            state is not None
+            and state.get("complete")
+            and self.same_remote(state)
+            and os.path.isfile(self.path)
+            and os.path.getsize(self.path) == self.size
+            and os.stat(self.path).st_mtime_ns == state.get("mtime_ns")
+            and (not self.expected_digest or state.get("digest") == self.expected_digest)
+        )
+
+    def run(self):
+        """downloads or resumes the file, returns what happened"""
+        self.remote = self.probe()
+        self.size = self.remote["size"]
+        if self.size is None:
+            raise DownloadError(f"{self.url} didn't report a size")
+        if self.expected_size is not None and self.size != self.expected_size:
+            raise DownloadError(
+                f"{self.url} has {self.size} bytes, {self.expected_size} were expected"
+            )
+        state = self.load_state()
+        if self.is_current(state):
+            return {"changed": False, "size": self.size, "resumed": self.size,
+                    "digest": state.get("digest")}
+
+        if (
+            self.same_remote(state)
+            and not state.get("complete")
+            and os.path.isfile(self.part_path)
+            and os.path.getsize(self.part_path) == self.size
+            and self.remote["ranges"]
+        ):
+            self.segments = [list(segment) for segment in state["segments"]]
+        else:
+            self.segments = self.plan_segments()
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+        resumed = sum(segment[2] for segment in self.segments)
+        if resumed:
+            self.log(f"Resuming {self.url} at {resumed} of {self.size} bytes")
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        hasher = None
+        try:
+            if os.fstat(self.fd).st_size != self.size:
+                if hasattr(os, "posix_fallocate") and self.size:
+                    try:
+                        os.posix_fallocate(self.fd, 0, self.size)
+                    except OSError:
+                        os.ftruncate(self.fd, self.size)
+                else:
+                    os.ftruncate(self.fd, self.size)
+            self.save_state([list(segment) for segment in self.segments])
+            hasher = _PrefixHasher(self, self.algorithm) if self.algorithm else None
+            if hasher:
+                hasher.start()
+            try:
+                self.fetch_all()
+            finally:
+                # Also reached when interrupted, keep what was downloaded for a resume.
+                self.checkpoint(0, force=True)
+            digest = hasher.hexdigest() if hasher else None
+        except BaseException:
+            self.aborted = True
+            with self.condition:
+                self.condition.notify_all()
+            if hasher:
+                hasher.join()
+            raise
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+        if self.expected_digest and digest != self.expected_digest:
+            os.remove(self.part_path)
+            os.remove(self.state_path)
+            raise DownloadError(
+                f"{self.algorithm} of {self.url} is {digest}, {self.expected_digest} was expected"
+            )
+        os.replace(self.part_path, self.path)
+        self.save_state(complete=True, digest=digest)
+        return {"changed": True, "size": self.size, "resumed": resumed, "digest": digest}
+
+    def fetch_all(self):
+        """runs one thread per unfinished segment, raises the first failure"""
+        errors = []
+
+        def worker(segment):
+            try:
+                self.fetch_segment(segment)
+            except BaseException as err:  # pylint: disable=broad-except
+                errors.append(err)
+                self.aborted = True
+                with self.condition:
+                    self.condition.notify_all()
+
+        threads = [
+            threading.Thread(target=worker, args=(segment,), name="rangefetch", daemon=True)
+            for segment in self.segments
+            if segment[0] + segment[2] < segment[1]
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            # The part file is closed after this returns, no thread may still write to it.
+            if any(thread.is_alive() for thread in threads):
+                self.aborted = True
+                for thread in threads:
+                    thread.join()
+        if errors:
+            raise errors[0]
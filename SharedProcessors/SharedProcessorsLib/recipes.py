@@ -0,0 +1,264 @@
+"""
+Reading and flattening the recipes of this repo outside of AutoPkg.
+
+A recipe is flattened the way AutoPkg runs it: the Input of every recipe in
+the ParentRecipe chain is merged with the child's values winning, and the
+Process lists are concatenated parent first.
+
+compile_recipes keeps the parsed and flattened recipes in a JSON cache, keyed
+by the recipe files' size and mtime with their sha256 as a fallback, so only
+recipes that changed are parsed again.
+"""
+
+import hashlib
+import json
+import os
+import plistlib
+
+from ruamel.yaml import YAML
+
+__all__ = [
+    "RecipeError",
+    "load_recipe",
+    "find_recipes",
+    "index_recipes",
+    "select_recipes",
+    "recipe_chain",
+    "flatten_recipe",
+    "processor_name",
+    "shared_processors",
+    "compile_recipes",
+]
+
+RECIPE_SUFFIXES = (".recipe.yaml", ".recipe", ".recipe.plist")
+CACHE_VERSION = 1
+
+
+class RecipeError(Exception):
+    """Raised for recipes that can't be read or resolved."""
+
+
+def parse_recipe(path, data):
+    """parses the bytes of a YAML or plist recipe"""
+    try:
+        if path.endswith(".yaml"):
+            recipe = YAML(typ="safe").load(data)
+        else:
+            recipe = plistlib.loads(data)
+    except Exception as err:  # pylint: disable=broad-except
+        raise RecipeError(f"Unable to read {path}: {err}") from err
+    if not isinstance(recipe, dict):
+        raise RecipeError(f"{path} is not a recipe")
+    return recipe
+
+
+def load_recipe(path):
+    """parses a YAML or plist recipe"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as err:
+        raise RecipeError(f"Unable to read {path}: {err}") from err
+    return parse_recipe(path, data)
+
+
+def find_recipes(paths):
+    """expands directories to the recipes below them"""
+    recipes = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+                recipes.extend(
+                    os.path.join(root, name)
+                    for name in sorted(files)
+                    if name.endswith(RECIPE_SUFFIXES)
+                )
+        else:
+            recipes.append(path)
+    return recipes
+
+
+def index_recipes(paths, loaded=None):
+    """identifier to {"path", "recipe"} for every recipe found below paths"""
+    recipes = {}
+    for path in find_recipes(paths):
+        recipe = loaded[path] if loaded is not None else load_recipe(path)
+        identifier = recipe.get("Identifier")
+        if not identifier:
+            raise RecipeError(f"{path} has no Identifier")
+        if identifier in recipes:
+            raise RecipeError(
+                f"{identifier} is defined in {recipes[identifier]['path']} and {path}"
+            )
+        recipes[identifier] = {"path": path, "recipe": recipe}
+    return recipes
+
+
+def select_recipes(selectors, root, cache_path=None):
+    """
+    indexes the recipes below root and the given paths, returns the index and the
+    identifiers selected by path, directory or identifier, all of root if none are;
+    with a cache_path the index is compiled, see compile_recipes
+    """
+    selectors = list(selectors or [root])
+    paths = [selector for selector in selectors if os.path.exists(selector)]
+    # Recipes given by path find their parents next to them, directories below
+    # one already searched are left out so no recipe is indexed twice.
+    search = []
+    for directory in sorted(
+        [os.path.realpath(root)]
+        + [os.path.realpath(path if os.path.isdir(path) else os.path.dirname(path) or ".")
+           for path in paths],
+        key=len,
+    ):
+        if not any(directory == known or directory.startswith(known + os.sep) for known in search):
+            search.append(directory)
+    if cache_path:
+        recipes = compile_recipes(search, cache_path)
+    else:
+        recipes = index_recipes(search)
+    by_path = {os.path.realpath(recipe["path"]): identifier for identifier, recipe in recipes.items()}
+    selected = [by_path[os.path.realpath(path)] for path in find_recipes(paths)]
+    for selector in selectors:
+        if selector in paths:
+            continue
+        if selector not in recipes:
+            raise RecipeError(f"No recipe {selector}")
+        selected.append(selector)
+    return recipes, list(dict.fromkeys(selected))
+
+
+def recipe_chain(identifier, recipes):
+    """identifiers from the root parent down to identifier"""
+    chain = []
+    while identifier:
+        if identifier in chain:
+            raise RecipeError(f"ParentRecipe cycle: {' -> '.join(chain + [identifier])}")
+        if identifier not in recipes:
+            if chain:
+                raise RecipeError(f"{chain[-1]} has an unknown ParentRecipe {identifier}")
+            raise RecipeError(f"Unknown recipe {identifier}")
+        chain.append(identifier)
+        identifier = recipes[identifier]["recipe"].get("ParentRecipe")
+    return chain[::-1]
+
+
+def flatten_recipe(identifier, recipes):
+    """the recipe as AutoPkg runs it, with its chain in ParentRecipes"""
+    chain = recipe_chain(identifier, recipes)
+    merged_input = {}
+    process = []
+    for link in chain:
+        recipe = recipes[link]["recipe"]
+        # SharedProcessors.recipe.yaml has placeholder lists, not dictionaries.
+        if isinstance(recipe.get("Input"), dict):
+            merged_input.update(recipe["Input"])
+        process.extend(step for step in recipe.get("Process") or [] if isinstance(step, dict))
+    recipe = recipes[identifier]["recipe"]
+    return {
+        "Identifier": identifier,
+        "Description": recipe.get("Description", ""),
+        "MinimumVersion": recipe.get("MinimumVersion", ""),
+        "ParentRecipes": chain[:-1],
+        "Input": merged_input,
+        "Process": process,
+    }
+
+
+def processor_name(step):
+    """the processor of a Process step without its recipe prefix"""
+    return str(step.get("Processor", "")).strip().rsplit("/", 1)[-1]
+
+
+def shared_processors(recipe):
+    """the processors of a flattened recipe that come from a recipe, e.g. SharedProcessors"""
+    return sorted({
+        str(step["Processor"]).strip()
+        for step in recipe["Process"]
+        if "/" in str(step.get("Processor", ""))
+    })
+
+
+def source_stat(path):
+    """size and mtime of a recipe file, what the cache is checked against"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_cache(cache_path):
+    """the compiled recipes cache, empty if missing, unreadable or outdated"""
+    try:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache
+
+
+def compile_recipes(roots, cache_path):
+    """
+    index_recipes for the recipes below roots, with every chain flattened under
+    "flattened" (or the reason it can't be under "error") and its shared processors
+    under "shared_processors". Unchanged recipe files are taken from the cache
+    at cache_path, which is rewritten if anything changed.
+    """
+    roots = [os.path.realpath(root) for root in roots]
+    cache = read_cache(cache_path)
+    cached = cache.get("sources", {})
+    sources = {}
+    changed = cache.get("roots") != roots
+    for path in find_recipes(roots):
+        stat = source_stat(path)
+        entry = cached.get(path)
+        if entry and entry["stat"] == stat:
+            sources[path] = entry
+            continue
+        changed = True
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as err:
+            raise RecipeError(f"Unable to read {path}: {err}") from err
+        digest = hashlib.sha256(data).hexdigest()
+        if entry and entry["sha256"] == digest:
+            # Touched, not edited.
+            sources[path] = dict(entry, stat=stat)
+            continue
+        sources[path] = {"stat": stat, "sha256": digest, "recipe": parse_recipe(path, data)}
+    if not changed and sources.keys() == cached.keys():
+        recipes = cache["recipes"]
+        for entry in recipes.values():
+            entry["recipe"] = sources[entry["path"]]["recipe"]
+        return recipes
+
+    recipes = index_recipes(roots, {path: source["recipe"] for path, source in sources.items()})
+    for identifier, entry in recipes.items():
+        try:
+            entry["flattened"] = flatten_recipe(identifier, recipes)
+            entry["shared_processors"] = shared_processors(entry["flattened"])
+        except RecipeError as err:
+            entry["error"] = str(err)
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        # Plist recipes may hold dates or data, they only matter as strings here.
+        json.dump(
+            {
+                "version": CACHE_VERSION,
+                "roots": roots,
+                "sources": sources,
+                # The unflattened recipes are in sources already.
+                "recipes": {
+                    identifier: {key: value for key, value in entry.items() if key != "recipe"}
+                    for identifier, entry in recipes.items()
+                },
+            },
+            f,
+            separators=(",", ":"),
+            default=str,
+        )
+    os.replace(tmp_path, cache_path)
+    return recipes
@@ -0,0 +1,221 @@
+"""
+Spans and counters for the hot paths of the shared processors.
+
+A processor runs its main inside tracing(path, name). Anything it calls,
+including the helpers here and code on worker threads, can then open spans
+with span("stage") and count bytes and subprocesses with add(). A span
+adds its counters to the span it is nested in on the same thread when it
+ends, so outer spans carry totals. Every span is appended to path as soon
+as it ends, which means several processors of one AutoPkg run can share
+the file:
+
+- *.jsonl gets one JSON object per line,
+- anything else gets Chrome trace events, viewable in chrome://tracing or
+  Perfetto. The trailing ] is left off, which the format allows for traces
+  that are still being appended to.
+
+Without a path, span() hands out one shared no-op span and add() returns
+immediately, so instrumented code costs next to nothing.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+__all__ = ["tracing", "span", "add", "counted", "enabled"]
+
+
+class NullSpan:
+    """What span() returns while tracing is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, **counters):
+        """ignores counters"""
+
+    def set(self, **attributes):
+        """ignores attributes"""
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """A timed stage with counters, written out when it ends."""
+
+    __slots__ = ("tracer", "name", "attributes", "counters", "parent", "start", "started")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.counters = {}
+        self.parent = None
+        self.start = None
+        self.started = None
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.start = time.time_ns()
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter_ns() - self.started
+        stack = self.tracer.stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        if self.parent is not None:
+            for counter, value in self.counters.items():
+                self.parent.counters[counter] = self.parent.counters.get(counter, 0) + value
+        self.tracer.emit(self, duration)
+        return False
+
+    def add(self, **counters):
+        """adds to counters such as bytes or subprocesses"""
+        for counter, value in counters.items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set(self, **attributes):
+        """records attributes, e.g. whether a cache was hit"""
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Appends the spans of one processor run to a trace file."""
+
+    def __init__(self, path, process):
+        self.path = path
+        self.process = process
+        self.chrome = not path.endswith(".jsonl")
+        self.local = threading.local()
+        self.pid = os.getpid()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # O_APPEND keeps lines of concurrent writers, processes included, whole.
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if self.chrome and os.fstat(self.fd).st_size == 0:
+            os.write(self.fd, b"[\n")
+
+    def stack(self):
+        """the spans open on this thread"""
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def emit(self, current, duration):
+        """appends one ended span"""
+        if self.chrome:
+            event = {
+                "name": current.name,
+                "cat": self.process,
+                "ph": "X",
+                "ts": current.start // 1000,
+                "dur": duration // 1000,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": {**current.attributes, **current.counters},
+            }
+            line = json.dumps(event, default=str) + ",\n"
+        else:
+            event = {
+                "ts": current.start / 1e9,
+                "name": current.name,
+                "processor": self.process,
+                "parent": current.parent.name if current.parent else None,
+                "seconds": duration / 1e9,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                **current.counters,
+                **current.attributes,
+            }
+            line = json.dumps(event, default=str) + "\n"
+        try:
+            os.write(self.fd, line.encode())
+        except OSError:
+            # A full disk or closed trace must not fail the processor.
+            pass
+
+    def close(self):
+        """closes the trace file"""
+        os.close(self.fd)
+
+
+_TRACER = None
+
+
+@contextmanager
+def tracing(path, process):
+    """
+    traces everything run inside it to path under a root span named after
+    the process, does nothing if path is empty
+    """
+    global _TRACER  # pylint: disable=global-statement
+    if not path:
+        yield NULL_SPAN
+        return
+    _TRACER = Tracer(path, process)
+    try:
+        with Span(_TRACER, process, {}) as root:
+            yield root
+    finally:
+        _TRACER.close()
+        _TRACER = None
+
+
+def enabled():
+    """whether spans are being recorded in this process"""
+    # Forked worker processes inherit the tracer, their spans are left out.
+    return _TRACER is not None and _TRACER.pid == os.getpid()
+
+
+def span(name, **attributes):
+    """a new span named name, a shared no-op one while tracing is off"""
+    if not enabled():
+        return NULL_SPAN
+    return Span(_TRACER, name, attributes)
+
+
+def add(**counters):
+    """adds counters to the innermost span open on this thread, if any"""
+    if not enabled():
+        return
+    stack = _TRACER.stack()
+    if stack:
+        stack[-1].add(**counters)
+
+
+class CountingReader:
+    """File-like wrapper adding the bytes read to the innermost span."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, *args):
+        """reads and counts"""
+        data = self.stream.read(*args)
+        add(bytes=len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def counted(stream):
+    """stream, counting the bytes read from it while tracing is on"""
+    return CountingReader(stream) if enabled() else stream
@@ -0,0 +1,211 @@
+"""
+Metadata extraction for Windows installers (.msi and .exe), used by WinVersioner
+for single files and for batches. Everything here is module level so that it can
+run in worker processes.
+"""
+
+import os
+import re
+from subprocess import check_output, CalledProcessError
+
+from . import trace
+from .digests import submit_file_digests
+from .msi import MSIError, MSIFile, PID_COMMENTS
+from .pe import PEError, read_version_info
+
+__all__ = ["InstallerError", "INSTALLER_EXTENSIONS", "InstallerInspector", "inspect_installer"]
+
+INSTALLER_EXTENSIONS = ("msi", "exe")
+
+# Dict that can be referred to via the processor architecture to get binary path.
+BINARIES = {
+    "msi": {
+        "arm": "/opt/homebrew/bin/msiinfo",
+        "i386": "/usr/local/bin/msiinfo"
+    },
+    "exe": {
+        "arm": "/opt/homebrew/bin/exiftool",
+        "i386": "/usr/local/bin/exiftool"
+    }
+}
+
+_proc_arch = None
+
+
+class InstallerError(Exception):
+    """Raised when the metadata of an installer can't be determined."""
+
+
+def run_cmd(command):
+    """Runs a shell command and returns its output"""
+    with trace.span("subprocess", command=os.path.basename(command[0])) as stage:
+        stage.add(subprocesses=1)
+        try:
+            return check_output(command).decode("utf-8")
+        except (CalledProcessError, OSError):
+            raise InstallerError(f"Running of command: {command} has failed.")
+
+
+def get_proper_arch():
+    """Autopkg prebuilt python identifies as x86_64 using platform, so ask sysctl.
+    The answer is remembered for the life of the process."""
+    global _proc_arch  # pylint: disable=global-statement
+    if _proc_arch is None:
+        command = ["/usr/sbin/sysctl", "-n", "machdep.cpu.brand_string"]
+        _proc_arch = "arm" if "Apple" in run_cmd(command) else "i386"
+    return _proc_arch
+
+
+class InstallerInspector:
+    """Reads display name and version of one installer."""
+
+    def __init__(self, pathname, reader="auto"):
+        self.pathname = pathname
+        self.reader = reader
+        self.file_extension = self.get_file_extension()
+        self.properties = None
+        self.summary = None
+        self.metadata = None
+        self.binary = None
+        self.fallback_reason = None
+
+    def get_file_extension(self):
+        """determine whether its an msi or exe, Setup.MSI is an msi too"""
+        return self.pathname.split(".")[-1].lower()
+
+    def get_version(self):
+        """gets the version respected by add/or remove programs in control panel"""
+        if self.properties is not None:
+            try:
+                return self.properties["ProductVersion"]
+            except KeyError:
+                raise InstallerError("ProductVersion not found in provided metadata.")
+        patterns = {
+            "msi": r"\nProductVersion\t(.*)\r",
+            "exe": r"\nProduct Version\W*: (.*)\n"
+        }
+        # Chrome does its own thing...
+        pattern = patterns[self.file_extension]
+        matches = re.search(pattern, self.metadata)
+        if not matches:
+            raise InstallerError(f"We were not able to find {pattern} in provided metadata.")
+        return matches.group(1)
+
+    def get_chrome_version(self):
+        """google do their own thing"""
+        # freakin' chrome includes the right version in a comment field..
+        if self.summary is not None:
+            output = f"\nComments: {self.summary.get(PID_COMMENTS, '')}\n"
+        elif self.properties is not None:
+            # An .exe read natively, its VERSIONINFO has a Comments string too.
+            output = f"\nComments: {self.properties.get('Comments', '')}\n"
+        elif self.binary is not None:
+            command = [self.binary, "suminfo", self.pathname]
+            output = run_cmd(command)
+        else:
+            raise InstallerError(f"No metadata to read the Chrome version of {self.pathname} from")
+        pattern = "\nComments: (.*) Copyright.*"
+        matches = re.search(pattern, output)
+        if not matches:
+            raise InstallerError(
+                "Look into Chrome metadata, not match found in comment containing version info"
+            )
+        return matches.group(1)
+
+    def get_display_name(self):
+        """gets the installed (control panel) displayname"""
+        if self.properties is not None:
+            try:
+                return self.properties["ProductName"]
+            except KeyError:
+                raise InstallerError("ProductName not found in provided metadata.")
+        patterns = {
+            "msi": r"\nProductName\t(.*)\r",
+            "exe": r"\nProduct Name\W*: (.*)\n"
+        }
+        pattern = patterns[self.file_extension]
+        matches = re.search(pattern, self.metadata)
+        if not matches:
+            raise InstallerError(f"We were not able to find {pattern} in provided metadata.")
+        return matches.group(1)
+
+    def read_native_metadata(self):
+        """reads the MSI Property table and SummaryInformation or the PE
+        VERSIONINFO resource without any subprocess"""
+        with trace.span("metadata.native", extension=self.file_extension):
+            if self.file_extension == "exe":
+                self.properties = read_version_info(self.pathname)
+                return
+            with MSIFile(self.pathname) as msi:
+                self.properties = msi.properties()
+                self.summary = msi.summary_information()
+
+    def get_metadata_command(self):
+        """builds the msiinfo/exiftool command for the subprocess reader"""
+        try:
+            self.binary = BINARIES[self.file_extension][get_proper_arch()]
+        except KeyError:
+            raise InstallerError(f"Unsupported installer type: {self.file_extension}")
+        # Build the appropriate command based on the file extension and generated vars.
+        commands = {
+            "msi": [self.binary, "export", self.pathname, "Property"],
+            "exe": [self.binary, self.pathname]
+        }
+        return commands[self.file_extension]
+
+    def read_metadata(self):
+        """reads the metadata natively, or through msiinfo/exiftool"""
+        if self.reader != "subprocess" and self.file_extension in INSTALLER_EXTENSIONS:
+            try:
+                self.read_native_metadata()
+            except (MSIError, PEError, OSError) as err:
+                if self.reader == "native":
+                    raise InstallerError(f"Unable to read {self.pathname}: {err}")
+                self.fallback_reason = str(err)
+                self.properties = None
+                self.summary = None
+        if self.properties is None:
+            try:
+                self.metadata = run_cmd(self.get_metadata_command())
+            except InstallerError as err:
+                if self.fallback_reason:
+                    raise InstallerError(f"{err} Native reader: {self.fallback_reason}")
+                raise
+            if not self.metadata:
+                raise InstallerError(f"We were not able to produce metadata for {self.pathname}")
+
+    def inspect(self):
+        """returns display name, version and extension as processor outputs"""
+        self.read_metadata()
+        outputs = {
+            "pkg_display_name": self.get_display_name(),
+            "pkg_file_extension": self.file_extension,
+        }
+        if "chrome" in outputs["pkg_display_name"].lower():
+            outputs["pkg_version"] = self.get_chrome_version()
+        else:
+            outputs["pkg_version"] = self.get_version()
+        return outputs
+
+
+def inspect_installer(pathname, algorithms=("sha256",), reader="auto"):
+    """
+    Returns the WinVersioner outputs for one installer: pkg_display_name,
+    pkg_version, pkg_file_extension and pkg_<algorithm> for every digest.
+    The file is hashed on a worker thread while the metadata is being read.
+    A "fallback_reason" key is set when the native reader had to be skipped.
+    """
+    digests = submit_file_digests(pathname, algorithms)
+    inspector = InstallerInspector(pathname, reader)
+    with trace.span("inspect", file=os.path.basename(pathname)):
+        try:
+            outputs = inspector.inspect()
+            # Whatever is left of the hashing once the metadata is read.
+            with trace.span("hash.wait"):
+                for algorithm, digest in digests.result().items():
+                    outputs[f"pkg_{algorithm}"] = digest
+        except OSError as err:
+            raise InstallerError(f"Unable to read {pathname}: {err}")
+    if inspector.fallback_reason:
+        outputs["fallback_reason"] = inspector.fallback_reason
+    return outputs
@@ -0,0 +1,184 @@
+"""
+Entry-level patching of YAML files whose document is a block mapping.
+
+A Gorilla catalog is one big top-level mapping and an import only ever touches
+one or a few of its entries. Instead of round-tripping the whole document,
+TopLevelMapping finds the span of every top-level key with a line scan, only
+round-trips the entries that are read, and re-serializes only the ones that are
+assigned. Everything else, comments and formatting included, is written back
+byte for byte.
+
+Documents the line scan can't map unambiguously (flow style, anchors/aliases,
+tags, multiple documents, non plain keys, CRLF line endings...) raise
+AmbiguousYAML, callers then fall back to a full round-trip.
+"""
+
+import io
+import re
+
+__all__ = ["AmbiguousYAML", "TopLevelMapping"]
+
+# A plain top-level key with its value on the following, indented lines.
+KEY_LINE = re.compile(r"(\w[\w.\- ]*?)[ ]*:[ ]*(?:#.*)?$")
+# Keys a YAML loader would not read back as the same string.
+NON_STRING_KEYS = {"y", "n", "yes", "no", "true", "false", "on", "off", "null"}
+NUMBER_LIKE = re.compile(r"[0-9][0-9_.:eE+\- ]*")
+# Start of every line beginning in column 0, keys, comments or anything unexpected.
+TOP_LEVEL_LINE = re.compile(r"\n[^ \r\n]")
+INDENTED_CONTENT = re.compile(r"^[ ]+[^ \r\n#]", re.MULTILINE)
+# Anchors, aliases and tags outside comments tie entries together or change how they load.
+REFERENCE_CHARS = "&*!"
+REFERENCE_PREFIXES = " \t\r\n:[{,-"
+
+
+class AmbiguousYAML(ValueError):
+    """The document can't be patched entry by entry."""
+
+
+class TopLevelMapping:
+    """
+    Mapping-like view of a YAML document that round-trips single entries.
+
+    yaml is a ruamel.yaml round-trip YAML instance used to load and dump entries.
+    Only entries assigned with catalog[key] = value are re-serialized, changes
+    made in place to a loaded entry must be assigned back to be written.
+    """
+
+    def __init__(self, text, yaml):
+        self.text = text
+        self.yaml = yaml
+        self.spans = {}
+        self.loaded = {}
+        self.changed = set()
+        self.added = []
+        self.scan()
+
+    def scan(self):
+        """records (start, end) character offsets of every top-level entry"""
+        if self.text.startswith("\ufeff"):
+            raise AmbiguousYAML("byte order mark")
+        if "\r" in self.text:
+            # Re-serialized entries would be written with \n, mixing line endings.
+            raise AmbiguousYAML("CR line endings")
+        self.check_references()
+        keys = []
+        line_starts = [match.start() + 1 for match in TOP_LEVEL_LINE.finditer(self.text)]
+        if self.text[:1] not in ("", " ", "\r", "\n"):
+            line_starts.insert(0, 0)
+        for line_start in line_starts:
+            line_end = self.text.find("\n", line_start)
+            line_end = len(self.text) if line_end < 0 else line_end
+            line = self.text[line_start:line_end].rstrip("\r")
+            if line.startswith("#"):
+                continue
+            key_match = KEY_LINE.match(line)
+            if not key_match:
+                raise AmbiguousYAML(f"unsupported top-level line {line!r}")
+            key = key_match.group(1)
+            if key.lower() in NON_STRING_KEYS or NUMBER_LIKE.fullmatch(key):
+                raise AmbiguousYAML(f"key {key!r} does not load as a string")
+            if key in self.spans:
+                raise AmbiguousYAML(f"duplicate key {key!r}")
+            self.spans[key] = None
+            keys.append((key, line_start, min(line_end + 1, len(self.text))))
+        if not keys:
+            raise AmbiguousYAML("no block mapping entries")
+        if INDENTED_CONTENT.search(self.text, 0, keys[0][1]):
+            raise AmbiguousYAML("indented content before the first key")
+        for index, (key, start, value_start) in enumerate(keys):
+            end = keys[index + 1][1] if index + 1 < len(keys) else len(self.text)
+            # Blank lines and column 0 comments after the entry stay outside its span.
+            while end > value_start:
+                newline = self.text.rfind("\n", value_start, end - 1)
+                line_start = newline + 1 if newline >= 0 else value_start
+                line = self.text[line_start:end]
+                if line.strip() and not line.startswith("#"):
+                    break
+                end = line_start
+            if end == value_start:
+                # Keys without an indented value are null, leave those to a full round-trip.
+                raise AmbiguousYAML(f"{key} has no indented value")
+            self.spans[key] = [start, end]
+
+    def check_references(self):
+        """raises AmbiguousYAML for anchors, aliases and tags, str.find is much faster than re here"""
+        for char in REFERENCE_CHARS:
+            position = self.text.find(char)
+            while position >= 0:
+                following = self.text[position + 1 : position + 2]
+                if (
+                    (position == 0 or self.text[position - 1] in REFERENCE_PREFIXES)
+                    and following
+                    and not following.isspace()
+                ):
+                    line_start = self.text.rfind("\n", 0, position) + 1
+                    if "#" not in self.text[line_start:position]:
+                        raise AmbiguousYAML(
+                            f"anchor, alias or tag: {self.text[position:].split(None, 1)[0]!r}"
+                        )
+                position = self.text.find(char, position + 1)
+
+    def load_entry(self, key):
+        """the round-tripped single-entry document of key"""
+        if key not in self.loaded:
+            start, end = self.spans[key]
+            document = self.yaml.load(self.text[start:end])
+            if list(document) != [key]:
+                raise AmbiguousYAML(f"{key} did not load as a single entry")
+            self.loaded[key] = document
+        return self.loaded[key]
+
+    def __contains__(self, key):
+        return key in self.spans or key in self.added
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.load_entry(key)[key] if key in self.spans else self.loaded[key][key]
+
+    def get(self, key, default=None):
+        """dict.get"""
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        if key in self.spans:
+            self.load_entry(key)[key] = value
+        else:
+            if key not in self.added:
+                self.added.append(key)
+            self.loaded[key] = {key: value}
+        self.changed.add(key)
+
+    def keys(self):
+        """top-level keys in document order"""
+        return list(self.spans) + self.added
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        """loads every entry, only use when the whole document is needed anyway"""
+        return [(key, self[key]) for key in self.keys()]
+
+    def dump_entry(self, key):
+        """serialized single-entry document of key"""
+        stream = io.StringIO()
+        self.yaml.dump(self.loaded[key], stream)
+        return stream.getvalue()
+
+    def render(self):
+        """the document text with the changed entries re-serialized"""
+        parts = []
+        offset = 0
+        for key, (start, end) in sorted(self.spans.items(), key=lambda item: item[1][0]):
+            if key not in self.changed:
+                continue
+            parts.append(self.text[offset:start])
+            parts.append(self.dump_entry(key))
+            offset = end
+        parts.append(self.text[offset:])
+        if self.added:
+            if parts[-1] and not parts[-1].endswith("\n"):
+                parts.append("\n")
+            parts.extend(self.dump_entry(key) for key in self.added)
+        return "".join(parts)
@@ -0,0 +1,151 @@
+#!/usr/local/autopkg/python
+#
+# Copyright 2022 Alex Alequin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""See docstring for URLDownloader class"""
+
+import os
+import sys
+from urllib.parse import unquote, urlsplit
+
+from autopkglib import Processor, ProcessorError
+
+# AutoPkg loads processors by path, make the shared helpers importable.
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.insert(0, os.path.dirname(__file__))
+from SharedProcessorsLib.digests import remember_digests  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.rangefetch import (  # pylint: disable=import-error,wrong-import-position
+    DownloadError,
+    RangeDownload,
+)
+
+__all__ = ["URLDownloader"]
+
+
+class URLDownloader(Processor):
+    """
+    Downloads a URL over several parallel HTTP Range connections, for payloads
+    like the multi-GB InstallAssistant.pkg. An interrupted download resumes
+    where it stopped on the next run, and a file that didn't change on the
+    server is not downloaded again. The payload can be verified against a known
+    size and digest, e.g. the size and digest outputs of GetInstallmacOSMetadata.
+    """
+
+    description = __doc__
+    input_variables = {
+        "url": {"required": True, "description": "The URL to download."},
+        "filename": {
+            "required": False,
+            "description": "Filename to download to, defaults to the last component "
+            "of the URL path.",
+        },
+        "download_dir": {
+            "required": False,
+            "description": "Directory to download to, defaults to downloads in "
+            "RECIPE_CACHE_DIR.",
+        },
+        "request_headers": {
+            "required": False,
+            "description": "Optional dictionary of headers sent with every request.",
+        },
+        "expected_size": {
+            "required": False,
+            "description": "Size in bytes the download must have, empty to not check.",
+        },
+        "expected_digest": {
+            "required": False,
+            "description": "Hex md5/sha1/sha256/sha512 digest the download must have, "
+            "the algorithm is picked by length. Empty to not check.",
+        },
+        "download_segments": {
+            "required": False,
+            "description": "Maximum number of parallel connections.",
+            "default": 8,
+        },
+        "download_timeout": {
+            "required": False,
+            "description": "Socket timeout in seconds.",
+            "default": 60,
+        },
+        "download_retries": {
+            "required": False,
+            "description": "How often a failed segment is retried from where it stopped.",
+            "default": 3,
+        },
+    }
+    output_variables = {
+        "pathname": {"description": "Path to the downloaded file."},
+        "download_changed": {
+            "description": "True if the file was downloaded, False if it was already "
+            "up to date."
+        },
+        "url_downloader_summary_result": {
+            "description": "Description of interesting results."
+        },
+    }
+
+    def get_download_path(self):
+        """where the url is downloaded to"""
+        filename = self.env.get("filename") or unquote(
+            os.path.basename(urlsplit(self.env["url"]).path)
+        )
+        if not filename:
+            raise ProcessorError(f"Can't derive a filename from {self.env['url']}")
+        download_dir = self.env.get("download_dir") or os.path.join(
+            self.env.get("RECIPE_CACHE_DIR", "."), "downloads"
+        )
+        return os.path.join(download_dir, filename)
+
+    def main(self):
+        """gimme some main"""
+        pathname = self.get_download_path()
+        download = RangeDownload(
+            self.env["url"],
+            pathname,
+            headers=self.env.get("request_headers"),
+            segments=int(self.env.get("download_segments", 8)),
+            timeout=float(self.env.get("download_timeout", 60)),
+            retries=int(self.env.get("download_retries", 3)),
+            expected_size=self.env.get("expected_size") or None,
+            expected_digest=self.env.get("expected_digest") or None,
+            log=self.output,
+        )
+        try:
+            result = download.run()
+        except DownloadError as err:
+            raise ProcessorError(str(err)) from err
+
+        self.env["pathname"] = pathname
+        self.env["download_changed"] = result["changed"]
+        if result["digest"]:
+            # Later processors hashing the payload get it for free.
+            remember_digests(pathname, {download.algorithm: result["digest"]})
+        if not result["changed"]:
+            self.output(f"Item at URL is unchanged, using existing {pathname}")
+            return
+        self.output(
+            f"Downloaded {pathname} ({result['size']} bytes"
+            + (f", {result['resumed']} resumed" if result["resumed"] else "")
+            + (f", {download.algorithm} verified" if result["digest"] else "")
+            + ")"
+        )
+        self.env["url_downloader_summary_result"] = {
+            "summary_text": "The following new items were downloaded:",
+            "data": {"download_path": pathname},
+        }
+
+
+if __name__ == "__main__":
+    PROCESSOR = URLDownloader()
+    PROCESSOR.execute_shell()
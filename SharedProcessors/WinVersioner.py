@@ -3,140 +3,349 @@
 See docstring for WinVersioner class
 """
 
-from subprocess import check_output, CalledProcessError
-import re
+from concurrent.futures import ProcessPoolExecutor
 import hashlib
-import platform
+import json
+import os
+import plistlib
+import sys
+import time
 
 from autopkglib import (  # pylint: disable=import-error,unused-import
     Processor,
     ProcessorError,
 )
 
+# AutoPkg loads processors by path, make the shared helpers importable.
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.insert(0, os.path.dirname(__file__))
+from SharedProcessorsLib import trace  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.digests import (  # pylint: disable=import-error,wrong-import-position
+    file_digests,
+    file_identity,
+    remember_digests,
+)
+from SharedProcessorsLib.inputs import input_flag  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib.locks import (  # pylint: disable=import-error,wrong-import-position
+    LockTimeout,
+    file_lock,
+)
+from SharedProcessorsLib.wininstaller import (  # pylint: disable=import-error,wrong-import-position
+    INSTALLER_EXTENSIONS,
+    InstallerError,
+    inspect_installer,
+)
+
 __all__ = ["WinVersioner"]
 
+# Parallel recipe runs share the metadata cache, each holds its lock briefly.
+METADATA_CACHE_LOCK_TIMEOUT = 60
+
 
 class WinVersioner(Processor):  # pylint: disable=too-few-public-methods
     """
-    Requires:
+    MSI and PE metadata is read in-process. The command line tools are only needed for
+    the subprocess reader, which is also the fallback when the native one fails:
     - https://github.com/Homebrew/linuxbrew-core/blob/master/Formula/msitools.rb
     - brew install exiftools
+
+    Several installers can be processed at once with batch_paths, they are
+    inspected and hashed in a pool of worker processes.
     """
 
     description = __doc__
     input_variables = {
         "pathname": {
-            "required": True,
-            "description": "Full file path to gather data from."},
+            "required": False,
+            "description": "Full file path to gather data from. Required unless "
+            "batch_paths is given."},
+        "batch_paths": {
+            "required": False,
+            "description": "List of .msi/.exe files and/or directories holding them. "
+            "When given, every installer is processed in a pool of worker processes "
+            "and the outputs are reported in win_versioner_manifest instead.",
+        },
+        "batch_manifest_path": {
+            "required": False,
+            "description": "Where to write the batch manifest, a .plist path writes a "
+            "plist, anything else JSON.",
+        },
+        "batch_max_workers": {
+            "required": False,
+            "description": "Number of worker processes for batch_paths. Defaults to "
+            "the number of CPUs.",
+        },
+        "metadata_reader": {
+            "required": False,
+            "description": "native reads the metadata in-process, subprocess uses "
+            "msiinfo/exiftool, auto tries native first and falls back to subprocess.",
+            "default": "auto",
+        },
+        "hash_algorithms": {
+            "required": False,
+            "description": "Digests computed in the same pass over the file, each is "
+            "output as pkg_<algorithm>. A list, or a comma or space separated string. "
+            "sha256 is always computed.",
+            "default": ["sha256"],
+        },
+        "metadata_cache_path": {
+            "required": False,
+            "description": "JSON file remembering the outputs per installer file. Defaults "
+            "to com.github.arequ.SharedProcessors/WinVersioner.json next to "
+            "RECIPE_CACHE_DIR. Set to an empty string to disable the cache.",
+        },
+        "metadata_cache_bypass": {
+            "required": False,
+            "description": "Ignore cached entries and re-read the installer, the cache "
+            "is still updated.",
+            "default": False,
+        },
+        "metadata_cache_verify": {
+            "required": False,
+            "description": "Re-hash the installer and compare it with the cached sha256 "
+            "before trusting a cached entry.",
+            "default": False,
+        },
+        "metadata_cache_max_entries": {
+            "required": False,
+            "description": "Maximum number of installers remembered, least recently "
+            "used entries are evicted first.",
+            "default": 256,
+        },
+        "trace_path": {
+            "required": False,
+            "description": "File to append timing spans of the cache, metadata and "
+            "hashing stages to, JSON lines for a .jsonl path and Chrome trace events "
+            "otherwise. Tracing is off when empty.",
+        },
     }
     output_variables = {
         "pkg_display_name": {"description": "the app name as it shows up in control panel"},
         "pkg_version": {"description": "the verison of the app"},
         "pkg_sha256": {"description": "the sha256 value of the file"},
-        "pkg_file_extension": {"description": "why look it up again?"}
+        "pkg_sha1": {"description": "the sha1 value of the file, if requested"},
+        "pkg_md5": {"description": "the md5 value of the file, if requested"},
+        "pkg_file_extension": {"description": "why look it up again?"},
+        "win_versioner_manifest": {
+            "description": "batch mode only: list of the outputs above per installer, "
+            "with pathname, or pathname and error if it could not be processed"
+        },
     }
 
-    def get_file_extension(self):
-        """determine whether its an msi or exe"""
-        return self.env["pathname"].split(".")[-1]
+    def get_metadata_cache_path(self):
+        """path of the metadata cache file, None if the cache is disabled"""
+        if "metadata_cache_path" in self.env:
+            return self.env["metadata_cache_path"] or None
+        cache_root = os.path.expanduser("~/Library/AutoPkg/Cache")
+        if self.env.get("RECIPE_CACHE_DIR"):
+            cache_root = os.path.dirname(self.env["RECIPE_CACHE_DIR"])
+        return os.path.join(cache_root, "com.github.arequ.SharedProcessors", "WinVersioner.json")
 
-    def get_proper_arch(self):
-        """Autopkg prebuilt python identifies as x86_64 using platform"""
-        command = ["/usr/sbin/sysctl", "-n", "machdep.cpu.brand_string"]
-        output = self.run_cmd(command)
-        if "Apple" in output:
-            return "arm"
-        else:
-            return "i386"
-
-    def get_sha256sum(self):
-        """Returns the sha256 hash of a file specified."""
-        sha256 = hashlib.sha256()
-        with open(self.env["pathname"], "rb") as f:
-            chunk = None
-            while chunk != b"":
-                chunk = f.read(1024)
-                sha256.update(chunk)
-        return sha256.hexdigest()
-
-    def get_version(self):
-        """gets the version respected by add/or remove programs in control panel"""
-        patterns = {
-            "msi": r"\nProductVersion\t(.*)\r",
-            "exe": r"\nProduct Version\W*: (.*)\n"
-        }
-        # Chrome does its own thing...
-        pattern = patterns[self.file_extension]
-        matches = re.search(pattern, self.metadata)
-        return matches.group(1)
-
-    def get_chrome_version(self):
-        """google do their own thing"""
-        # freakin' chrome includes the right version in a comment field..
-        command = [self.binary, "suminfo", self.env["pathname"]]
-        output = self.run_cmd(command)
-        pattern = "\nComments: (.*) Copyright.*"
-        matches = re.search(pattern, output)
+    def load_metadata_cache(self, cache_path):
+        """loads the metadata cache, an empty one if missing or unreadable"""
+        with trace.span("metadata_cache.load") as stage:
+            try:
+                with open(cache_path, "r") as f:
+                    stage.add(bytes=os.fstat(f.fileno()).st_size)
+                    return json.load(f)
+            except (OSError, ValueError):
+                return {}
+
+    def save_metadata_cache(self, cache_path, cache):
+        """evicts the least recently used entries and atomically writes the cache"""
+        max_entries = max(1, int(self.env.get("metadata_cache_max_entries", 256)))
+        if len(cache) > max_entries:
+            newest = sorted(cache, key=lambda key: cache[key]["used"], reverse=True)
+            cache = {key: cache[key] for key in newest[:max_entries]}
+        with trace.span("metadata_cache.save", entries=len(cache)) as stage:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f, indent=1)
+                stage.add(bytes=f.tell())
+            os.replace(tmp_path, cache_path)
+
+    def update_metadata_cache(self, cache_path, entries, used):
+        """
+        merges new entries and the use times of cache hits into the cache file,
+        re-read under its lock so entries of parallel runs aren't lost
+        """
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
         try:
-            return matches.group(1)
-        except IndexError:
-            raise ProcessorError(
-                "Look into Chrome metadata, not match found in comment containing version info"
-            )
-
-    def get_display_name(self):
-        """gets the installed (control panel) displayname"""
-        patterns = {
-            "msi": r"\nProductName\t(.*)\r",
-            "exe": r"\nProduct Name\W*: (.*)\n"
+            with file_lock(f"{cache_path}.lock", METADATA_CACHE_LOCK_TIMEOUT):
+                cache = self.load_metadata_cache(cache_path)
+                for key, timestamp in used.items():
+                    if key in cache:
+                        cache[key]["used"] = max(cache[key].get("used", 0), timestamp)
+                cache.update(entries)
+                self.save_metadata_cache(cache_path, cache)
+        except LockTimeout as err:
+            self.output(f"WARNING: Metadata cache not updated: {err}")
+
+    def get_cache_key(self, pathname):
+        """identifies the installer by path, size, mtime and inode without reading it"""
+        return "|".join(str(part) for part in file_identity(pathname))
+
+    def get_hash_algorithms(self):
+        """requested digest algorithms, sha256 first, from a list or a -k string"""
+        requested = self.env.get("hash_algorithms") or ["sha256"]
+        if isinstance(requested, str):
+            requested = requested.replace(",", " ").split()
+        algorithms = ["sha256"]
+        for algorithm in requested:
+            algorithm = str(algorithm).strip().lower()
+            if algorithm not in hashlib.algorithms_available:
+                raise ProcessorError(f"Unknown hash algorithm {algorithm!r} in hash_algorithms")
+            if algorithm not in algorithms:
+                algorithms.append(algorithm)
+        return algorithms
+
+    def get_cached_outputs(self, pathname, entry):
+        """outputs from a cache entry, None if it can't be used"""
+        algorithms = self.get_hash_algorithms()
+        if not all(algorithm in entry["digests"] for algorithm in algorithms):
+            return None
+        if input_flag(self.env, "metadata_cache_verify"):
+            actual = file_digests(pathname)["sha256"]
+            if actual != entry["digests"]["sha256"]:
+                self.output(f"Cached metadata does not match content of {pathname}, ignoring it.")
+                return None
+        remember_digests(pathname, entry["digests"])
+        outputs = {
+            key: entry[key]
+            for key in ("pkg_display_name", "pkg_version", "pkg_file_extension")
         }
-        pattern = patterns[self.file_extension]
-        matches = re.search(pattern, self.metadata)
-        try:
-            return matches.group(1)
-        except IndexError:
-            raise ProcessorError(f"We were not able to find {pattern} in provided metadata.")
+        for algorithm in algorithms:
+            outputs[f"pkg_{algorithm}"] = entry["digests"][algorithm]
+        return outputs
 
-    def run_cmd(self, command):
-        """Runs a shell command and returns its output, returns None on failure"""
-        try:
-            return check_output(command).decode("utf-8")
-        except CalledProcessError:
-            raise ProcessorError(f"Running of command: {command} has failed.")
+    def extract_all(self, pathnames):
+        """inspects installers in worker processes, or inline for a single one"""
+        algorithms = self.get_hash_algorithms()
+        reader = self.env.get("metadata_reader", "auto")
+        workers = int(self.env.get("batch_max_workers") or os.cpu_count() or 1)
+        workers = max(1, min(workers, len(pathnames)))
+        with trace.span("extract", installers=len(pathnames), workers=workers):
+            results = {}
+            if workers == 1:
+                for pathname in pathnames:
+                    try:
+                        results[pathname] = inspect_installer(pathname, algorithms, reader)
+                    except InstallerError as err:
+                        results[pathname] = {"error": str(err)}
+                    except Exception as err:  # pylint: disable=broad-except
+                        # One broken installer must not cost the rest of the batch.
+                        results[pathname] = {"error": f"{type(err).__name__}: {err}"}
+                return results
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    pathname: executor.submit(inspect_installer, pathname, algorithms, reader)
+                    for pathname in pathnames
+                }
+                for pathname, future in futures.items():
+                    try:
+                        results[pathname] = future.result()
+                    except InstallerError as err:
+                        results[pathname] = {"error": str(err)}
+                    except Exception as err:  # pylint: disable=broad-except
+                        # Also BrokenProcessPool, the other results are kept.
+                        results[pathname] = {"error": f"{type(err).__name__}: {err}"}
+                    else:
+                        # Hashed in another process, let GorillaImporter & co reuse it here.
+                        remember_digests(pathname, {
+                            algorithm: results[pathname][f"pkg_{algorithm}"]
+                            for algorithm in algorithms
+                        })
+            return results
 
-    def main(self):
-        """gimme some main"""
-        proc_arch = self.get_proper_arch()
-        self.file_extension = self.get_file_extension()
-        # Dict that can be referred to via output of platform lib to get binary path.
-        self.binaries = {
-            "msi": {
-                "arm": "/opt/homebrew/bin/msiinfo",
-                "i386": "/usr/local/bin/msiinfo"
-            },
-            "exe": {
-                "arm": "/opt/homebrew/bin/exiftool",
-                "i386": "/usr/local/bin/exiftool"
+    def process_installers(self, pathnames):
+        """returns the outputs of every installer, from the cache where possible"""
+        cache_path = self.get_metadata_cache_path()
+        cache = self.load_metadata_cache(cache_path) if cache_path else {}
+        results = {}
+        keys = {}
+        entries = {}
+        used = {}
+        for pathname in pathnames:
+            try:
+                keys[pathname] = self.get_cache_key(pathname)
+            except OSError as err:
+                results[pathname] = {"error": f"Unable to read {pathname}: {err}"}
+                continue
+            entry = cache.get(keys[pathname])
+            if entry and not input_flag(self.env, "metadata_cache_bypass"):
+                outputs = self.get_cached_outputs(pathname, entry)
+                if outputs:
+                    self.output(f"Using cached metadata for {pathname}")
+                    trace.add(cache_hits=1)
+                    used[keys[pathname]] = time.time()
+                    results[pathname] = outputs
+        missing = [pathname for pathname in pathnames if pathname not in results]
+        for pathname, outputs in self.extract_all(missing).items():
+            results[pathname] = outputs
+            if "fallback_reason" in outputs:
+                self.output(
+                    f"Native reader failed for {pathname} ({outputs.pop('fallback_reason')}), "
+                    "used subprocess."
+                )
+            if "error" in outputs:
+                continue
+            entries[keys[pathname]] = {
+                "pkg_display_name": outputs["pkg_display_name"],
+                "pkg_version": outputs["pkg_version"],
+                "pkg_file_extension": outputs["pkg_file_extension"],
+                "digests": {
+                    algorithm: outputs[f"pkg_{algorithm}"]
+                    for algorithm in self.get_hash_algorithms()
+                },
+                "used": time.time(),
             }
-        }
-        self.binary = self.binaries[self.file_extension][proc_arch]
-        # Build the appropriate command based on the file extension and generated vars.
-        self.commands = {
-            "msi": [self.binary, "export", self.env["pathname"], "Property"],
-            "exe": [self.binary, self.env["pathname"]]
-        }
-        command = self.commands[self.file_extension]
-        self.metadata = self.run_cmd(command)
-        if self.metadata:
-            self.env["pkg_display_name"] = self.get_display_name()
-            self.env["pkg_sha256"] = self.get_sha256sum()
-            self.env["pkg_file_extension"] = self.file_extension
-            if "chrome" in self.env["pkg_display_name"].lower():
-                self.env["pkg_version"] = self.get_chrome_version()
+        if cache_path and (entries or used):
+            self.update_metadata_cache(cache_path, entries, used)
+        return [dict(pathname=pathname, **results[pathname]) for pathname in pathnames]
+
+    def get_batch_paths(self):
+        """expands batch_paths directories to the installers they contain"""
+        pathnames = []
+        for path in self.env["batch_paths"]:
+            if os.path.isdir(path):
+                pathnames.extend(
+                    os.path.join(path, name)
+                    for name in sorted(os.listdir(path))
+                    if name.split(".")[-1].lower() in INSTALLER_EXTENSIONS
+                )
             else:
-                self.env["pkg_version"] = self.get_version()
+                pathnames.append(path)
+        return pathnames
+
+    def write_manifest(self, manifest_path, manifest):
+        """writes the batch manifest as plist or JSON depending on the extension"""
+        if manifest_path.endswith(".plist"):
+            with open(manifest_path, "wb") as f:
+                plistlib.dump(manifest, f)
         else:
-            raise ProcessorError(f"We were not able to produce metadata for {self.env['pathname']}")
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+
+    def main(self):
+        """gimme some main"""
+        with trace.tracing(self.env.get("trace_path"), "WinVersioner"):
+            if self.env.get("batch_paths"):
+                manifest = self.process_installers(self.get_batch_paths())
+                self.env["win_versioner_manifest"] = manifest
+                if self.env.get("batch_manifest_path"):
+                    self.write_manifest(self.env["batch_manifest_path"], manifest)
+                failed = [result for result in manifest if "error" in result]
+                for result in failed:
+                    self.output(f"{result['pathname']}: {result['error']}")
+                self.output(f"Processed {len(manifest)} installers, {len(failed)} failed.")
+                return
+            if not self.env.get("pathname"):
+                raise ProcessorError("Either pathname or batch_paths is required.")
+            outputs = self.process_installers([self.env["pathname"]])[0]
+            if "error" in outputs:
+                raise ProcessorError(outputs["error"])
+            del outputs["pathname"]
+            self.env.update(outputs)
 
 if __name__ == "__main__":
     PROCESSOR = WinVersioner()
@@ -0,0 +1,45 @@
+"""
+Stand-in for AutoPkg's autopkglib, so the shared processors run under any
+Python. Only what the processors use is provided: Processor with env,
+output() and process() filling in input defaults, and ProcessorError.
+"""
+
+__all__ = ["Processor", "ProcessorError"]
+
+
+class ProcessorError(Exception):
+    """Raised by processors, like autopkglib.ProcessorError."""
+
+
+class Processor:
+    """The parts of autopkglib.Processor the shared processors rely on."""
+
+    description = ""
+    input_variables = {}
+    output_variables = {}
+
+    def __init__(self, env=None, infile=None, outfile=None):
+        self.env = env if env is not None else {}
+        self.infile = infile
+        self.outfile = outfile
+
+    def output(self, msg, verbose_level=1):
+        """prints msg if the verbose variable is at least verbose_level"""
+        if int(self.env.get("verbose", 0)) >= verbose_level:
+            print(f"{self.__class__.__name__}: {msg}")
+
+    def main(self):
+        """implemented by every processor"""
+        raise ProcessorError("Abstract method main() not implemented.")
+
+    def process(self):
+        """fills in input defaults and runs main, returns the environment"""
+        for key, flags in self.input_variables.items():
+            if key not in self.env and "default" in flags:
+                self.env[key] = flags["default"]
+        self.main()
+        return self.env
+
+    def execute_shell(self):
+        """not supported outside of AutoPkg"""
+        raise ProcessorError("The benchmark autopkglib can't run processors from a shell.")
@@ -0,0 +1 @@
+"""Synthetic inputs for the benchmarks, generated on the fly."""
@@ -0,0 +1,52 @@
+"""
+Synthetic Gorilla repos: a catalog with N entries written the way
+GorillaImporter leaves them, and installers to import into it.
+"""
+
+import hashlib
+import os
+
+__all__ = ["write_gorilla_repo", "write_installer"]
+
+
+def catalog_entry(number):
+    """the YAML of one catalog entry"""
+    name = f"App{number:05d}"
+    version = f"{number % 9 + 1}.{number % 13}.{number}"
+    digest = hashlib.sha256(name.encode()).hexdigest().upper()
+    return (
+        f"{name}:\n"
+        "  installer:\n"
+        "    arguments:\n"
+        "    - /qn\n"
+        f"    hash: {digest}\n"
+        f"    location: apps/{name}/{name}-{version}.msi\n"
+        "    type: msi\n"
+        "  check:\n"
+        "    registry:\n"
+        f"      name: {name}\n"
+        f"      version: {version}\n"
+        f"  display_name: {name}\n"
+        f"  version: {version}\n"
+    )
+
+
+def write_gorilla_repo(root, entries=1000, catalog="alpha"):
+    """writes root/catalogs/<catalog>.yaml with entries entries, returns its path"""
+    os.makedirs(os.path.join(root, "catalogs"), exist_ok=True)
+    os.makedirs(os.path.join(root, "pkgs"), exist_ok=True)
+    path = os.path.join(root, "catalogs", f"{catalog}.yaml")
+    with open(path, "w") as f:
+        f.writelines(catalog_entry(number) for number in range(entries))
+    return path
+
+
+def write_installer(path, size, seed=0):
+    """writes size bytes that differ per seed, standing in for a downloaded installer"""
+    block = hashlib.sha256(str(seed).encode()).digest() * 2048
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+    return path
@@ -0,0 +1,183 @@
+"""
+Minimal .msi files: a compound file with a string pool, a Property table,
+SummaryInformation and an optional payload stream to give the file a size.
+They are just enough for SharedProcessorsLib.msi and the fake msiinfo.
+"""
+
+import struct
+
+__all__ = ["build_msi"]
+
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+FATSECT = 0xFFFFFFFD
+NOSTREAM = 0xFFFFFFFF
+# Characters MSI packs two to a UTF-16 code unit in stream names.
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz._"
+SECTOR_SHIFT = 12
+MINI_SECTOR_SIZE = 64
+MINI_STREAM_CUTOFF = 4096
+FMTID_SUMMARY_INFORMATION = bytes.fromhex("e0859ff2f94f6810ab9108002b27b3d9")
+
+
+def encode_stream_name(name, table=True):
+    """the compound file name of an MSI stream, tables get the 0x4840 prefix"""
+    out = [chr(0x4840)] if table else []
+    position = 0
+    while position < len(name):
+        char = name[position]
+        if char not in ALPHABET:
+            out.append(char)
+            position += 1
+            continue
+        following = name[position + 1:position + 2]
+        if following and following in ALPHABET:
+            out.append(chr(0x3800 + (ALPHABET.index(following) << 6) + ALPHABET.index(char)))
+            position += 2
+            continue
+        out.append(chr(0x4800 + ALPHABET.index(char)))
+        position += 1
+    return "".join(out)
+
+
+def directory_entry(name, entry_type, right, child, start, size):
+    """one 128 byte compound file directory entry"""
+    raw = name.encode("utf-16-le") + b"\x00\x00" if name else b""
+    entry = raw.ljust(64, b"\x00")
+    entry += struct.pack("<HBB", len(raw), entry_type, 1)
+    entry += struct.pack("<III", NOSTREAM, right, child)
+    entry += b"\x00" * 36
+    entry += struct.pack("<IQ", start, size)
+    return entry
+
+
+def write_compound_file(path, streams):
+    """writes a version 4 compound file holding streams, a list of (name, bytes)"""
+    sector_size = 1 << SECTOR_SHIFT
+    sectors = []
+    fat = []
+
+    def allocate(data):
+        if not data:
+            return ENDOFCHAIN
+        count = (len(data) + sector_size - 1) // sector_size
+        start = len(sectors)
+        data = data.ljust(count * sector_size, b"\x00")
+        for index in range(count):
+            sectors.append(data[index * sector_size:(index + 1) * sector_size])
+            fat.append(start + index + 1 if index < count - 1 else ENDOFCHAIN)
+        return start
+
+    mini_stream = bytearray()
+    mini_fat = []
+    entries = []
+    for name, data in streams:
+        if len(data) >= MINI_STREAM_CUTOFF:
+            entries.append((name, allocate(data), len(data)))
+            continue
+        count = (len(data) + MINI_SECTOR_SIZE - 1) // MINI_SECTOR_SIZE
+        start = len(mini_stream) // MINI_SECTOR_SIZE if data else ENDOFCHAIN
+        mini_fat.extend(start + index + 1 if index < count - 1 else ENDOFCHAIN for index in range(count))
+        mini_stream += data.ljust(count * MINI_SECTOR_SIZE, b"\x00")
+        entries.append((name, start, len(data)))
+    root_start = allocate(bytes(mini_stream))
+    mini_fat_bytes = struct.pack(f"<{len(mini_fat)}I", *mini_fat)
+    mini_fat_start = allocate(mini_fat_bytes) if mini_fat else ENDOFCHAIN
+    mini_fat_count = (len(mini_fat_bytes) + sector_size - 1) // sector_size
+
+    # The streams hang off the root as a chain of right siblings in sort order,
+    # a degenerate but valid red-black tree.
+    entries.sort(key=lambda entry: (len(entry[0]), entry[0].upper()))
+    directory = directory_entry(
+        "Root Entry", 5, NOSTREAM, 1 if entries else NOSTREAM, root_start, len(mini_stream)
+    )
+    for position, (name, start, size) in enumerate(entries):
+        right = position + 2 if position + 1 < len(entries) else NOSTREAM
+        directory += directory_entry(name, 2, right, NOSTREAM, start, size)
+    while len(directory) % sector_size:
+        directory += directory_entry("", 0, NOSTREAM, NOSTREAM, 0, 0)
+    directory_start = allocate(directory)
+
+    per_sector = sector_size // 4
+    fat_sectors = 0
+    while len(sectors) + fat_sectors > fat_sectors * per_sector:
+        fat_sectors += 1
+    if fat_sectors > 109:
+        raise ValueError("too large for a compound file without DIFAT sectors")
+    fat_start = len(sectors)
+    fat.extend([FATSECT] * fat_sectors)
+    fat.extend([FREESECT] * (fat_sectors * per_sector - len(fat)))
+    fat_bytes = struct.pack(f"<{len(fat)}I", *fat)
+    for index in range(fat_sectors):
+        sectors.append(fat_bytes[index * sector_size:(index + 1) * sector_size])
+
+    header = bytearray(512)
+    header[:8] = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+    struct.pack_into("<HHHHH", header, 0x18, 0x3E, 4, 0xFFFE, SECTOR_SHIFT, 6)
+    struct.pack_into("<I", header, 0x28, len(directory) // sector_size)
+    struct.pack_into(
+        "<8I", header, 0x2C, fat_sectors, directory_start, 0, MINI_STREAM_CUTOFF,
+        mini_fat_start, mini_fat_count, ENDOFCHAIN, 0,
+    )
+    difat = [fat_start + index for index in range(fat_sectors)]
+    struct.pack_into("<109I", header, 0x4C, *(difat + [FREESECT] * (109 - fat_sectors)))
+    with open(path, "wb") as f:
+        f.write(bytes(header).ljust(sector_size, b"\x00"))
+        for sector in sectors:
+            f.write(sector)
+
+
+def summary_information(properties, codepage=1252):
+    """a SummaryInformation property set stream, properties maps PIDs to str or int"""
+    items = [(1, struct.pack("<Ih", 2, codepage) + b"\x00\x00")]
+    for pid, value in sorted(properties.items()):
+        if isinstance(value, int):
+            items.append((pid, struct.pack("<Ii", 3, value)))
+            continue
+        raw = value.encode("cp1252") + b"\x00"
+        raw += b"\x00" * (-len(raw) % 4)
+        items.append((pid, struct.pack("<II", 30, len(raw)) + raw))
+    body = b""
+    offsets = []
+    base = 8 + 8 * len(items)
+    for pid, blob in items:
+        offsets.append(struct.pack("<II", pid, base + len(body)))
+        body += blob
+    section = struct.pack("<II", base + len(body), len(items)) + b"".join(offsets) + body
+    header = struct.pack("<HHI", 0xFFFE, 0, 0x00020006) + b"\x00" * 16 + struct.pack("<I", 1)
+    return header + FMTID_SUMMARY_INFORMATION + struct.pack("<I", 48) + section
+
+
+def build_msi(path, properties, summary=None, payload_size=0):
+    """
+    writes an .msi with properties in its Property table, the summary information
+    PIDs given in summary and payload_size bytes of filler in a payload stream
+    """
+    strings = []
+    ids = {}
+
+    def string_id(value):
+        if value not in ids:
+            strings.append(value)
+            ids[value] = len(strings)
+        return ids[value]
+
+    names = [string_id(name) for name in properties]
+    values = [string_id(value) for value in properties.values()]
+    pool = struct.pack("<HH", 1252, 0)
+    data = b""
+    for value in strings:
+        raw = value.encode("cp1252")
+        pool += struct.pack("<HH", len(raw), 1)
+        data += raw
+    # Columns are stored one after the other, two byte string references each.
+    table = b"".join(index.to_bytes(2, "little") for index in names + values)
+    streams = [
+        (encode_stream_name("_StringPool"), pool),
+        (encode_stream_name("_StringData"), data),
+        (encode_stream_name("Property"), table),
+        ("\x05SummaryInformation", summary_information(summary or {})),
+    ]
+    if payload_size:
+        streams.append((encode_stream_name("payload.cab", table=False), b"\xab" * payload_size))
+    write_compound_file(path, streams)
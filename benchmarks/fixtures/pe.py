@@ -0,0 +1,96 @@
+"""
+Minimal PE32+ .exe files: one .rsrc section holding a VS_VERSION_INFO
+resource, followed by filler to give the file a size. They are just enough
+for SharedProcessorsLib.pe and the fake exiftool.
+"""
+
+import struct
+
+__all__ = ["build_pe"]
+
+SECTION_RVA = 0x1000
+RAW_OFFSET = 0x400
+
+
+def pad4(buffer):
+    """pads a bytearray to a multiple of four bytes"""
+    buffer += b"\x00" * (-len(buffer) % 4)
+    return buffer
+
+
+def version_block(key, value=b"", value_length=0, value_type=0, children=()):
+    """one length prefixed VERSIONINFO block"""
+    out = bytearray(struct.pack("<HHH", 0, value_length, value_type))
+    out += (key + "\x00").encode("utf-16-le")
+    pad4(out)
+    out += value
+    for child in children:
+        pad4(out)
+        out += child
+    struct.pack_into("<H", out, 0, len(out))
+    return bytes(out)
+
+
+def version_resource(strings, version="1.0.0.0", language="040904b0"):
+    """a VS_VERSION_INFO resource with a fixed file info and one string table"""
+    parts = [int(part) for part in version.split(".")[:4]] + [0, 0, 0, 0]
+    most, least = parts[0] << 16 | parts[1], parts[2] << 16 | parts[3]
+    fixed = struct.pack(
+        "<13I", 0xFEEF04BD, 0x10000, most, least, most, least, 0x3F, 0, 0x40004, 1, 0, 0, 0
+    )
+    table = version_block(
+        language,
+        value_type=1,
+        children=[
+            version_block(key, (value + "\x00").encode("utf-16-le"), len(value) + 1, 1)
+            for key, value in strings.items()
+        ],
+    )
+    translation = version_block("Translation", struct.pack("<HH", 0x409, 1200), 4, 0)
+    return version_block(
+        "VS_VERSION_INFO",
+        fixed,
+        52,
+        0,
+        [
+            version_block("StringFileInfo", value_type=1, children=[table]),
+            version_block("VarFileInfo", value_type=1, children=[translation]),
+        ],
+    )
+
+
+def build_pe(path, strings, version="1.0.0.0", payload_size=0):
+    """
+    writes an .exe whose version resource holds strings, e.g. ProductName and
+    ProductVersion, followed by payload_size bytes of filler
+    """
+    resource = version_resource(strings, version)
+    # Resource tree: type RT_VERSION -> name 1 -> language 0x409 -> data entry.
+    tree = bytearray()
+    tree += struct.pack("<IIHHHH", 0, 0, 0, 0, 0, 1) + struct.pack("<II", 16, 0x80000000 | 24)
+    tree += struct.pack("<IIHHHH", 0, 0, 0, 0, 0, 1) + struct.pack("<II", 1, 0x80000000 | 48)
+    tree += struct.pack("<IIHHHH", 0, 0, 0, 0, 0, 1) + struct.pack("<II", 0x409, 72)
+    tree += struct.pack("<IIII", SECTION_RVA + 88, len(resource), 0, 0)
+    tree += resource
+    raw_size = (len(tree) + 0x1FF) & ~0x1FF
+
+    dos = bytearray(0x80)
+    dos[:2] = b"MZ"
+    struct.pack_into("<I", dos, 0x3C, len(dos))
+    coff = struct.pack("<HHIIIHH", 0x8664, 1, 0, 0, 0, 240, 0x22)
+    optional = bytearray(240)
+    struct.pack_into("<H", optional, 0, 0x20B)
+    struct.pack_into("<I", optional, 108, 16)
+    # Data directory 2 is the resource table.
+    struct.pack_into("<II", optional, 112 + 2 * 8, SECTION_RVA, len(tree))
+    section = b".rsrc\x00\x00\x00" + struct.pack("<IIII", len(tree), SECTION_RVA, raw_size, RAW_OFFSET)
+    section += b"\x00" * 12 + struct.pack("<I", 0x40000040)
+    headers = bytes(dos) + b"PE\x00\x00" + coff + bytes(optional) + section
+    with open(path, "wb") as f:
+        f.write(headers.ljust(RAW_OFFSET, b"\x00"))
+        f.write(bytes(tree).ljust(raw_size, b"\x00"))
+        chunk = b"\xcd" * (1 << 20)
+        remaining = payload_size
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
@@ -0,0 +1,129 @@
+"""
+Local stand-in for the download servers: serves a directory over HTTP/1.1
+keep-alive with ETag and Last-Modified validators, 304 answers to
+conditional requests, single byte ranges and gzip for clients accepting it.
+Files that don't exist are answered with a few bytes of filler, so catalog
+packages can be probed without generating them. --latency adds a delay to
+every request to stand in for the round trip to a CDN.
+
+Run as a script it prints the port it listens on and serves until killed:
+
+    python -m fixtures.server ROOT [--port 0] [--latency 0.0]
+"""
+
+import argparse
+import email.utils
+import gzip
+import http.server
+import os
+import re
+import sys
+import threading
+import time
+
+__all__ = ["FixtureHandler", "serve"]
+
+RANGE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    """Serves files below the server's root."""
+
+    protocol_version = "HTTP/1.1"
+    gzip_cache = {}
+    gzip_lock = threading.Lock()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """requests are not logged"""
+
+    def gzipped(self, path, stat):
+        """the gzip compressed file, compressed once per mtime"""
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.gzip_lock:
+            if key not in self.gzip_cache:
+                with open(path, "rb") as f:
+                    self.gzip_cache[key] = gzip.compress(f.read(), compresslevel=6)
+            return self.gzip_cache[key]
+
+    def send_body(self, status, headers, body):
+        """sends status, headers and body unless this is a HEAD request"""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """answers GET and HEAD"""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        relative = os.path.normpath(self.path.split("?", 1)[0].lstrip("/"))
+        path = os.path.join(self.server.root, relative)
+        if relative.startswith("..") or not os.path.isfile(path):
+            self.send_body(200, {"Content-Type": "application/octet-stream"}, b"\x00" * 16)
+            return
+        stat = os.stat(path)
+        headers = {
+            "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+        }
+        if self.headers.get("If-None-Match") == headers["ETag"] or (
+            "If-None-Match" not in self.headers
+            and self.headers.get("If-Modified-Since") == headers["Last-Modified"]
+        ):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        match = RANGE.match(self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or stat.st_size - 1), stat.st_size - 1)
+            with open(path, "rb") as f:
+                f.seek(start)
+                body = f.read(max(0, end - start + 1))
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            self.send_body(206, headers, body)
+            return
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            self.send_body(200, headers, self.gzipped(path, stat))
+            return
+        with open(path, "rb") as f:
+            self.send_body(200, headers, f.read())
+
+    do_HEAD = do_GET
+
+
+def serve(root, port=0, latency=0.0):
+    """a threading HTTP server for root, not yet serving"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    server.daemon_threads = True
+    server.root = os.path.abspath(root)
+    server.latency = latency
+    return server
+
+
+def main(argv=None):
+    """serves until killed, the first line of output is the port"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added per request")
+    args = parser.parse_args(argv)
+    server = serve(args.root, args.port, args.latency)
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
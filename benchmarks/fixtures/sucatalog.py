@@ -0,0 +1,94 @@
+"""
+A synthetic software update catalog in the shape of Apple's: mostly ordinary
+products with a handful of packages each, and every so often a macOS
+installer product with InstallAssistantPackageIdentifiers and an English
+.dist file carrying its title, build and version.
+"""
+
+import datetime
+import os
+import plistlib
+
+__all__ = ["write_sucatalog"]
+
+MACOS_VERSIONS = ("10.15.7", "11.7.10", "12.7.4", "13.6.6", "14.4.1", "14.5", "15.0")
+
+
+def dist_file(title, build, version):
+    """an installer .dist with the auxinfo GetInstallmacOSMetadata reads"""
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<installer-gui-script minSpecVersion="2">\n'
+        f"  <title>{title}</title>\n"
+        '  <options hostArchitectures="x86_64,arm64"/>\n'
+        "  <auxinfo>\n    <dict>\n"
+        f"      <key>BUILD</key>\n      <string>{build}</string>\n"
+        f"      <key>VERSION</key>\n      <string>{version}</string>\n"
+        "    </dict>\n  </auxinfo>\n"
+        "</installer-gui-script>\n"
+    )
+
+
+def write_sucatalog(root, base_url, products=5000, installers=40, name="index.sucatalog"):
+    """
+    writes name and the .dist files of the installers below root, URLs point at
+    base_url; returns the path of the catalog
+    """
+    os.makedirs(os.path.join(root, "dists"), exist_ok=True)
+    installer_every = max(1, products // max(1, installers))
+    posted = datetime.datetime(2019, 1, 1)
+    catalog_products = {}
+    for number in range(products):
+        key = f"0{number // 1000:02d}-{number:05d}"
+        post_date = posted + datetime.timedelta(hours=number)
+        dist_url = f"{base_url}/dists/{key}.English.dist"
+        if number % installer_every:
+            catalog_products[key] = {
+                "PostDate": post_date,
+                "ServerMetadataURL": f"{base_url}/content/{key}/update.smd",
+                "Packages": [
+                    {
+                        "URL": f"{base_url}/content/{key}/Update{part}.pkg",
+                        "Size": 1048576 * (part + 1),
+                        "MetadataURL": f"{base_url}/content/{key}/Update{part}.pkm",
+                    }
+                    for part in range(3)
+                ],
+                "Distributions": {"English": dist_url, "fr": dist_url},
+            }
+            continue
+        version = MACOS_VERSIONS[(number // installer_every) % len(MACOS_VERSIONS)]
+        build = f"{20 + number % 7}A{number}"
+        with open(os.path.join(root, "dists", f"{key}.English.dist"), "w") as f:
+            f.write(dist_file(f"macOS {version}", build, version))
+        catalog_products[key] = {
+            "PostDate": post_date,
+            "ExtendedMetaInfo": {
+                "InstallAssistantPackageIdentifiers": {
+                    "OSInstall": "com.apple.mpkg.OSInstall",
+                    "SharedSupport": "com.apple.pkg.InstallAssistant.macOS",
+                }
+            },
+            "Packages": [
+                {"URL": f"{base_url}/content/{key}/BuildManifest.plist", "Size": 2048},
+                {
+                    "URL": f"{base_url}/content/{key}/InstallAssistant.pkg",
+                    "Size": 12884901888 + number,
+                    "Digest": f"{number:040x}",
+                    "IntegrityDataURL": f"{base_url}/content/{key}/InstallAssistant.pkg.integrityDataV1",
+                },
+            ],
+            "Distributions": {"English": dist_url},
+        }
+    path = os.path.join(root, name)
+    with open(path, "wb") as f:
+        plistlib.dump(
+            {
+                "CatalogVersion": 2,
+                "ApplePostURL": f"{base_url}/post",
+                "IndexDate": posted + datetime.timedelta(hours=products),
+                "Products": catalog_products,
+            },
+            f,
+        )
+    return path
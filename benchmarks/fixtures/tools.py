@@ -0,0 +1,60 @@
+"""
+Fake msiinfo and exiftool for the subprocess reader of WinVersioner. They
+read the fixture with the native readers and print it the way the real
+tools do, so the benchmark pays a process start per installer like the
+real thing without msitools or exiftool being installed.
+"""
+
+import os
+import stat
+import sys
+
+__all__ = ["write_fake_tools"]
+
+SHARED_PROCESSORS = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "SharedProcessors",
+)
+
+MSIINFO = '''#!{python}
+"""Fake msiinfo: export PATH Property, suminfo PATH."""
+import sys
+sys.path.insert(0, {shared!r})
+from SharedProcessorsLib.msi import MSIFile, PID_COMMENTS
+
+command, path = sys.argv[1], sys.argv[2]
+with MSIFile(path) as msi:
+    if command == "export":
+        sys.stdout.write("Property\\tValue\\r\\ns72\\tl0\\r\\nProperty\\tProperty\\r\\n")
+        for name, value in msi.properties().items():
+            sys.stdout.write(f"{{name}}\\t{{value}}\\r\\n")
+    elif command == "suminfo":
+        print(f"Comments: {{msi.summary_information().get(PID_COMMENTS, '')}}")
+    else:
+        sys.exit(f"msiinfo: unknown command {{command}}")
+'''
+
+EXIFTOOL = '''#!{python}
+"""Fake exiftool: PATH."""
+import re
+import sys
+sys.path.insert(0, {shared!r})
+from SharedProcessorsLib.pe import read_version_info
+
+print(f"{{'ExifTool Version Number':<32}}: 12.76")
+for name, value in read_version_info(sys.argv[1]).items():
+    print(f"{{re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', name):<32}}: {{value}}")
+'''
+
+
+def write_fake_tools(directory):
+    """writes msiinfo and exiftool to directory, returns {"msi": path, "exe": path}"""
+    os.makedirs(directory, exist_ok=True)
+    tools = {}
+    for extension, name, source in (("msi", "msiinfo", MSIINFO), ("exe", "exiftool", EXIFTOOL)):
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(source.format(python=sys.executable, shared=SHARED_PROCESSORS))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        tools[extension] = path
+    return tools
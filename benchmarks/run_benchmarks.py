@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for GetInstallmacOSMetadata, WinVersioner and
+GorillaImporter.
+
+Everything the processors talk to is generated first in a scratch directory:
+
+- a synthetic sucatalog with --products products, --installers of them
+  macOS installers with .dist files, served by a local HTTP server,
+- .msi and .exe fixtures of --payload-mb, plus --batch-files for batches,
+- fake msiinfo and exiftool for the subprocess reader,
+- a Gorilla repo whose catalog has --catalog-entries entries.
+
+Every stage runs in a process of its own with the stand-in autopkglib.
+The results are JSON, one object per stage, with:
+
+- latency percentiles,
+- throughput in operations and bytes per second,
+- the peak RSS of the stage process and of its children.
+
+    python benchmarks/run_benchmarks.py [--output results.json] [STAGE ...]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixtures.gorilla import write_gorilla_repo, write_installer
+from fixtures.msi import build_msi
+from fixtures.pe import build_pe
+from fixtures.sucatalog import write_sucatalog
+from fixtures.tools import write_fake_tools
+from stages import STAGES
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+# Opt-in stages, too slow for every run.
+SLOW_STAGES = ("gorilla_import_roundtrip",)
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, percent):
+    """linear interpolation between the closest ranks"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(raw, parameters):
+    """latency percentiles and throughput of the raw measurements of a stage"""
+    if "error" in raw:
+        return dict(raw, parameters=parameters)
+    latencies = raw["latencies"]
+    total = sum(latencies)
+    latency = {"min": min(latencies), "mean": total / len(latencies), "max": max(latencies)}
+    latency.update((f"p{percent}", percentile(latencies, percent)) for percent in PERCENTILES)
+    return {
+        "stage": raw["stage"],
+        "processor": raw["processor"],
+        "iterations": len(latencies),
+        "latency_seconds": {key: round(value, 6) for key, value in latency.items()},
+        "throughput": {
+            "ops_per_second": round(len(latencies) / total, 3) if total else None,
+            "bytes_per_second": (
+                round(raw["bytes_per_op"] * len(latencies) / total) if total else None
+            ),
+        },
+        "bytes_per_op": raw["bytes_per_op"],
+        "peak_rss_bytes": raw["peak_rss_bytes"],
+        "peak_children_rss_bytes": raw["peak_children_rss_bytes"],
+        "parameters": parameters,
+    }
+
+
+def generate_fixtures(workdir, args, base_url):
+    """writes every fixture below workdir, returns the stage parameters"""
+    www = os.path.join(workdir, "www")
+    payload = args.payload_mb << 20
+    params = {
+        "workdir": workdir,
+        "base_url": base_url,
+        "iterations": args.iterations,
+        "sucatalog": write_sucatalog(www, base_url, args.products, args.installers),
+        "msi": os.path.join(workdir, "Zoom.msi"),
+        "exe": os.path.join(workdir, "Nessus.exe"),
+        "tools": write_fake_tools(os.path.join(workdir, "bin")),
+        "batch_dir": os.path.join(workdir, "batch"),
+        "batch_workers": args.batch_workers,
+        "catalog_entries": args.catalog_entries,
+        "gorilla_repo": os.path.join(workdir, "gorilla"),
+        "gorilla_installers": [],
+    }
+    build_msi(
+        params["msi"],
+        {"ProductName": "Zoom (64-bit)", "ProductVersion": "5.17.11.34827"},
+        payload_size=payload,
+    )
+    build_pe(
+        params["exe"],
+        {"ProductName": "Nessus Agent", "ProductVersion": "10.6.1"},
+        "10.6.1.0",
+        payload_size=payload,
+    )
+    os.makedirs(params["batch_dir"])
+    for number in range(args.batch_files):
+        build_msi(
+            os.path.join(params["batch_dir"], f"App{number}.msi"),
+            {"ProductName": f"App {number}", "ProductVersion": f"1.0.{number}"},
+            payload_size=payload // max(1, args.batch_files),
+        )
+    write_gorilla_repo(params["gorilla_repo"], args.catalog_entries)
+    # One distinct installer per iteration, each import is a new version.
+    for number in range(args.iterations):
+        params["gorilla_installers"].append(
+            write_installer(
+                os.path.join(workdir, f"gorilla-{number}.msi"),
+                args.gorilla_payload_mb << 20,
+                seed=number,
+            )
+        )
+    return params
+
+
+def start_server(root, latency):
+    """starts the fixture server, returns the process and its base URL"""
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "fixtures.server", root, "--latency", str(latency)],
+        cwd=BENCHMARKS,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    port = server.stdout.readline().strip()
+    if not port:
+        server.kill()
+        raise RuntimeError("The fixture server did not start.")
+    return server, f"http://127.0.0.1:{port}"
+
+
+def run_stage(name, params):
+    """runs a stage in its own process and returns its summary"""
+    result = subprocess.run(
+        [sys.executable, os.path.join(BENCHMARKS, "stages.py"), name, json.dumps(params)],
+        cwd=params["workdir"],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+    if result.returncode:
+        return {"stage": name, "processor": STAGES[name][0],
+                "error": f"exited with {result.returncode}"}
+    return summarize(json.loads(result.stdout), {
+        key: params[key] for key in ("iterations",) if key in params
+    })
+
+
+def main(argv=None):
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("stages", nargs="*", metavar="STAGE",
+                        help=f"one of {', '.join(STAGES)}; "
+                        f"all but {', '.join(SLOW_STAGES)} by default")
+    parser.add_argument("--output", help="write the results here instead of stdout")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--products", type=int, default=5000, help="sucatalog products")
+    parser.add_argument("--installers", type=int, default=40, help="macOS installer products")
+    parser.add_argument("--payload-mb", type=int, default=64, help=".msi/.exe fixture size")
+    parser.add_argument("--batch-files", type=int, default=8)
+    parser.add_argument("--batch-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--catalog-entries", type=int, default=1000)
+    parser.add_argument("--gorilla-payload-mb", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the server adds to every request")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.stages if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    stages = args.stages or [name for name in STAGES if name not in SLOW_STAGES]
+
+    workdir = tempfile.mkdtemp(prefix="shared-processors-bench-")
+    os.makedirs(os.path.join(workdir, "www"))
+    server, base_url = start_server(os.path.join(workdir, "www"), args.latency)
+    try:
+        started = time.perf_counter()
+        params = generate_fixtures(workdir, args, base_url)
+        print(f"Fixtures generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        results = []
+        for name in stages:
+            results.append(run_stage(name, params))
+            summary = results[-1]
+            if "error" in summary:
+                print(f"{name:<30} error: {summary['error']}", file=sys.stderr)
+                continue
+            print(
+                f"{name:<30} p50 {summary['latency_seconds']['p50'] * 1000:9.1f} ms"
+                f"  p99 {summary['latency_seconds']['p99'] * 1000:9.1f} ms"
+                f"  {summary['throughput']['bytes_per_second'] / 1048576:8.1f} MiB/s"
+                f"  peak RSS {summary['peak_rss_bytes'] / 1048576:6.1f} MiB",
+                file=sys.stderr,
+            )
+    finally:
+        server.terminate()
+        server.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key not in ("stages", "output", "keep")
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0 if all("error" not in result for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+The benchmark stages. Each one drives a shared processor through the
+benchmark autopkglib against the fixtures run_benchmarks.py generated, and
+is run in a process of its own so its peak RSS is its own:
+
+    python stages.py STAGE PARAMETERS_JSON
+
+prints one JSON object with the latencies of every iteration and the peak
+RSS of the process and of its children (fake tools, worker processes).
+"""
+
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+# The stand-in autopkglib next to this file wins over an installed one.
+sys.path[:0] = [BENCHMARKS, os.path.join(os.path.dirname(BENCHMARKS), "SharedProcessors")]
+
+from autopkglib import ProcessorError  # pylint: disable=import-error,wrong-import-position
+
+__all__ = ["STAGES", "run_stage"]
+
+
+def rusage_peak_rss(who):
+    """ru_maxrss in bytes, Linux reports kilobytes and macOS bytes"""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def peak_rss():
+    """
+    peak resident set size of this process in bytes. Linux keeps ru_maxrss across
+    fork and exec, it would report the runner's peak from building the fixtures,
+    VmHWM is this process's own.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return rusage_peak_rss(resource.RUSAGE_SELF)
+
+
+def measure(run, iterations, before=None, after=None):
+    """
+    seconds taken by each of iterations calls of run, before and after are called
+    untimed around every call
+    """
+    latencies = []
+    for iteration in range(iterations):
+        if before:
+            before(iteration)
+        started = time.perf_counter()
+        run(iteration)
+        latencies.append(time.perf_counter() - started)
+        if after:
+            after(iteration)
+    return latencies
+
+
+def forget_digests(_iteration=None):
+    """
+    empties the digests memo, every iteration would otherwise reuse the sha256 the
+    first one computed for the same fixture
+    """
+    from SharedProcessorsLib import digests  # pylint: disable=import-outside-toplevel,import-error
+
+    digests._results.clear()  # pylint: disable=protected-access
+
+
+def check_hashed(pathnames):
+    """an after hook making sure every iteration hashed pathnames itself"""
+    from SharedProcessorsLib import digests  # pylint: disable=import-outside-toplevel,import-error
+
+    def after(iteration):
+        # The memo was emptied before the iteration and the metadata cache is off, an
+        # entry can only come from hashing the file, here or in a batch worker.
+        for pathname in pathnames:
+            if digests.file_identity(pathname) not in digests._results:  # pylint: disable=protected-access
+                raise RuntimeError(f"Iteration {iteration} did not hash {pathname}")
+
+    return after
+
+
+def run_processor(processor_class, env):
+    """runs a processor the way AutoPkg would and returns its environment"""
+    processor = processor_class(dict(env))
+    processor.process()
+    return processor.env
+
+
+def getinstallmacosmetadata(params, cache="cold", streaming=True):
+    """GetInstallmacOSMetadata against the local sucatalog"""
+    from GetInstallmacOSMetadata import GetInstallmacOSMetadata  # pylint: disable=import-outside-toplevel
+
+    work = tempfile.mkdtemp(dir=params["workdir"])
+    env = {
+        "SUCATALOG_URL": f"{params['base_url']}/index.sucatalog",
+        "SUCATALOG_STREAMING": streaming,
+        "SUCATALOG_CACHE_DIR": os.path.join(work, "cache"),
+    }
+
+    def before(iteration):
+        if cache == "cold":
+            env["SUCATALOG_CACHE_DIR"] = os.path.join(work, f"cache{iteration}")
+
+    if cache == "warm":
+        run_processor(GetInstallmacOSMetadata, env)
+    latencies = measure(
+        lambda _: run_processor(GetInstallmacOSMetadata, env), params["iterations"], before
+    )
+    return latencies, os.path.getsize(params["sucatalog"])
+
+
+def winversioner(params, extension, reader="native", cached=False):
+    """WinVersioner on a single .msi or .exe fixture"""
+    from SharedProcessorsLib import wininstaller  # pylint: disable=import-outside-toplevel,import-error
+    from WinVersioner import WinVersioner  # pylint: disable=import-outside-toplevel
+
+    if reader == "subprocess":
+        # Point the subprocess reader at the fake tools instead of Homebrew's.
+        wininstaller._proc_arch = "i386"  # pylint: disable=protected-access
+        for tool_extension, path in params["tools"].items():
+            wininstaller.BINARIES[tool_extension]["i386"] = path
+    pathname = params[extension]
+    cache_path = os.path.join(tempfile.mkdtemp(dir=params["workdir"]), "WinVersioner.json")
+    env = {
+        "pathname": pathname,
+        "metadata_reader": reader,
+        "metadata_cache_path": cache_path if cached else "",
+    }
+    if cached:
+        # Measures the cache hit, there is nothing left to hash.
+        run_processor(WinVersioner, env)
+        latencies = measure(
+            lambda _: run_processor(WinVersioner, env), params["iterations"], forget_digests
+        )
+    else:
+        latencies = measure(
+            lambda _: run_processor(WinVersioner, env),
+            params["iterations"],
+            forget_digests,
+            check_hashed([pathname]),
+        )
+    return latencies, os.path.getsize(pathname)
+
+
+def winversioner_batch(params):
+    """WinVersioner with batch_paths over a directory of installers"""
+    from WinVersioner import WinVersioner  # pylint: disable=import-outside-toplevel
+
+    env = {
+        "batch_paths": [params["batch_dir"]],
+        "batch_max_workers": params["batch_workers"],
+        "metadata_cache_path": "",
+    }
+    pathnames = [
+        os.path.join(params["batch_dir"], name) for name in sorted(os.listdir(params["batch_dir"]))
+    ]
+    size = sum(os.path.getsize(pathname) for pathname in pathnames)
+    # Workers are forked, an emptied memo is what they start with.
+    latencies = measure(
+        lambda _: run_processor(WinVersioner, env),
+        params["iterations"],
+        forget_digests,
+        check_hashed(pathnames),
+    )
+    return latencies, size
+
+
+def gorilla_import(params, changed=True, patching=True):
+    """GorillaImporter importing into the synthetic N entry catalog"""
+    from GorillaImporter import GorillaImporter  # pylint: disable=import-outside-toplevel
+
+    repo = os.path.join(tempfile.mkdtemp(dir=params["workdir"]), "repo")
+    shutil.copytree(params["gorilla_repo"], repo)
+    installers = params["gorilla_installers"]
+    env = {
+        "gorilla_repo": repo,
+        "gorilla_catalog": "alpha",
+        "gorilla_subdirectories": "apps",
+        "gorilla_catalog_patching": patching,
+        "pkg_file_extension": "msi",
+    }
+
+    def before(iteration):
+        # A new version of an existing entry, or the same one over and over.
+        number = iteration if changed else 0
+        env.update(
+            pathname=installers[number % len(installers)],
+            pkg_shortname=f"App{number % params['catalog_entries']:05d}",
+            pkg_version=f"99.0.{number}",
+        )
+
+    if not changed:
+        before(0)
+        run_processor(GorillaImporter, env)
+    latencies = measure(lambda _: run_processor(GorillaImporter, env), params["iterations"], before)
+    return latencies, os.path.getsize(installers[0])
+
+
+# Stage name: (processor, function, keyword arguments)
+STAGES = {
+    "sucatalog_cold": ("GetInstallmacOSMetadata", getinstallmacosmetadata, {}),
+    "sucatalog_warm": ("GetInstallmacOSMetadata", getinstallmacosmetadata, {"cache": "warm"}),
+    "sucatalog_plistlib": (
+        "GetInstallmacOSMetadata", getinstallmacosmetadata, {"streaming": False},
+    ),
+    "winversioner_msi_native": ("WinVersioner", winversioner, {"extension": "msi"}),
+    "winversioner_exe_native": ("WinVersioner", winversioner, {"extension": "exe"}),
+    "winversioner_msi_subprocess": (
+        "WinVersioner", winversioner, {"extension": "msi", "reader": "subprocess"},
+    ),
+    "winversioner_exe_subprocess": (
+        "WinVersioner", winversioner, {"extension": "exe", "reader": "subprocess"},
+    ),
+    "winversioner_msi_cached": (
+        "WinVersioner", winversioner, {"extension": "msi", "cached": True},
+    ),
+    "winversioner_batch": ("WinVersioner", winversioner_batch, {}),
+    "gorilla_import_changed": ("GorillaImporter", gorilla_import, {}),
+    "gorilla_import_unchanged": ("GorillaImporter", gorilla_import, {"changed": False}),
+    "gorilla_import_roundtrip": (
+        "GorillaImporter", gorilla_import, {"patching": False},
+    ),
+}
+
+
+def run_stage(name, params):
+    """runs one stage, returns its raw measurements"""
+    processor, function, kwargs = STAGES[name]
+    try:
+        latencies, bytes_per_op = function(params, **kwargs)
+    except (ProcessorError, RuntimeError) as err:
+        return {"stage": name, "processor": processor, "error": str(err)}
+    return {
+        "stage": name,
+        "processor": processor,
+        "latencies": latencies,
+        "bytes_per_op": bytes_per_op,
+        "peak_rss_bytes": peak_rss(),
+        # Children inherit ru_maxrss too, on Linux this is at least the stage's own
+        # peak at the time it started them.
+        "peak_children_rss_bytes": rusage_peak_rss(resource.RUSAGE_CHILDREN),
+    }
+
+
+if __name__ == "__main__":
+    # Anything the processors print goes to stderr, stdout is for the result.
+    RESULT_STREAM, sys.stdout = sys.stdout, sys.stderr
+    json.dump(run_stage(sys.argv[1], json.loads(sys.argv[2])), RESULT_STREAM)
@@ -0,0 +1,159 @@
+"""
+URLDownloader against the benchmark fixture server: an interrupted download
+resumes where it stopped, an unchanged file isn't downloaded again and a
+payload with the wrong digest is thrown away.
+
+    python -m unittest discover tests
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The stand-in autopkglib and the fixtures live with the benchmarks.
+sys.path[:0] = [os.path.join(REPO_ROOT, "benchmarks"), os.path.join(REPO_ROOT, "SharedProcessors")]
+
+from autopkglib import ProcessorError  # pylint: disable=import-error,wrong-import-position
+from fixtures.server import FixtureHandler, serve  # pylint: disable=import-error,wrong-import-position
+from SharedProcessorsLib import rangefetch  # pylint: disable=import-error,wrong-import-position
+from URLDownloader import URLDownloader  # pylint: disable=import-error,wrong-import-position
+
+PAYLOAD_SIZE = 1 << 20
+SEGMENT_SIZE = 64 << 10
+
+
+class CountingHandler(FixtureHandler):
+    """
+    Records every request, cuts range answers short or answers with a bad
+    status line while the server is told to.
+    """
+
+    def send_body(self, status, headers, body):
+        self.server.requests.append((self.headers.get("Range"), status))
+        if status == 206 and len(body) > 1 and self.server.garble:
+            self.server.garble -= 1
+            self.close_connection = True
+            self.wfile.write(b"garbage\r\n\r\n")
+            return
+        if status == 206 and len(body) > 1 and self.server.truncate:
+            # Promise the whole range, send half of it and hang up.
+            self.server.truncate -= 1
+            self.close_connection = True
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[: len(body) // 2])
+            return
+        super().send_body(status, headers, body)
+
+
+class URLDownloaderTest(unittest.TestCase):
+    """URLDownloader with several Range segments on a local server."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, "www"))
+        self.payload = os.urandom(PAYLOAD_SIZE)
+        with open(os.path.join(self.root, "www", "InstallAssistant.pkg"), "wb") as f:
+            f.write(self.payload)
+
+        self.server = serve(os.path.join(self.root, "www"))
+        self.server.RequestHandlerClass = CountingHandler
+        self.server.requests = []
+        self.server.truncate = 0
+        self.server.garble = 0
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        # Several segments out of a small payload, no waiting between retries.
+        for name, value in (("MIN_SEGMENT_SIZE", SEGMENT_SIZE), ("CHUNK_SIZE", 16 << 10)):
+            patcher = mock.patch.object(rangefetch, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(rangefetch.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pathname = os.path.join(self.root, "downloads", "InstallAssistant.pkg")
+
+    def download(self, **env):
+        """runs URLDownloader, returns its environment"""
+        env = dict(
+            {
+                "url": f"http://127.0.0.1:{self.server.server_address[1]}/InstallAssistant.pkg",
+                "download_dir": os.path.dirname(self.pathname),
+                "download_segments": 4,
+                "download_retries": 0,
+                "expected_size": str(PAYLOAD_SIZE),
+                "expected_digest": hashlib.sha1(self.payload).hexdigest().upper(),
+            },
+            **env,
+        )
+        return URLDownloader(env).process()
+
+    def downloaded(self):
+        """bytes asked for in range requests since the last call"""
+        sent = 0
+        for byte_range, status in self.server.requests:
+            if status == 206:
+                start, _, end = byte_range[len("bytes="):].partition("-")
+                sent += int(end) - int(start) + 1
+        self.server.requests = []
+        return sent
+
+    def test_resume_after_interruption(self):
+        self.server.truncate = 4
+        with self.assertRaises(ProcessorError):
+            self.download()
+        self.assertFalse(os.path.exists(self.pathname))
+        self.assertTrue(os.path.exists(f"{self.pathname}.part"))
+        self.assertTrue(os.path.exists(f"{self.pathname}.download.json"))
+        self.downloaded()
+
+        env = self.download()
+        self.assertTrue(env["download_changed"])
+        with open(self.pathname, "rb") as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertFalse(os.path.exists(f"{self.pathname}.part"))
+        # Only the rest of the interrupted segments was asked for again.
+        self.assertLess(self.downloaded(), PAYLOAD_SIZE)
+
+    def test_retry_after_bad_status_line(self):
+        # http.client raises BadStatusLine, not an OSError, it must still be retried.
+        self.server.garble = 1
+        env = self.download(download_retries=1)
+        self.assertTrue(env["download_changed"])
+        with open(self.pathname, "rb") as f:
+            self.assertEqual(f.read(), self.payload)
+
+    def test_unchanged_rerun(self):
+        self.assertTrue(self.download()["download_changed"])
+        self.downloaded()
+        env = self.download()
+        self.assertFalse(env["download_changed"])
+        self.assertNotIn("url_downloader_summary_result", env)
+        # Only the one byte probe went over the wire.
+        self.assertEqual(self.server.requests, [("bytes=0-0", 206)])
+
+    def test_digest_mismatch(self):
+        with self.assertRaisesRegex(ProcessorError, "was expected"):
+            self.download(expected_digest="0" * 40)
+        self.assertFalse(os.path.exists(self.pathname))
+        self.assertFalse(os.path.exists(f"{self.pathname}.part"))
+        self.assertFalse(os.path.exists(f"{self.pathname}.download.json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
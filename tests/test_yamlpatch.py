@@ -0,0 +1,150 @@
+"""
+TopLevelMapping on Gorilla catalog shaped documents: untouched entries,
+comments and blank lines are written back byte for byte, and documents the
+line scan can't map raise AmbiguousYAML for a full round-trip.
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The stand-in autopkglib lives with the benchmarks.
+sys.path[:0] = [os.path.join(REPO_ROOT, "benchmarks"), os.path.join(REPO_ROOT, "SharedProcessors")]
+
+from GorillaImporter import GorillaImporter  # pylint: disable=import-error,wrong-import-position
+from ruamel.yaml import YAML  # pylint: disable=wrong-import-position
+from SharedProcessorsLib.yamlpatch import (  # pylint: disable=import-error,wrong-import-position
+    AmbiguousYAML,
+    TopLevelMapping,
+)
+
+CATALOG = """\
+# Production catalog, edited by hand too.
+
+Firefox:
+  display_name: Firefox
+  version: 120.0   # pinned
+  installer:
+    location: apps/Firefox.msi
+    hash: aaaa
+
+# Chrome moves to the MSI below.
+Chrome:
+  display_name: Google Chrome
+  version: '119.0'
+  installer:
+    location: apps/Chrome.msi
+    hash: bbbb
+
+
+Zoom:
+  display_name: Zoom
+  version: 5.16.0
+"""
+
+
+class TopLevelMappingTest(unittest.TestCase):
+    """Patching entries of a catalog in place."""
+
+    def setUp(self):
+        self.yaml = YAML()
+
+    def mapping(self, text):
+        """the TopLevelMapping of text"""
+        return TopLevelMapping(text, self.yaml)
+
+    def test_unchanged_document_is_kept(self):
+        catalog = self.mapping(CATALOG)
+        self.assertEqual(catalog.keys(), ["Firefox", "Chrome", "Zoom"])
+        self.assertEqual(catalog["Chrome"]["version"], "119.0")
+        # Read but not assigned, so not re-serialized.
+        self.assertEqual(catalog.render(), CATALOG)
+
+    def test_changed_entry_is_replaced_in_place(self):
+        catalog = self.mapping(CATALOG)
+        entry = catalog["Chrome"]
+        entry["version"] = "120.0"
+        entry["installer"]["hash"] = "cccc"
+        catalog["Chrome"] = entry
+        rendered = catalog.render()
+
+        self.assertEqual(
+            rendered,
+            CATALOG.replace("version: '119.0'", "version: '120.0'").replace("hash: bbbb", "hash: cccc"),
+        )
+        # The comments and blank lines around it are still there.
+        self.assertIn("# Chrome moves to the MSI below.\nChrome:\n", rendered)
+        self.assertIn("    hash: cccc\n\n\nZoom:\n", rendered)
+        self.assertEqual(self.yaml.load(rendered)["Chrome"]["installer"]["hash"], "cccc")
+
+    def test_new_entry_is_appended(self):
+        catalog = self.mapping(CATALOG)
+        catalog["Slack"] = {"display_name": "Slack", "version": "4.35"}
+        rendered = catalog.render()
+
+        self.assertTrue(rendered.startswith(CATALOG))
+        self.assertEqual(rendered[len(CATALOG):], "Slack:\n  display_name: Slack\n  version: '4.35'\n")
+        self.assertEqual(list(self.yaml.load(rendered)), ["Firefox", "Chrome", "Zoom", "Slack"])
+
+    def test_new_entry_after_missing_final_newline(self):
+        catalog = self.mapping(CATALOG.rstrip("\n"))
+        catalog["Slack"] = {"version": "4.35"}
+        self.assertTrue(catalog.render().endswith("version: 5.16.0\nSlack:\n  version: '4.35'\n"))
+
+    def test_ambiguous_documents(self):
+        documents = {
+            "empty file": "",
+            "comments only": "# nothing yet\n",
+            "column 0 sequence": "- Firefox\n- Chrome\n",
+            "sequence value at column 0": "Firefox:\n- 120.0\n",
+            "quoted key": '"Firefox":\n  version: 120.0\n',
+            "single quoted key": "'Chrome':\n  version: 119.0\n",
+            "non string key": "yes:\n  version: 1\n",
+            "flow mapping": "{Firefox: {version: 120.0}}\n",
+            "inline value": "Firefox: 120.0\n",
+            "anchor": "Firefox: &ff\n  version: 120.0\nESR:\n  <<: *ff\n",
+            "tag": "Firefox: !custom\n  version: 120.0\n",
+            "duplicate key": "Firefox:\n  a: 1\nFirefox:\n  a: 2\n",
+            "multiple documents": "Firefox:\n  a: 1\n---\nChrome:\n  a: 2\n",
+            "CRLF": CATALOG.replace("\n", "\r\n"),
+            "byte order mark": "\ufeff" + CATALOG,
+        }
+        for name, text in documents.items():
+            with self.subTest(name):
+                with self.assertRaises(AmbiguousYAML):
+                    self.mapping(text)
+
+    def test_crlf_catalog_keeps_its_line_endings(self):
+        # Patched entries would be re-serialized with \n between \r\n lines, so
+        # TopLevelMapping refuses CR and GorillaImporter reads with universal
+        # newlines, patches, and writes the file back with \r\n throughout.
+        with self.assertRaisesRegex(AmbiguousYAML, "CR line endings"):
+            self.mapping(CATALOG.replace("\n", "\r\n"))
+
+        repo = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, repo)
+        os.makedirs(os.path.join(repo, "catalogs"))
+        catalog_path = os.path.join(repo, "catalogs", "alpha.yaml")
+        with open(catalog_path, "wb") as f:
+            f.write(CATALOG.replace("\n", "\r\n").encode())
+        importer = GorillaImporter({"gorilla_repo": repo, "gorilla_catalog": "alpha"})
+        importer.yaml_file = catalog_path
+        catalog = importer.yaml_to_dict()
+        self.assertIsInstance(catalog, TopLevelMapping)
+        catalog["Slack"] = {"version": "4.35"}
+        importer.write_out_catalog(catalog)
+
+        with open(catalog_path, "rb") as f:
+            written = f.read()
+        self.assertEqual(written.count(b"\n"), written.count(b"\r\n"))
+        self.assertTrue(written.startswith(CATALOG.replace("\n", "\r\n").encode()))
+        self.assertTrue(written.endswith(b"Slack:\r\n  version: '4.35'\r\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,527 @@
+#!/usr/local/autopkg/python
+#
+# Copyright 2022 Alex Alequin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Runs the recipes of this repo in parallel with `autopkg run`.
+
+The ParentRecipe chains are resolved first: a recipe whose parent is also
+selected starts once the parent succeeded, and is skipped if it failed.
+Independent chains share a pool of workers, limited per resource:
+
+- one recipe at a time per Gorilla catalog (GorillaImporter),
+- one recipe at a time per Munki repo (MunkiImporter),
+- one recipe at a time installing on this machine (Installer, InstallFromDMG),
+- --downloads recipes downloading at once (URLDownloader).
+
+Every run ends with a wall clock report. Its critical path follows, from the
+last recipe to finish, the recipe whose completion let each one start; that
+is the chain to shorten to make the whole run faster.
+
+Every recipe that succeeds is acknowledged in FreshnessProbe's state
+(--freshness-state), so the changes it was flagged for count as seen.
+
+The flattened chains are compiled into a cache (--cache), so listing,
+validating and launching parse only the recipes that changed since the last
+time; `compile` just refreshes it.
+
+    run_recipes.py compile
+    run_recipes.py list [RECIPE, DIRECTORY or IDENTIFIER ...]
+    run_recipes.py validate [...]
+    run_recipes.py run [--jobs N] [--downloads N] [-k KEY=VALUE] [--dry-run] [...]
+"""
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import os
+import plistlib
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "SharedProcessors"))
+from SharedProcessorsLib.freshness import (  # pylint: disable=import-error,wrong-import-position
+    FreshnessProbe,
+    substitute,
+)
+from SharedProcessorsLib.recipes import (  # pylint: disable=import-error,wrong-import-position
+    RecipeError,
+    flatten_recipe,
+    processor_name,
+    select_recipes,
+    shared_processors,
+)
+
+SHARED_PROCESSORS = "com.github.arequ.SharedProcessors"
+AUTOPKG_PREFERENCES = os.path.expanduser("~/Library/Preferences/com.github.autopkg.plist")
+DEFAULT_CACHE = os.path.expanduser(
+    "~/Library/AutoPkg/Cache/com.github.arequ.SharedProcessors/recipe_chains.json"
+)
+DEFAULT_FRESHNESS_STATE = os.path.expanduser(
+    "~/Library/AutoPkg/Cache/com.github.arequ.SharedProcessors/FreshnessProbe.json"
+)
+DOWNLOAD_PROCESSORS = ("URLDownloader", "URLDownloaderPython", "CURLDownloader")
+INSTALL_PROCESSORS = ("Installer", "InstallFromDMG")
+KEY_VALUE = re.compile(r"^([A-Za-z_]\w*)=(.*)$", re.DOTALL)
+
+
+def autopkg_preferences():
+    """AutoPkg's preferences, for MUNKI_REPO and friends, empty if unreadable"""
+    try:
+        with open(AUTOPKG_PREFERENCES, "rb") as f:
+            return plistlib.load(f)
+    except (OSError, plistlib.InvalidFileException, ValueError):
+        return {}
+
+
+def recipe_resources(recipe, variables, inherited=0):
+    """
+    the resources a flattened recipe holds while it runs, "download" plus one
+    lock per Gorilla catalog, Munki repo or the local installer it touches;
+    the downloads of the first inherited steps, run by a parent job that
+    finished before, don't count
+    """
+    variables = dict(variables, **recipe["Input"])
+
+    def resolve(value, default):
+        value = str(value if value is not None else default)
+        return substitute(value, variables) or value
+
+    resources = set()
+    for index, step in enumerate(recipe["Process"]):
+        name = processor_name(step)
+        arguments = step.get("Arguments") or {}
+        if name in DOWNLOAD_PROCESSORS:
+            if index >= inherited:
+                resources.add("download")
+        elif name in INSTALL_PROCESSORS:
+            resources.add("installer")
+        elif name == "MunkiImporter":
+            repo = resolve(arguments.get("MUNKI_REPO"), "%MUNKI_REPO%")
+            resources.add(f"munki:{repo}")
+        elif name == "GorillaImporter":
+            repo = resolve(arguments.get("gorilla_repo"), "%GORILLA_REPO%").rstrip("/")
+            catalog = resolve(arguments.get("gorilla_catalog"), "%GORILLA_CATALOG%")
+            resources.add(f"gorilla:{repo}/catalogs/{catalog}.yaml")
+    return sorted(resources)
+
+
+def missing_shared_processors(processors):
+    """the shared processors of a recipe that aren't in this repo"""
+    return [
+        processor for processor in processors
+        if processor.startswith(SHARED_PROCESSORS + "/")
+        and not os.path.isfile(
+            os.path.join(REPO_ROOT, "SharedProcessors", f"{processor.rsplit('/', 1)[1]}.py")
+        )
+    ]
+
+
+class Job:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """One recipe run and what it waits for."""
+
+    def __init__(self, identifier, path, recipe, resources):
+        self.identifier = identifier
+        self.path = path
+        self.recipe = recipe
+        self.resources = resources
+        self.parents = []
+        self.children = []
+        self.status = "pending"
+        self.returncode = None
+        self.ready = None
+        self.start = None
+        self.end = None
+        self.blocked_by = None
+        self.log = None
+
+    def report(self, started):
+        """the job as a dictionary with times relative to the start of the run"""
+
+        def relative(value):
+            return None if value is None else round(value - started, 3)
+
+        return {
+            "identifier": self.identifier,
+            "path": self.path,
+            "status": self.status,
+            "returncode": self.returncode,
+            "resources": self.resources,
+            "parents": [parent.identifier for parent in self.parents],
+            "ready": relative(self.ready),
+            "start": relative(self.start),
+            "end": relative(self.end),
+            "seconds": (
+                round(self.end - self.start, 3) if None not in (self.start, self.end) else None
+            ),
+            "waited": (
+                round(self.start - self.ready, 3) if None not in (self.start, self.ready) else None
+            ),
+            "blocked_by": self.blocked_by.identifier if self.blocked_by else None,
+            "log": self.log,
+        }
+
+
+def plan(selectors, variables, cache_path=None):
+    """the jobs of the selected recipes with their parents wired up, and resolve errors"""
+    recipes, selected = select_recipes(selectors, REPO_ROOT, cache_path)
+    jobs = {}
+    errors = {}
+    for identifier in selected:
+        entry = recipes[identifier]
+        if "error" in entry:
+            errors[identifier] = entry["error"]
+            continue
+        try:
+            recipe = entry.get("flattened") or flatten_recipe(identifier, recipes)
+        except RecipeError as err:
+            errors[identifier] = str(err)
+            continue
+        if not recipe["Process"]:
+            # Nothing to run, e.g. SharedProcessors.recipe.yaml.
+            continue
+        missing = missing_shared_processors(
+            entry.get("shared_processors") or shared_processors(recipe)
+        )
+        if missing:
+            errors[identifier] = f"uses missing shared processors {', '.join(missing)}"
+            continue
+        jobs[identifier] = Job(identifier, recipes[identifier]["path"], recipe, [])
+    for job in jobs.values():
+        # The closest selected ancestor, a chain may skip an unselected layer.
+        for parent in job.recipe["ParentRecipes"][::-1]:
+            if parent in jobs:
+                job.parents.append(jobs[parent])
+                jobs[parent].children.append(job)
+                break
+        # Process lists are concatenated parent first, the parent job already
+        # downloaded what its steps fetch, so the child finds it in the cache.
+        inherited = len(job.parents[0].recipe["Process"]) if job.parents else 0
+        job.resources = recipe_resources(job.recipe, variables, inherited)
+    return list(jobs.values()), errors
+
+
+def priorities(jobs, history):
+    """
+    the longest chain of expected seconds from each job to the end of its tree,
+    jobs on long chains start first; unknown durations count as one second
+    """
+    longest = {}
+
+    def chain(job):
+        if job.identifier not in longest:
+            longest[job.identifier] = history.get(job.identifier, 1.0) + max(
+                (chain(child) for child in job.children), default=0.0
+            )
+        return longest[job.identifier]
+
+    for job in jobs:
+        chain(job)
+    return longest
+
+
+class Runner:
+    """Schedules jobs on a pool of workers within the resource limits."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, jobs, command, log_dir, max_workers=4, downloads=2, history=None,
+        freshness_state=None,
+    ):
+        self.jobs = jobs
+        self.command = command
+        self.log_dir = log_dir
+        self.freshness_state = freshness_state
+        self.max_workers = max(1, int(max_workers))
+        self.limits = {"download": max(1, int(downloads))}
+        self.priority = priorities(jobs, history or {})
+        self.held = {}
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.started = None
+
+    def limit(self, resource):
+        """how many jobs may hold resource at once"""
+        return self.limits.get(resource, 1)
+
+    def available(self, job):
+        """whether every resource of job has a free slot"""
+        return all(self.held.get(resource, 0) < self.limit(resource) for resource in job.resources)
+
+    def acquire(self, job, delta):
+        """takes (1) or releases (-1) the resources of job"""
+        for resource in job.resources:
+            self.held[resource] = self.held.get(resource, 0) + delta
+
+    def execute(self, job):
+        """runs one recipe, returns its exit code"""
+        job.log = os.path.join(self.log_dir, f"{job.identifier}.log")
+        with open(job.log, "wb") as log:
+            process = subprocess.Popen(  # pylint: disable=consider-using-with
+                self.command + [job.path],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+            )
+            with self.lock:
+                self.processes[job.identifier] = process
+            try:
+                return process.wait()
+            finally:
+                with self.lock:
+                    del self.processes[job.identifier]
+
+    def acknowledge(self, job, log):
+        """marks the changes FreshnessProbe flagged for job as seen"""
+        if not self.freshness_state or not os.path.exists(self.freshness_state):
+            return
+        try:
+            FreshnessProbe(self.freshness_state).acknowledge([job.identifier])
+        except OSError as err:
+            log(f"error  {job.identifier}: unable to update {self.freshness_state}: {err}")
+
+    def skip(self, job, reason):
+        """skips job and everything below it"""
+        for child in job.children:
+            if child.status == "pending":
+                child.status = "skipped"
+                child.blocked_by = reason
+                self.skip(child, reason)
+
+    def run(self, log=print):
+        """runs every job, returns the report"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.started = time.monotonic()
+        for job in self.jobs:
+            if not job.parents:
+                job.ready = self.started
+        running = {}
+        trigger = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while True:
+                    ready = sorted(
+                        (
+                            job for job in self.jobs
+                            if job.status == "pending"
+                            and all(parent.status == "succeeded" for parent in job.parents)
+                        ),
+                        key=lambda job: -self.priority[job.identifier],
+                    )
+                    for job in ready:
+                        if len(running) >= self.max_workers:
+                            break
+                        if not self.available(job):
+                            continue
+                        self.acquire(job, 1)
+                        job.status = "running"
+                        job.start = time.monotonic()
+                        job.blocked_by = trigger
+                        log(f"start  {job.identifier}")
+                        running[executor.submit(self.execute, job)] = job
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in sorted(done, key=lambda future: running[future].identifier):
+                        job = running.pop(future)
+                        job.end = time.monotonic()
+                        self.acquire(job, -1)
+                        try:
+                            job.returncode = future.result()
+                        except OSError as err:
+                            job.returncode = -1
+                            log(f"error  {job.identifier}: {err}")
+                        job.status = "succeeded" if job.returncode == 0 else "failed"
+                        log(f"{job.status[:6]:<6} {job.identifier} ({job.end - job.start:.1f}s)")
+                        if job.status == "failed":
+                            self.skip(job, job)
+                        else:
+                            self.acknowledge(job, log)
+                        for child in job.children:
+                            if child.status == "pending":
+                                child.ready = job.end
+                        trigger = job
+            except KeyboardInterrupt:
+                with self.lock:
+                    for process in self.processes.values():
+                        process.terminate()
+                raise
+        return self.report()
+
+    @staticmethod
+    def blocked_on(job):
+        """what job waited for: its parent, a resource or a free worker"""
+        if job.blocked_by is None:
+            return None
+        if job.blocked_by in job.parents:
+            return "parent"
+        shared = sorted(set(job.resources) & set(job.blocked_by.resources))
+        return ", ".join(shared) if shared else "worker"
+
+    def report(self):
+        """wall clock, serial time and the critical path of the run"""
+        finished = [job for job in self.jobs if job.end is not None]
+        ended = max((job.end for job in finished), default=self.started)
+        critical = []
+        job = max(finished, key=lambda job: job.end, default=None)
+        while job is not None:
+            critical.append(job)
+            job = job.blocked_by if isinstance(job.blocked_by, Job) else None
+        critical.reverse()
+        return {
+            "wall_seconds": round(ended - self.started, 3),
+            "serial_seconds": round(sum(job.end - job.start for job in finished), 3),
+            "max_workers": self.max_workers,
+            "limits": self.limits,
+            "critical_path": [
+                {
+                    "identifier": job.identifier,
+                    "start": round(job.start - self.started, 3),
+                    "seconds": round(job.end - job.start, 3),
+                    "waited": round(job.start - job.ready, 3),
+                    "after": self.blocked_on(job),
+                }
+                for job in critical
+            ],
+            "jobs": [job.report(self.started) for job in self.jobs],
+        }
+
+
+def print_report(report):
+    """the report as text"""
+    print()
+    print(f"{'recipe':<52} {'status':<9} {'start':>8} {'waited':>8} {'seconds':>8}")
+    for job in sorted(report["jobs"], key=lambda job: (job["start"] is None, job["start"] or 0)):
+        print(
+            f"{job['identifier']:<52} {job['status']:<9} "
+            + " ".join(
+                f"{job[field]:>8.1f}" if job[field] is not None else f"{'-':>8}"
+                for field in ("start", "waited", "seconds")
+            )
+        )
+    wall = report["wall_seconds"]
+    serial = report["serial_seconds"]
+    print()
+    print(
+        f"Wall clock {wall:.1f}s for {serial:.1f}s of recipe runs"
+        + (f", {serial / wall:.1f}x parallel" if wall else "")
+    )
+    print("Critical path:")
+    for step in report["critical_path"]:
+        print(
+            f"  {step['start']:>8.1f}s  {step['identifier']} "
+            f"({step['seconds']:.1f}s, waited {step['waited']:.1f}s"
+            + (f" for {step['after']}" if step["after"] else "")
+            + ")"
+        )
+
+
+def load_history(report_path):
+    """recipe durations of the previous report, to start long chains first"""
+    try:
+        with open(report_path, "r") as f:
+            return {
+                job["identifier"]: job["seconds"]
+                for job in json.load(f).get("jobs", [])
+                if job.get("seconds") is not None
+            }
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def parse_keys(pairs):
+    """-k KEY=VALUE arguments as a dictionary"""
+    keys = {}
+    for pair in pairs:
+        match = KEY_VALUE.match(pair)
+        if not match:
+            raise argparse.ArgumentTypeError(f"{pair} is not KEY=VALUE")
+        keys[match.group(1)] = match.group(2)
+    return keys
+
+
+def main(argv=None):
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=("compile", "list", "validate", "run"))
+    parser.add_argument("recipes", nargs="*", help="recipe paths, directories or identifiers")
+    parser.add_argument("-k", "--key", action="append", default=[], metavar="KEY=VALUE",
+                        help="input variable passed to every recipe, also used for resources")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="recipes running at once")
+    parser.add_argument("--downloads", type=int, default=2, help="recipes downloading at once")
+    parser.add_argument("--autopkg", default="/usr/local/bin/autopkg", help="autopkg to run")
+    parser.add_argument("--autopkg-args", default="-v",
+                        help="extra autopkg run arguments, shell quoted")
+    parser.add_argument("--log-dir", default=os.path.expanduser("~/Library/Logs/AutoPkg/run_recipes"),
+                        help="directory for the per recipe logs")
+    parser.add_argument("--report", help="JSON report, also read back to order the next run")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="compiled recipe chains")
+    parser.add_argument("--no-cache", action="store_true", help="parse every recipe")
+    parser.add_argument("--freshness-state", default=DEFAULT_FRESHNESS_STATE,
+                        help="FreshnessProbe state to acknowledge succeeded recipes in, "
+                        "empty to leave it alone")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="show the jobs and their resources without running them")
+    args = parser.parse_intermixed_args(argv)
+    try:
+        keys = parse_keys(args.key)
+        jobs, errors = plan(
+            args.recipes,
+            dict(autopkg_preferences(), **keys),
+            None if args.no_cache else args.cache,
+        )
+    except (RecipeError, argparse.ArgumentTypeError) as err:
+        parser.error(str(err))
+
+    for identifier, error in sorted(errors.items()):
+        print(f"{identifier}: {error}", file=sys.stderr)
+    if args.command == "compile":
+        print(f"Compiled {len(jobs) + len(errors)} recipes into {args.cache}")
+        return 1 if errors else 0
+    if args.command == "validate":
+        print(f"{len(jobs)} recipes are valid, {len(errors)} are not.")
+        return 1 if errors else 0
+    if args.command == "list" or args.dry_run:
+        for job in jobs:
+            parents = f" after {job.parents[0].identifier}" if job.parents else ""
+            print(f"{job.identifier}{parents}\t{', '.join(job.resources) or '-'}")
+        return 1 if errors else 0
+
+    command = [args.autopkg, "run", "--search-dir", REPO_ROOT] + shlex.split(args.autopkg_args)
+    for key, value in keys.items():
+        command += ["--key", f"{key}={value}"]
+    runner = Runner(
+        jobs,
+        command,
+        args.log_dir,
+        max_workers=args.jobs,
+        downloads=args.downloads,
+        history=load_history(args.report) if args.report else None,
+        freshness_state=args.freshness_state,
+    )
+    report = runner.run()
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = [job for job in report["jobs"] if job["status"] != "succeeded"]
+    return 1 if failed or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())